@@ -0,0 +1,277 @@
+"""Time each converter stage on synthetic data and record its peak memory.
+
+Every stage runs in a fresh Python process, so its peak memory is not
+inflated by earlier stages. The peak is the largest total resident set size
+of the stage's process tree (the stage and its worker processes), sampled
+from ``/proc`` every ``SAMPLE_INTERVAL`` seconds; spikes shorter than that
+can be missed, and shared pages count once per process. Without ``/proc``
+(macOS) it falls back to the largest peak of any single process.
+
+The stages are:
+
+- ``preprocess``: first preprocessing of the raw tables, caches cleared,
+- ``preprocess-cached``: the same call again, served from the staged caches,
+- ``convert``: the whole converter, every subject rewritten (``force``).
+
+Babelbetes has no separate preprocessing and only runs ``convert``.
+
+    python benchmarks/benchmark.py --subjects 50 --days 30 --results bench.json
+    python benchmarks/benchmark.py --subjects 50 --days 30 --baseline bench.json
+
+With ``--baseline`` the run exits with status 1 if a stage got slower or
+used more memory than the baseline allows (``--tolerance``).
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import synthetic
+
+
+# the converters import their siblings (and utils_path) as top-level modules
+SCRIPTS = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+sys.path.insert(0, SCRIPTS)
+
+from diax_output import OutputOptions  # noqa: E402 (needs SCRIPTS on sys.path)
+
+# study -> (module in scripts/, preprocessing function, conversion function)
+CONVERTERS = {
+    "dclp3": ("dclp3", "preprocess_dclp3", "process_all_dclp3"),
+    "dclp5": ("dclp5", "preprocess_dclp5", "process_all_dclp5"),
+    "pedap": ("pedap", "preprocess_pedap", "process_all_pedap"),
+    "iobp2": ("iobp2", "preprocess_iobp2", "process_all_iobp2"),
+    "loop": ("loop", "preprocess_loop", "process_all_loop"),
+    "t1dexi": ("t1dexi", "preprocess_t1dexi", "process_all_t1dexi"),
+    "babelbetes": ("babelbetes_converter", None, "convert_all"),
+}
+
+# differences below these are measurement noise, whatever the tolerance
+NOISE = {"seconds": 0.1, "peak_mb": 5.0}
+
+# seconds between two samples of a stage's process tree memory
+SAMPLE_INTERVAL = 0.02
+
+
+def _peak_mb():
+    """Largest peak RSS of this process or any single finished child, in MB.
+
+    ``RUSAGE_CHILDREN`` reports the maximum of one child, not the sum over
+    the children, so with worker processes this is a lower bound of the
+    peak total; ``benchmark`` measures the total with ``_tree_rss_mb``.
+    """
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _tree_rss_mb(root):
+    """Summed current RSS of process ``root`` and all its descendants, in MB.
+
+    Returns:
+        None where ``/proc`` is not available.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    children, rss = {}, {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue  # exited while scanning
+        # the command name in parentheses may contain spaces; the fields after it do not
+        fields = stat.rsplit(")", 1)[1].split()
+        pid, ppid = int(entry), int(fields[1])
+        children.setdefault(ppid, []).append(pid)
+        rss[pid] = int(fields[21])
+    total, todo = 0, [root]
+    while todo:
+        pid = todo.pop()
+        total += rss.get(pid, 0)
+        todo.extend(children.get(pid, []))
+    return total * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _run_sampled(cmd):
+    """Run ``cmd``, sampling the RSS of its process tree while it runs.
+
+    Returns:
+        ``(completed process, peak total RSS in MB or None without /proc)``
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    peak = {"mb": None}
+
+    def sample():
+        while proc.poll() is None:
+            total = _tree_rss_mb(proc.pid)
+            if total is None:
+                return
+            peak["mb"] = max(total, peak["mb"] or 0)
+            time.sleep(SAMPLE_INTERVAL)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    stdout, _ = proc.communicate()
+    sampler.join()
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout), peak["mb"]
+
+
+def _clear_caches(source):
+    """Remove the staged caches a converter left next to its synthetic source files."""
+    for entry in os.scandir(source):
+        if entry.is_dir():
+            shutil.rmtree(entry.path)
+
+
+def convert(study, source, output, jobs=1, fmt="json"):
+    """Convert every subject of a study with its converter, in this process."""
+    module, _, function = CONVERTERS[study]
+    module = importlib.import_module(module)
+    options = OutputOptions(fmt=fmt, force=True)
+    if study == "babelbetes":
+        module.convert_all(source, output, None, jobs=jobs, options=options)
+    else:
+        getattr(module, function)(source, output, jobs=jobs, options=options)
+
+
+def run_stage(study, stage, source, output, jobs=1, fmt="json"):
+    """Run one stage in this process; returns ``(seconds, peak MB)``."""
+    t0 = time.perf_counter()
+    if stage == "convert":
+        convert(study, source, output, jobs, fmt)
+    else:
+        module, preprocess, _ = CONVERTERS[study]
+        getattr(importlib.import_module(module), preprocess)(source)
+    return time.perf_counter() - t0, _peak_mb()
+
+
+def _stages(study):
+    return ["convert"] if CONVERTERS[study][1] is None else ["preprocess", "preprocess-cached", "convert"]
+
+
+def benchmark(data, output, studies, jobs=1, fmt="json"):
+    """Benchmark the converters of ``studies`` on the synthetic sources under ``data``.
+
+    Returns:
+        list of ``{"study", "stage", "seconds", "peak_mb"}``, one per stage.
+    """
+    results = []
+    for study in studies:
+        source = os.path.join(data, study)
+        if CONVERTERS[study][1] is not None:
+            _clear_caches(source)
+        for stage in _stages(study):
+            cmd = [sys.executable, os.path.abspath(__file__), "--stage", study, stage, source,
+                   os.path.join(output, study), "--jobs", str(jobs), "--format", fmt]
+            done, tree_peak = _run_sampled(cmd)
+            if done.returncode != 0:
+                raise RuntimeError(f"{study} {stage} failed (exit {done.returncode})")
+            # the converters print progress; the measurement is the last line
+            seconds, peak = json.loads(done.stdout.strip().splitlines()[-1])
+            # the sampled total misses spikes between samples, the child's own peak does not
+            peak = max(peak, tree_peak or 0)
+            results.append({"study": study, "stage": stage, "seconds": round(seconds, 3), "peak_mb": round(peak, 1)})
+            print(f"{study:<12} {stage:<18} {seconds:9.2f} s {peak:9.1f} MB")
+    return results
+
+
+def regressions(results, baseline, tolerance=0.2):
+    """Stages of ``results`` slower or larger than ``baseline`` by more than ``tolerance``."""
+    before = {(r["study"], r["stage"]): r for r in baseline}
+    found = []
+    for result in results:
+        base = before.get((result["study"], result["stage"]))
+        if base is None:
+            continue
+        for metric in ("seconds", "peak_mb"):
+            limit = max(base[metric] * (1 + tolerance), base[metric] + NOISE[metric])
+            if result[metric] > limit:
+                found.append(f"{result['study']} {result['stage']}: {metric} {base[metric]} -> {result[metric]}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the converters on synthetic study data.")
+    parser.add_argument(
+        "--data",
+        default=None,
+        help="Directory of synthetic sources (<data>/<study>); missing studies are generated. "
+        "Default: a temporary directory.",
+    )
+    parser.add_argument(
+        "--studies",
+        default=None,
+        help=f"Comma-separated list of studies (default: all of {', '.join(CONVERTERS)}).",
+    )
+    parser.add_argument("--subjects", type=int, default=10, help="Subjects per generated study (default: 10).")
+    parser.add_argument("--days", type=float, default=14, help="Days per generated subject (default: 14).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator (default: 0).")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes per converter (default: 1).")
+    parser.add_argument("--format", default="json", help="Output format of the converters (default: json).")
+    parser.add_argument("--results", default=None, help="Write the measurements to this JSON file.")
+    parser.add_argument("--baseline", default=None, help="Results file of an earlier run to compare against.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative increase of time and peak memory over the baseline (default: 0.2).",
+    )
+    parser.add_argument("--stage", nargs=4, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        # child process of benchmark(): run one stage and report the measurement
+        print(json.dumps(run_stage(*args.stage, jobs=args.jobs, fmt=args.format)))
+        return 0
+
+    studies = [s.strip() for s in args.studies.split(",")] if args.studies else list(CONVERTERS)
+    with tempfile.TemporaryDirectory(prefix="diax-bench-") as tmp:
+        data = args.data or os.path.join(tmp, "data")
+        missing = [study for study in studies if not os.path.isdir(os.path.join(data, study))]
+        if missing:
+            print(f"Generating {', '.join(missing)} ({args.subjects} subjects, {args.days:g} days) in {data}")
+            synthetic.generate(data, missing, args.subjects, args.days, args.seed)
+        results = benchmark(data, os.path.join(tmp, "output"), studies, args.jobs, args.format)
+
+    if args.results:
+        report = {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": {"subjects": args.subjects, "days": args.days, "seed": args.seed},
+            "jobs": args.jobs,
+            "format": args.format,
+            "results": results,
+        }
+        with open(args.results, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f)["results"], args.tolerance)
+        for line in found:
+            print(f"Regression: {line}")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
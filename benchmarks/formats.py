@@ -0,0 +1,134 @@
+"""Compare the DIAX file formats on synthetic converter output.
+
+Each study is generated (``synthetic.py``), converted to JSON once, and
+every output file is then rewritten in each format of ``diax_io.FORMATS``
+(``json.zst`` only if ``zstandard`` is installed). Per study and format the
+benchmark records the total size, the time to ``load_diax`` every file and,
+for the binary format, the time to ``read_streams`` every file (typed
+columns, no Python objects per row). Times are the best of ``--repeat``
+passes over the files.
+
+    python benchmarks/formats.py --subjects 20 --days 30 --results formats.json
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import benchmark
+import synthetic
+import utils_path  # noqa: F401 (diax_io lives in utils/python; benchmark puts scripts/ on sys.path)
+from diax_binary import read_streams
+from diax_io import FORMATS, _strip_suffix, convert_file, diax_suffix, load_diax
+
+
+def available_formats():
+    """Formats of ``FORMATS`` that can be written here."""
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return [fmt for fmt in FORMATS if fmt != "json.zst"]
+    return list(FORMATS)
+
+
+def _best(function, files, repeat):
+    """Best wall time of ``repeat`` passes of ``function`` over ``files``, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for path in files:
+            function(path)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def measure(files, output, formats, repeat=3):
+    """Rewrite the JSON ``files`` in each of ``formats`` under ``output`` and time reading them back.
+
+    Returns:
+        list of ``{"format", "files", "mb", "load_s", "read_streams_s"}``,
+        ``read_streams_s`` being None for the JSON formats.
+    """
+    results = []
+    for fmt in formats:
+        directory = os.path.join(output, fmt)
+        os.makedirs(directory, exist_ok=True)
+        converted = []
+        for i, src in enumerate(files):
+            # babelbetes subjects of different studies can share a file name
+            dst = os.path.join(directory, f"{i:05d}_{_strip_suffix(os.path.basename(src))}{diax_suffix(fmt)}")
+            converted.append(convert_file(src, dst))
+        size = sum(os.path.getsize(path) for path in converted)
+        results.append({
+            "format": fmt,
+            "files": len(converted),
+            "mb": round(size / 1e6, 3),
+            "load_s": round(_best(load_diax, converted, repeat), 4),
+            "read_streams_s": round(_best(read_streams, converted, repeat), 4) if fmt == "diax" else None,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare DIAX file formats on synthetic converter output.")
+    parser.add_argument(
+        "--data",
+        default=None,
+        help="Directory of synthetic sources (<data>/<study>); missing studies are generated. "
+        "Default: a temporary directory.",
+    )
+    parser.add_argument(
+        "--studies",
+        default=None,
+        help=f"Comma-separated list of studies (default: all of {', '.join(benchmark.CONVERTERS)}).",
+    )
+    parser.add_argument("--subjects", type=int, default=10, help="Subjects per generated study (default: 10).")
+    parser.add_argument("--days", type=float, default=14, help="Days per generated subject (default: 14).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator (default: 0).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes per format; the best counts (default: 3).")
+    parser.add_argument("--results", default=None, help="Write the measurements to this JSON file.")
+    args = parser.parse_args()
+
+    studies = [s.strip() for s in args.studies.split(",")] if args.studies else list(benchmark.CONVERTERS)
+    formats = available_formats()
+    results = []
+    print(f"{'study':<12}{'format':<10}{'files':>7}{'MB':>10}{'load_diax s':>13}{'read_streams s':>16}")
+    with tempfile.TemporaryDirectory(prefix="diax-formats-") as tmp:
+        data = args.data or os.path.join(tmp, "data")
+        missing = [study for study in studies if not os.path.isdir(os.path.join(data, study))]
+        if missing:
+            synthetic.generate(data, missing, args.subjects, args.days, args.seed)
+        for study in studies:
+            converted = os.path.join(tmp, "json", study)
+            benchmark.convert(study, os.path.join(data, study), converted)
+            files = sorted(glob.glob(os.path.join(converted, "**", "*.json"), recursive=True))
+            for result in measure(files, os.path.join(tmp, "formats", study), formats, args.repeat):
+                results.append({"study": study, **result})
+                streams = "-" if result["read_streams_s"] is None else f"{result['read_streams_s']:.4f}"
+                print(
+                    f"{study:<12}{result['format']:<10}{result['files']:>7}{result['mb']:>10.3f}"
+                    f"{result['load_s']:>13.4f}{streams:>16}"
+                )
+
+    if args.results:
+        report = {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": {"subjects": args.subjects, "days": args.days, "seed": args.seed},
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.results, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
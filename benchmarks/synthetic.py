@@ -0,0 +1,407 @@
+"""Fake raw study exports for benchmarking the converters without the real data.
+
+Every generator writes the files one converter reads, with the same names,
+columns, delimiters, encodings and timestamp formats as the restricted
+source datasets, at a configurable number of subjects and days. Values are
+random walks and draws, so only the shape and size of the data are real.
+
+    python benchmarks/synthetic.py ../synthetic --subjects 200 --days 365
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# SAS datetimes count seconds from this epoch
+SAS_EPOCH = pd.Timestamp("1960-01-01")
+
+
+def _times(start, days, minutes, rng=None, jitter=0):
+    """Regular timestamps every ``minutes`` over ``days``, optionally jittered by up to ``jitter`` seconds."""
+    n = int(days * 1440 / minutes)
+    times = pd.Timestamp(start) + pd.to_timedelta(np.arange(n) * minutes, unit="min")
+    if jitter:
+        times = times + pd.to_timedelta(rng.integers(0, jitter, n), unit="s")
+    return times
+
+
+def _glucose(rng, n):
+    """A glucose trace in mg/dL (bounded random walk)."""
+    return np.clip(140 + np.cumsum(rng.normal(0, 3, n)), 40, 400).round()
+
+
+def _vendor_times(times):
+    """Jaeb vendor format: ``%m/%d/%Y %I:%M:%S %p``, with bare dates at midnight."""
+    text = pd.Series(times.strftime("%m/%d/%Y %I:%M:%S %p"))
+    midnight = (times.hour == 0) & (times.minute == 0) & (times.second == 0)
+    text[midnight] = times[midnight].strftime("%m/%d/%Y")
+    return text.to_numpy()
+
+
+def _write_table(frames, path, encoding="utf-8"):
+    """Write a pipe-delimited table with a Jaeb-style leading ``RecID`` column."""
+    df = pd.concat(frames, ignore_index=True)
+    df.insert(0, "RecID", np.arange(1, len(df) + 1))
+    df.to_csv(path, sep="|", index=False, encoding=encoding)
+
+
+def _phys_exam(rng, ids):
+    return [
+        pd.DataFrame({
+            "PtID": ids,
+            "Weight": rng.uniform(40, 200, len(ids)).round(1),
+            "WeightUnits": rng.choice(["lbs", "kg"], len(ids)),
+            "Height": rng.uniform(50, 75, len(ids)).round(1),
+            "HeightUnits": "in",
+        })
+    ]
+
+
+def _insulin(ids, name_column):
+    rows = []
+    for pt_id in ids:
+        rows.append((pt_id, "Pump", "2019-01-01", "", "Humalog"))
+        rows.append((pt_id, "Pump", "2019-03-01", "", "Novolog"))
+        rows.append((pt_id, "MDI", "2019-01-01", "", "Lantus"))
+    return [pd.DataFrame(rows, columns=["PtID", "InsRoute", "InsTypeStartDt", "InsTypeStopDt", name_column])]
+
+
+def dclp3(out, subjects=5, days=3, rng=None):
+    """DCLP3: Dexcom CGM (``%d%b%y:%H:%M:%S`` times), Tandem pump tables, UTF-16 forms."""
+    rng = rng or np.random.default_rng(0)
+    os.makedirs(out, exist_ok=True)
+    ids = list(range(1, subjects + 1))
+    cgm, basal, bolus, smbg = [], [], [], []
+    for pt_id in ids:
+        t = _times("2019-01-05", days, 5, rng, jitter=60)
+        cgm.append(pd.DataFrame({
+            "PtID": pt_id, "DataDtTm": t.strftime("%d%b%y:%H:%M:%S").str.upper(), "CGM": _glucose(rng, len(t)),
+        }))
+        tb = _times("2019-01-05", days, 60)
+        basal.append(pd.DataFrame({
+            "PtID": pt_id,
+            "DataDtTm": tb.strftime("%Y-%m-%d %H:%M:%S"),
+            "CommandedBasalRate": rng.choice([0.5, 0.75, 1.05], len(tb)),
+        }))
+        tbol = tb[::4]
+        bolus.append(pd.DataFrame({
+            "PtID": pt_id,
+            "DataDtTm": tbol.strftime("%Y-%m-%d %H:%M:%S"),
+            "BolusAmount": rng.uniform(0.1, 6, len(tbol)).round(2),
+        }))
+        tbg = tb[::6]
+        smbg.append(pd.DataFrame({
+            "PtID": pt_id, "DataDtTm": tbg.strftime("%Y-%m-%d %H:%M:%S"), "BG": _glucose(rng, len(tbg)),
+        }))
+    _write_table(cgm, os.path.join(out, "cgm.txt"))
+    _write_table(basal, os.path.join(out, "Pump_BasalRateChange.txt"))
+    _write_table(bolus, os.path.join(out, "Pump_BolusDelivered.txt"))
+    _write_table(smbg, os.path.join(out, "RocheMeter_a.txt"), "utf-16")
+    _write_table(_phys_exam(rng, ids), os.path.join(out, "DiabPhysExam_a.txt"), "utf-16")
+    _write_table(_insulin(ids, "ParentInsulinListID"), os.path.join(out, "Insulin_a.txt"), "utf-16")
+
+
+def dclp5(out, subjects=5, days=3, rng=None):
+    """DCLP5: three overlapping CGM sources and Tandem tables with adjusted vendor times."""
+    rng = rng or np.random.default_rng(0)
+    os.makedirs(out, exist_ok=True)
+    ids = list(range(1, subjects + 1))
+    clarity, tandem, other, basal, bolus, smbg = [], [], [], [], [], []
+    for pt_id in ids:
+        t = _times("2020-02-01", days, 5)
+        glucose = _glucose(rng, len(t))
+        half = len(t) // 2
+        # the Clarity and Tandem exports overlap by a few readings
+        clarity.append(pd.DataFrame({
+            "PtID": pt_id, "DataDtTm": _vendor_times(t[:half + 10]), "DataDtTm_adj": "", "CGM": glucose[:half + 10],
+        }))
+        t2 = t[half:] + pd.Timedelta(seconds=20)
+        tandem.append(pd.DataFrame({
+            "PtID": pt_id, "DataDtTm": _vendor_times(t2), "DataDtTm_adjusted": "", "CGMValue": glucose[half:],
+        }))
+        other.append(pd.DataFrame({
+            "PtID": pt_id, "DataDtTm": _vendor_times(t[:5]), "DataDtTm_adjusted": "", "CGM": glucose[:5],
+        }))
+        tb = _times("2020-02-01", days, 60)
+        basal.append(pd.DataFrame({
+            "PtID": pt_id,
+            "DataDtTm": _vendor_times(tb),
+            "DataDtTm_adjusted": "",
+            "CommandedBasalRate": rng.choice([0.5, 0.8], len(tb)),
+        }))
+        tbol = tb[::4]
+        bolus.append(pd.DataFrame({
+            "PtID": pt_id,
+            "DataDtTm": _vendor_times(tbol),
+            "DataDtTm_adjusted": "",
+            "BolusAmount": rng.uniform(0.1, 5, len(tbol)).round(2),
+        }))
+        tbg = tb[::6]
+        smbg.append(pd.DataFrame({
+            "PtID": pt_id, "DataDtTm": tbg.strftime("%Y-%m-%d %H:%M:%S"), "BG": _glucose(rng, len(tbg)),
+        }))
+    _write_table(clarity, os.path.join(out, "DexcomClarityCGM.txt"))
+    _write_table(tandem, os.path.join(out, "DCLP5TandemCGMDATAGXB_b.txt"))
+    _write_table(other, os.path.join(out, "OtherCGM.txt"))
+    _write_table(basal, os.path.join(out, "DCLP5TandemBASALRATECHG_b.txt"))
+    _write_table(bolus, os.path.join(out, "DCLP5TandemBolus_Completed_Combined_b.txt"))
+    _write_table(smbg, os.path.join(out, "RocheMeter.txt"))
+    _write_table(_phys_exam(rng, ids), os.path.join(out, "DiabPhysExam.txt"))
+    _write_table(_insulin(ids, "ParentInsulinListID"), os.path.join(out, "Insulin.txt"))
+
+
+def pedap(out, subjects=5, days=3, rng=None):
+    """PEDAP: Tandem CGM, basal and bolus (with carbs) in vendor time format."""
+    rng = rng or np.random.default_rng(0)
+    os.makedirs(out, exist_ok=True)
+    ids = list(range(1, subjects + 1))
+    cgm, basal, bolus = [], [], []
+    for pt_id in ids:
+        t = _times("2021-03-01", days, 5)
+        cgm.append(pd.DataFrame({"PtID": pt_id, "DeviceDtTm": _vendor_times(t), "CGMValue": _glucose(rng, len(t))}))
+        tb = _times("2021-03-01", days, 30)
+        basal.append(pd.DataFrame({
+            "PtID": pt_id, "DeviceDtTm": _vendor_times(tb), "BasalRate": rng.choice([0.2, 0.35], len(tb)),
+        }))
+        tbol = tb[::3]
+        bolus.append(pd.DataFrame({
+            "PtID": pt_id,
+            "DeviceDtTm": _vendor_times(tbol),
+            "BolusAmount": rng.uniform(0.1, 3, len(tbol)).round(2),
+            "CarbAmount": rng.choice([0, 0, 20, 45], len(tbol)),
+        }))
+    _write_table(cgm, os.path.join(out, "PEDAPTandemCGMDATAGXB.txt"))
+    _write_table(basal, os.path.join(out, "PEDAPTandemBASALDELIVERY.txt"))
+    _write_table(bolus, os.path.join(out, "PEDAPTandemBolusDelivered.txt"))
+    _write_table(_phys_exam(rng, ids), os.path.join(out, "PEDAPDiabPhysExam.txt"))
+    _write_table(_insulin(ids, "InsulinName"), os.path.join(out, "PEDAPInsulin.txt"))
+
+
+def iobp2(out, subjects=5, days=3, rng=None):
+    """IOBP2: the iLet device table (CGM, deliveries, meals), BGM and height/weight."""
+    rng = rng or np.random.default_rng(0)
+    os.makedirs(out, exist_ok=True)
+    ids = list(range(1, subjects + 1))
+    device, bgm, height_weight = [], [], []
+    for pt_id in ids:
+        t = _times("2020-06-01", days, 5)
+        n = len(t)
+        meal = rng.random(n) < 0.02
+        device.append(pd.DataFrame({
+            "PtID": pt_id,
+            "DeviceDtTm": _vendor_times(t),
+            "CGMVal": np.where(rng.random(n) < 0.05, np.nan, _glucose(rng, n)),
+            "BasalDelivPrev": rng.choice([0.05, 0.1], n),
+            "BolusDelivPrev": np.where(rng.random(n) < 0.1, 0.3, 0.0),
+            "MealBolus": np.where(meal, 2.0, 0.0),
+            "MealSize": np.where(meal, rng.choice(["Less", "Typical", "More"], n), ""),
+        }))
+        tbg = t[::50]
+        bgm.append(pd.DataFrame({"PtID": pt_id, "DeviceDtTm": _vendor_times(tbg), "BGMVal": _glucose(rng, len(tbg))}))
+        height_weight.append(pd.DataFrame({
+            "PtID": [pt_id, pt_id],
+            "Weight": [150.0, 152.0],
+            "WeightUnits": ["lbs", "lbs"],
+            "WeightAssessDt": ["2020-06-01", "2020-09-01"],
+            "Height": [65.0, np.nan],
+            "HeightUnits": ["in", ""],
+            "HeightAssessDt": ["2020-06-01", ""],
+        }))
+    _write_table(device, os.path.join(out, "IOBP2DeviceiLet.txt"))
+    _write_table(bgm, os.path.join(out, "IOBP2DeviceBGM.txt"))
+    _write_table(height_weight, os.path.join(out, "IOBP2HeightWeight.txt"))
+    _write_table(_insulin(ids, "InsulinName"), os.path.join(out, "IOBP2Insulin.txt"))
+
+
+def loop(out, subjects=6, days=3, rng=None):
+    """Loop: UTC device tables, CGM and basal shuffled across several files, and the roster."""
+    rng = rng or np.random.default_rng(0)
+    os.makedirs(out, exist_ok=True)
+    ids = list(range(1, subjects + 1))
+    cgm, basal, bgm, bolus, food = [], [], [], [], []
+    for pt_id in ids:
+        t = _times("2019-05-01", days, 5, rng, jitter=30)
+        glucose = _glucose(rng, len(t))
+        mmol = pt_id % 3 == 0
+        cgm.append(pd.DataFrame({
+            "PtID": pt_id,
+            "UTCDtTm": t.strftime("%Y-%m-%d %H:%M:%S"),
+            "CGMVal": (glucose / 18.0182).round(1) if mmol else glucose,
+            "Units": "mmol/L" if mmol else "mg/dL",
+            "OriginDeviceManufact": "Dexcom",
+            "OriginDeviceModel": "G6",
+        }))
+        tb = _times("2019-05-01", days, 30, rng, jitter=60)
+        basal.append(pd.DataFrame({
+            "PtID": pt_id,
+            "UTCDtTm": tb.strftime("%Y-%m-%d %H:%M:%S"),
+            "Rate": rng.choice([0.5, 0.6, 0.0], len(tb)),
+            "OriginDeviceManufact": "Insulet",
+            "OriginDeviceModel": "Omnipod",
+        }))
+        te = tb[::5].strftime("%Y-%m-%d %H:%M:%S")
+        bolus.append(pd.DataFrame({
+            "PtID": pt_id,
+            "UTCDtTm": te,
+            "Normal": rng.uniform(0.1, 4, len(te)).round(2),
+            "Extended": np.where(rng.random(len(te)) < 0.1, 0.5, np.nan),
+            "OriginDeviceManufact": "Insulet",
+            "OriginDeviceModel": "Omnipod",
+        }))
+        bgm.append(pd.DataFrame({
+            "PtID": pt_id,
+            "UTCDtTm": te,
+            "BGMVal": _glucose(rng, len(te)),
+            "Units": "mg/dL",
+            "OriginDeviceManufact": "",
+            "OriginDeviceModel": "",
+        }))
+        food.append(pd.DataFrame({
+            "PtID": pt_id, "UTCDtTm": te, "CarbsNet": rng.choice([10, 30, 60], len(te)), "CarbUnits": "grams",
+        }))
+
+    # subjects are spread over all files, as in the real export
+    for name, frames, n_files in (("LOOPDeviceCGM", cgm, 6), ("LOOPDeviceBasal", basal, 3)):
+        df = pd.concat(frames, ignore_index=True)
+        df = df.iloc[rng.permutation(len(df))]
+        for k, rows in enumerate(np.array_split(np.arange(len(df)), n_files)):
+            _write_table([df.iloc[rows]], os.path.join(out, f"{name}{k + 1}.txt"))
+    _write_table(bgm, os.path.join(out, "LOOPDeviceBGM.txt"))
+    _write_table(bolus, os.path.join(out, "LOOPDeviceBolus.txt"))
+    _write_table(food, os.path.join(out, "LOOPDeviceFood.txt"))
+    offsets = [-5, -6, -7, -8, 1, -4]
+    roster = pd.DataFrame({"PtID": ids, "PtTimezoneOffset": [offsets[i % len(offsets)] for i in range(len(ids))]})
+    _write_table([roster], os.path.join(out, "PtRoster.txt"))
+
+
+def _write_xpt(frames, path, name):
+    try:
+        import pyreadstat
+    except ImportError as e:
+        raise ImportError("Writing synthetic T1DEXI .xpt files requires the 'pyreadstat' package.") from e
+    pyreadstat.write_xport(pd.concat(frames, ignore_index=True), path, table_name=name, file_format_version=5)
+
+
+def t1dexi(out, subjects=3, days=2, rng=None):
+    """T1DEXI: SAS transport (XPT v5) domains with SAS datetimes; every third subject uses injections."""
+    rng = rng or np.random.default_rng(0)
+    os.makedirs(out, exist_ok=True)
+
+    def sas(times):
+        return ((times - SAS_EPOCH) / pd.Timedelta(seconds=1)).astype(float)
+
+    tables = {name: [] for name in ("FAMLPM", "DX", "CM", "FACM", "LB", "FA", "VS")}
+    for i in range(1, subjects + 1):
+        subject = str(100 + i)
+        pump = i % 3 != 2
+        t = _times("2021-01-01", days, 5)
+        tables["LB"].append(pd.DataFrame({
+            "USUBJID": subject, "LBTEST": "Glucose", "LBDTC": sas(t),
+            "LBSTRESC": _glucose(rng, len(t)).astype(int).astype(str),
+        }))
+        th = _times("2021-01-01", days, 60)
+        if pump:
+            tables["FACM"].append(pd.DataFrame({
+                "USUBJID": subject, "FADTC": sas(th), "FATESTCD": "BASFLRT",
+                "FAORRES": rng.choice(["0.5", "0.8", " "], len(th)), "INSDVSRC": "Pump",
+            }))
+        else:
+            tables["FACM"].append(pd.DataFrame({
+                "USUBJID": subject, "FADTC": sas(th[::24]), "FATESTCD": "INSBASAL", "FAORRES": "20",
+                "INSDVSRC": "Injections",
+            }))
+        tables["FACM"].append(pd.DataFrame({
+            "USUBJID": subject, "FADTC": sas(th[::4]), "FATESTCD": "INSBOLUS",
+            "FAORRES": rng.uniform(1, 5, len(th[::4])).round(1).astype(str),
+            "INSDVSRC": "Pump" if pump else "Injections",
+        }))
+        tables["FAMLPM"].append(pd.DataFrame({
+            "USUBJID": subject, "FATEST": "Dietary Total Carbohydrates", "FACAT": "CONSUMED",
+            "FADTC": sas(th[::6]), "FASTRESN": rng.choice([20.0, 45.0], len(th[::6])),
+        }))
+        tables["DX"].append(pd.DataFrame({
+            "USUBJID": [subject, subject], "DXTRT": ["INSULIN PUMP", "TANDEM T:SLIM X2" if pump else "MDI"],
+        }))
+        tables["CM"].append(pd.DataFrame({
+            "USUBJID": [subject, subject],
+            "CMSCAT": ["PUMP OR CLOSED LOOP" if pump else "MDI, BASAL INSULIN", "MDI, BOLUS INSULIN"],
+            "CMTRT": ["HUMALOG", "NOVOLOG"],
+        }))
+        # steps in 10-second bins, only the non-empty ones are exported
+        ts = _times("2021-01-01", days, 1 / 6)[::30]
+        tables["FA"].append(pd.DataFrame({
+            "USUBJID": subject, "FADTC": sas(ts), "FATESTCD": "STEPSTKN",
+            "FAORRES": rng.choice(["0", "12", "40"], len(ts)),
+        }))
+        tables["VS"].append(pd.DataFrame({
+            "USUBJID": [subject, subject], "VSDTC": sas(th[:2]), "VSCAT": "", "VSTEST": ["Weight", "Height"],
+            "VSSTRESC": ["70", "170"], "VSORRES": ["154", "67"], "VSORRESU": ["LBS", "in"],
+        }))
+        thr = _times("2021-01-01", days, 1)
+        tables["VS"].append(pd.DataFrame({
+            "USUBJID": subject, "VSDTC": sas(thr), "VSCAT": "VERILY HEART RATE", "VSTEST": "Heart Rate",
+            "VSSTRESC": rng.integers(55, 140, len(thr)).astype(str), "VSORRES": "", "VSORRESU": "beats/min",
+        }))
+    for name, frames in tables.items():
+        _write_xpt(frames, os.path.join(out, f"{name}.xpt"), name)
+
+
+def babelbetes(out, subjects=4, days=2, rng=None, studies=("A", "B")):
+    """Babelbetes: Parquet partitioned as ``study_name=<study>/data_type=<type>/``."""
+    rng = rng or np.random.default_rng(0)
+    for study in studies:
+        for data_type, minutes, column in (("cgm", 5, "cgm"), ("basal", 30, "basal_rate"), ("bolus", 120, "bolus")):
+            frames = []
+            for i in range(subjects):
+                t = _times("2022-01-01", days, minutes)
+                values = _glucose(rng, len(t)) if column == "cgm" else rng.uniform(0, 3, len(t)).round(2)
+                frames.append(pd.DataFrame({"patient_id": f"{study}{i}", "datetime": t, column: values}))
+            directory = os.path.join(out, f"study_name={study}", f"data_type={data_type}")
+            os.makedirs(directory, exist_ok=True)
+            pd.concat(frames, ignore_index=True).to_parquet(os.path.join(directory, "part-0.parquet"), index=False)
+
+
+# generator of each study, by the name of its converter's source directory
+STUDIES = {
+    "dclp3": dclp3,
+    "dclp5": dclp5,
+    "pedap": pedap,
+    "iobp2": iobp2,
+    "loop": loop,
+    "t1dexi": t1dexi,
+    "babelbetes": babelbetes,
+}
+
+
+def generate(root, studies=None, subjects=5, days=3, seed=0):
+    """Write synthetic sources for ``studies`` (default: all) to ``root/<study>``.
+
+    Returns:
+        dict of study -> source directory.
+    """
+    sources = {}
+    for study in studies or STUDIES:
+        sources[study] = os.path.join(root, study)
+        STUDIES[study](sources[study], subjects=subjects, days=days, rng=np.random.default_rng(seed))
+    return sources
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic raw study exports for benchmarking.")
+    parser.add_argument("output", help="Root directory; each study is written to <output>/<study>.")
+    parser.add_argument(
+        "--studies",
+        default=None,
+        help=f"Comma-separated list of studies (default: all of {', '.join(STUDIES)}).",
+    )
+    parser.add_argument("--subjects", type=int, default=5, help="Subjects per study (default: 5).")
+    parser.add_argument("--days", type=float, default=3, help="Days of data per subject (default: 3).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0).")
+    args = parser.parse_args()
+
+    studies = [s.strip() for s in args.studies.split(",")] if args.studies else None
+    for study, path in generate(args.output, studies, args.subjects, args.days, args.seed).items():
+        print(f"{study}: {path}")
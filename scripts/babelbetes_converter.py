@@ -1,26 +1,201 @@
 import argparse
-import json
+import collections
+import functools
+import logging
+import operator
 import os
-from typing import Iterable, List, Optional
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from typing import Iterable, Optional
 import pandas as pd
-import tqdm
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 
+from diax_output import (
+    OutputManifest,
+    OutputOptions,
+    add_output_arguments,
+    save_subject,
+    source_fingerprints,
+    update_study_summary,
+)
+from runner import add_runner_arguments, add_selection_arguments, parse_list, process_pool, run_subjects
+from staging import partition_chunks, read_partition
+from timestamps import format_times
 
-def _read_parquet(source_dir: str, study_name: str, data_type: str) -> pd.DataFrame:
-    """Read a single study/data_type parquet dataset."""
+
+logger = logging.getLogger(__name__)
+
+CONVERTER_VERSION = 1
+
+# value column of each data_type
+VALUE_COLUMNS = {'cgm': 'cgm', 'basal': 'basal_rate', 'bolus': 'bolus'}
+
+# rows buffered while spooling a data_type before they are flushed to disk
+SPOOL_FLUSH_ROWS = 5_000_000
+
+# fixed peak memory of converting a study (dataset scans, pyarrow buffers and
+# the first patient's imports), fitted on synthetic studies with benchmark.py
+STUDY_BYTES = 80 * 2**20
+
+# peak memory per buffered row while spooling (id, datetime, value in pandas,
+# plus the per-patient groupby and concat copies); fitted at 13, rounded up
+SPOOL_BYTES_PER_ROW = 20
+
+# peak memory per row of the patient a worker converts (its three tables, the
+# formatted times and the Python lists of the output dict); fitted at 200-250
+CONVERT_BYTES_PER_ROW = 300
+
+# resident size of an idle spawned worker (interpreter, pandas and pyarrow),
+# held for the whole run whatever the studies
+WORKER_BYTES = 150 * 2**20
+
+
+def _open_dataset(source_dir: str, study_name: str, data_type: str) -> ds.Dataset:
+    """Open a single study/data_type parquet dataset without reading it."""
     path = os.path.join(source_dir, f"study_name={study_name}", f"data_type={data_type}")
     if not os.path.isdir(path):
         raise FileNotFoundError(f"Missing dataset directory: {path}")
-    # Read per-data_type to avoid schema conflicts across partitions.
-    return pd.read_parquet(path)
+    # Opened per-data_type to avoid schema conflicts across partitions.
+    return ds.dataset(path, format="parquet")
+
+
+def _patient_ids(dataset: ds.Dataset, patients: Iterable[str]) -> pa.Array:
+    """Patient ids cast to the dataset's patient_id type.
+
+    Raises:
+        ValueError: If an id does not cast (e.g. a non-numeric id for an
+            integer column); the message names the id.
+    """
+    id_type = dataset.schema.field('patient_id').type
+    ids = list(patients)
+    for pt_id in ids:
+        try:
+            pa.array([pt_id]).cast(id_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Patient id {pt_id!r} is not a valid patient_id of type {id_type}.") from e
+    return pa.array(ids).cast(id_type)
+
+
+def check_patients(source_dir: str, studies: Optional[Iterable[str]], patients: Optional[Iterable[str]]) -> None:
+    """Check up front that every patient id casts to patient_id in each study.
+
+    Studies or data_types that are missing are left to ``convert_all``,
+    which reports them per study.
+
+    Raises:
+        ValueError: Naming the first patient id that does not cast.
+    """
+    if patients is None:
+        return
+    for study_name in _find_studies(source_dir, studies):
+        for data_type in VALUE_COLUMNS:
+            try:
+                dataset = _open_dataset(source_dir, study_name, data_type)
+            except FileNotFoundError:
+                continue
+            _patient_ids(dataset, patients)
+
+
+def _scan_filter(
+    dataset: ds.Dataset,
+    patients: Optional[Iterable[str]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> Optional[ds.Expression]:
+    """Filter on patient_id and an inclusive datetime range, evaluated inside the scan."""
+    conditions = []
+    if patients is not None:
+        conditions.append(ds.field('patient_id').isin(_patient_ids(dataset, patients)))
+
+    time_type = dataset.schema.field('datetime').type
+    for bound, op in ((start, operator.ge), (end, operator.le)):
+        if bound is None:
+            continue
+        bound = pd.Timestamp(bound)
+        if getattr(time_type, 'tz', None) and bound.tzinfo is None:
+            bound = bound.tz_localize(time_type.tz)
+        conditions.append(op(ds.field('datetime'), pa.scalar(bound, type=time_type)))
+
+    return functools.reduce(operator.and_, conditions) if conditions else None
+
+
+def _spool_by_patient(dataset: ds.Dataset, data_type: str, scan_filter, staging_dir: str) -> set:
+    """Stream one data_type into per-patient Parquet files; returns the patient ids seen."""
+    columns = ['patient_id', 'datetime', VALUE_COLUMNS[data_type]]
+    patients = set()
+
+    def chunks():
+        for batch in dataset.to_batches(columns=columns, filter=scan_filter):
+            if batch.num_rows:
+                chunk = batch.to_pandas()
+                patients.update(chunk['patient_id'].unique())
+                yield chunk
+
+    partition_chunks(
+        chunks(), data_type, 0, os.path.join(staging_dir, data_type), 'patient_id', flush_rows=SPOOL_FLUSH_ROWS
+    )
+    return patients
+
+
+def _patient_rows(dataset: ds.Dataset) -> collections.Counter:
+    """Rows per patient_id of a dataset, from the Parquet footers where possible.
+
+    A row group whose patient_id statistics have min == max belongs to one
+    patient and is counted from its footer; only the patient_id column of
+    row groups mixing patients is read.
+    """
+    counts = collections.Counter()
+    for fragment in dataset.get_fragments():
+        metadata = fragment.metadata
+        column = metadata.schema.names.index('patient_id')
+        mixed = []
+        for index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(index)
+            stats = row_group.column(column).statistics
+            if stats is not None and stats.has_min_max and stats.min == stats.max:
+                counts[stats.min] += row_group.num_rows
+            else:
+                mixed.append(index)
+        if mixed:
+            ids = fragment.subset(row_group_ids=mixed).to_table(columns=['patient_id']).column('patient_id')
+            for item in pc.value_counts(ids).to_pylist():
+                counts[item['values']] += item['counts']
+    return counts
 
 
-def process_subj(cgm_data, basal_data, bolus_data, subject_id, output_file):
+def estimate_footprint(source_dir: str, study_name: str, jobs: int = 1) -> int:
+    """Estimated peak bytes of converting a study, from Parquet metadata.
+
+    Spooling buffers at most SPOOL_FLUSH_ROWS rows of one data_type; then
+    each of up to ``jobs`` workers holds all rows of the patient it
+    converts. The estimate is STUDY_BYTES, the spool buffer and ``jobs``
+    times the largest patient (rows of all data_types). The patient and
+    time filters are not applied, so it is an upper bound; so is adding up
+    studies that share one worker pool.
+    """
+    rows, per_patient = 0, collections.Counter()
+    for data_type in VALUE_COLUMNS:
+        counts = _patient_rows(_open_dataset(source_dir, study_name, data_type))
+        rows = max(rows, sum(counts.values()))
+        per_patient.update(counts)
+    largest = max(per_patient.values(), default=0)
+    return (
+        STUDY_BYTES
+        + min(rows, SPOOL_FLUSH_ROWS) * SPOOL_BYTES_PER_ROW
+        + jobs * largest * CONVERT_BYTES_PER_ROW
+    )
+
+
+def process_subj(cgm_data, basal_data, bolus_data, subject_id, output_file, options=OutputOptions()):
     """Process a single subject's data and write to DIAX format."""
 
     def normalize(df, col):
         df = df.copy()
-        df.loc[:, 'time'] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        df.loc[:, 'time'] = format_times(df[col])
         return df.sort_values(col).reset_index(drop=True)
     
     # ensure datetime columns are in datetime format
@@ -80,53 +255,186 @@ def process_subj(cgm_data, basal_data, bolus_data, subject_id, output_file):
         },
     }
 
-    with open(output_file, "w") as f:
-        json.dump(output, f, indent=2, default=str)
+    save_subject(output, output_file, options)
+
+
+def _convert_patient(staging_dir, pt_id, output_file, options=OutputOptions()):
+    """Read one patient's spooled tables and convert it (runs inside a worker)."""
+    cgm, basal, bolus = (
+        read_partition(os.path.join(staging_dir, data_type), 'patient_id', pt_id)
+        for data_type in ('cgm', 'basal', 'bolus')
+    )
+    process_subj(cgm, basal, bolus, pt_id, output_file, options)
+
 
+def convert_study(
+    source_dir: str,
+    output_dir: str,
+    study_name: str,
+    jobs: int = 1,
+    patients: Optional[Iterable[str]] = None,
+    pool=None,
+    options: OutputOptions = OutputOptions(),
+) -> dict:
+    """Convert one study into standardized CSV outputs.
 
-def convert_study(source_dir: str, output_dir: str, study_name: str) -> None:
-    """Convert one study into standardized CSV outputs."""
+    Each data_type is scanned once as an Arrow dataset, with the patient and
+    time filters applied in the scan, and spooled to per-patient Parquet
+    files; workers then read a single patient, so memory follows the largest
+    patient rather than the study. Subjects go to ``pool`` when studies
+    share one (see ``convert_all``). Patients whose output is current in
+    the study's output manifest are skipped unless ``options.force`` is set;
+    ``options`` (``OutputOptions``) also sets the format, the time window,
+    compaction and the study summary.
+    Returns the ``run_subjects`` report.
+    """
     study_out = os.path.join(output_dir, study_name)
     os.makedirs(study_out, exist_ok=True)
+    manifest = OutputManifest(
+        study_out,
+        source_fingerprints(os.path.join(source_dir, f"study_name={study_name}"), recursive=True),
+        CONVERTER_VERSION,
+        options,
+        subset=patients is not None,
+    )
+    if manifest.up_to_date():
+        update_study_summary(study_out, manifest, options)
+        return {"results": {}, "failed": {}}
 
-    cgm_all = _read_parquet(source_dir, study_name, 'cgm')
-    basal_all = _read_parquet(source_dir, study_name, 'basal')
-    bolus_all = _read_parquet(source_dir, study_name, 'bolus')
+    with tempfile.TemporaryDirectory(prefix=".staging-", dir=study_out) as staging_dir:
+        seen = []
+        for data_type in ('cgm', 'basal', 'bolus'):
+            dataset = _open_dataset(source_dir, study_name, data_type)
+            scan_filter = _scan_filter(dataset, patients, options.start, options.end)
+            seen.append(_spool_by_patient(dataset, data_type, scan_filter, staging_dir))
 
-    # Find patients with all three data types.
-    pt_ids = set(cgm_all['patient_id']).intersection(basal_all['patient_id']).intersection(bolus_all['patient_id'])
+        # Find patients with all three data types.
+        outputs = {
+            pt_id: os.path.join(study_out, f"subject_{pt_id}{options.suffix}")
+            for pt_id in seen[0].intersection(seen[1]).intersection(seen[2])
+        }
+        pt_ids = manifest.pending(outputs)
 
-    for pt_id in tqdm.tqdm(pt_ids, desc=f"Processing subjects for study: {study_name}"):
-        cgm = cgm_all[cgm_all['patient_id'] == pt_id].copy()
-        basal = basal_all[basal_all['patient_id'] == pt_id].copy()
-        bolus = bolus_all[bolus_all['patient_id'] == pt_id].copy()
+        def tasks():
+            for pt_id in pt_ids:
+                yield pt_id, (staging_dir, pt_id, outputs[pt_id]), {"options": options}
 
-        output_file = os.path.join(study_out, f"subject_{pt_id}.json")
-        process_subj(cgm, basal, bolus, pt_id, output_file)
+        with manifest:
+            report = run_subjects(
+                tasks(),
+                _convert_patient,
+                jobs=jobs,
+                desc=f"Processing subjects for study: {study_name}",
+                total=len(pt_ids),
+                pool=pool,
+                on_done=manifest.on_done,
+            )
+    update_study_summary(study_out, manifest, options)
+    return report
 
         
-def convert_all(source_dir: str, output_dir: str, studies: Optional[Iterable[str]]) -> int:
-    """Convert all requested studies. Returns the number of studies processed."""
+def _find_studies(source_dir: str, studies: Optional[Iterable[str]]) -> list:
+    """The requested studies, or all found in the source directory."""
+    if studies is not None:
+        return list(studies)
+    return [entry.split("=", 1)[1] for entry in os.listdir(source_dir) if entry.startswith("study_name=")]
 
-    if studies is None:  # No specific studies provided, process all found in the source directory.
-        studies = []
-        for entry in os.listdir(source_dir):
-            if entry.startswith("study_name="):
-                studies.append(entry.split("=", 1)[1])
 
-    count = 0
-    for study_name in studies:
-        convert_study(source_dir, output_dir, study_name)
-        count += 1
+def convert_all(
+    source_dir: str,
+    output_dir: str,
+    studies: Optional[Iterable[str]],
+    jobs: int = 1,
+    patients: Optional[Iterable[str]] = None,
+    memory_budget: Optional[int] = None,
+    options: OutputOptions = OutputOptions(),
+) -> int:
+    """Convert all requested studies. Returns the number of studies processed.
 
-    return count
+    With ``jobs > 1`` up to ``jobs`` studies run at once, each in a thread,
+    and their subjects share one pool of ``jobs`` worker processes. A study
+    is started only while the estimated footprints of the running studies
+    (``estimate_footprint``) fit in ``memory_budget`` bytes, less
+    WORKER_BYTES per worker process; the largest studies are queued first,
+    and a study over the budget runs on its own. A study that cannot be
+    estimated or converted (e.g. a missing data_type directory) is logged
+    and reported as failed; the others still run.
+    """
 
+    footprints, reports = {}, {}
+    for study_name in _find_studies(source_dir, studies):
+        try:
+            footprints[study_name] = estimate_footprint(source_dir, study_name, max(1, jobs))
+        except Exception:
+            # reported like a study that fails to convert; the others still run
+            logger.exception("Study %s failed", study_name)
+            reports[study_name] = None, 0.0
+    queue = sorted(footprints, key=footprints.get, reverse=True)
+    budget = float("inf") if memory_budget is None else memory_budget
+    if jobs > 1:
+        budget -= jobs * WORKER_BYTES
 
-def _parse_studies(value: Optional[str]) -> Optional[List[str]]:
-    """Parse comma-separated study list from CLI (or return None)."""
+    def run(study_name, pool):
+        began = time.perf_counter()
+        report = convert_study(
+            source_dir,
+            output_dir,
+            study_name,
+            jobs=jobs,
+            patients=patients,
+            pool=pool,
+            options=options,
+        )
+        return report, time.perf_counter() - began
+
+    pool = process_pool(jobs) if jobs > 1 else None
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as threads, (pool or nullcontext()):
+        running = {}
+        while queue or running:
+            in_use = sum(footprints[study_name] for study_name in running.values())
+            for study_name in list(queue):
+                if len(running) >= max(1, jobs):
+                    break
+                if running and in_use + footprints[study_name] > budget:
+                    continue
+                queue.remove(study_name)
+                running[threads.submit(run, study_name, pool)] = study_name
+                in_use += footprints[study_name]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                study_name = running.pop(future)
+                try:
+                    reports[study_name] = future.result()
+                except Exception:
+                    logger.exception("Study %s failed", study_name)
+                    reports[study_name] = None, 0.0
+
+    _print_summary(reports, footprints)
+    return sum(1 for report, _ in reports.values() if report is not None)
+
+
+def _print_summary(reports, footprints):
+    """Per-study subjects, estimated footprint and wall time."""
+    print(f"{'study':<24}{'subjects':>10}{'failed':>8}{'est. MB':>10}{'wall s':>10}")
+    for study_name, (report, seconds) in sorted(reports.items(), key=lambda item: -item[1][1]):
+        if report is None:
+            converted, failed = "-", "study"
+        else:
+            converted, failed = len(report["results"]), len(report["failed"])
+        estimate = f"{footprints[study_name] / 1e6:.1f}" if study_name in footprints else "-"
+        print(f"{study_name:<24}{converted:>10}{failed:>8}{estimate:>10}{seconds:>10.1f}")
+
+
+def _parse_size(value: Optional[str]) -> Optional[int]:
+    """Parse a memory size such as ``16G``, ``512M`` or a plain byte count."""
     if not value:
         return None
-    return [item.strip() for item in value.split(",") if item.strip()]
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
 
 
 if __name__ == "__main__":
@@ -148,9 +456,32 @@ if __name__ == "__main__":
         default=None,
         help="Comma-separated list of study names (default: all).",
     )
+    parser.add_argument(
+        "--memory-budget",
+        default=None,
+        help="Memory for concurrently converted studies, e.g. 16G (default: unlimited).",
+    )
+
+    add_runner_arguments(parser)
+    add_selection_arguments(parser)
+    # the patient filter's earlier name
+    parser.add_argument("--patients", dest="subjects", type=parse_list, help=argparse.SUPPRESS)
+    add_output_arguments(parser)
 
     args = parser.parse_args()
-    study_list = _parse_studies(args.studies)
+    study_list = parse_list(args.studies)
+    try:
+        check_patients(args.source, study_list, args.subjects)
+    except ValueError as err:
+        parser.error(str(err))
 
-    processed = convert_all(args.source, args.output, study_list)
+    processed = convert_all(
+        args.source,
+        args.output,
+        study_list,
+        jobs=args.jobs,
+        patients=args.subjects,
+        memory_budget=_parse_size(args.memory_budget),
+        options=OutputOptions.from_args(args),
+    )
     print(f"Processed {processed} studies.")
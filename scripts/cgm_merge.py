@@ -0,0 +1,74 @@
+import numpy as np
+
+
+# readings of two sources closer than this (in seconds) are one sensor value;
+# below half the 5-minute CGM interval, so consecutive readings never collapse
+DEFAULT_TOLERANCE = 120
+
+# sentinels of "no kept reading before/after", far enough out not to overflow
+_NEVER_BEFORE = -(2**62)
+_NEVER_AFTER = 2**62
+
+
+def merge_sources(df, priority, tolerance=DEFAULT_TOLERANCE, time="time", source="source"):
+    """Merge the overlapping CGM sources of one subject into a single stream.
+
+    Each source is sorted by time and the sorted runs are merged (a stable
+    sort of k presorted runs, so linear in the rows for a fixed number of
+    sources). Sources are then taken in ``priority`` order: every reading of
+    the first source is kept, and a reading of a later source is dropped as
+    a duplicate if a kept reading of a higher-priority source lies within
+    ``tolerance`` seconds of it. Readings of the same source never collapse.
+    Each level is one pass over the merged rows, filling the nearest kept
+    time before and after every row with a running max/min.
+
+    Args:
+        df: Readings of one subject, with ``time`` (datetime64) and
+            ``source`` columns.
+        priority: Source names, most trusted first; sources not listed come
+            last, as one level. With a categorical ``source`` column every
+            name must be one of its categories.
+        tolerance: Window in seconds within which readings are duplicates.
+        time: Name of the time column.
+        source: Name of the column naming each row's source.
+
+    Returns:
+        (merged frame sorted by time, number of duplicates dropped). Rows
+        without a time are kept, after the others.
+
+    Raises:
+        ValueError: If ``priority`` names a source that is not a category of
+            a categorical ``source`` column (a misspelt name would silently
+            change the ranking).
+    """
+    if hasattr(df[source], "cat"):
+        unknown = [name for name in priority if name not in df[source].cat.categories]
+        if unknown:
+            raise ValueError(f"Unknown source(s) {', '.join(map(str, unknown))} in the priority list.")
+    when = df[time].to_numpy(dtype="datetime64[ns]")
+    valid = ~np.isnat(when)
+    ticks = when.view(np.int64)
+    ranks = {name: level for level, name in enumerate(priority)}
+    rank = df[source].astype(object).map(ranks).fillna(len(priority)).to_numpy(dtype=np.int64)
+
+    # sort each source, then merge the presorted runs
+    rows = np.flatnonzero(valid)
+    rows = rows[np.argsort(rank[rows], kind="stable")]
+    runs = np.split(rows, np.flatnonzero(np.diff(rank[rows])) + 1) if len(rows) else []
+    rows = np.concatenate([run[np.argsort(ticks[run], kind="stable")] for run in runs] or [rows])
+    rows = rows[np.argsort(ticks[rows], kind="stable")]
+
+    t = ticks[rows]
+    r = rank[rows]
+    window = int(tolerance * 1_000_000_000)
+    kept = np.zeros(len(rows), dtype=bool)
+    for level in np.unique(r):
+        candidate = r == level
+        if kept.any():
+            before = np.maximum.accumulate(np.where(kept, t, _NEVER_BEFORE))
+            after = np.minimum.accumulate(np.where(kept, t, _NEVER_AFTER)[::-1])[::-1]
+            candidate &= (t - before > window) & (after - t > window)
+        kept |= candidate
+
+    merged = np.concatenate([rows[kept], np.flatnonzero(~valid)])
+    return df.iloc[merged].reset_index(drop=True), int(len(rows) - kept.sum())
@@ -1,19 +1,60 @@
-import json
 import os
 
 import numpy as np
 import pandas as pd
 
+from diax_output import (
+    OutputManifest,
+    OutputOptions,
+    add_output_arguments,
+    save_subject,
+    source_fingerprints,
+    update_study_summary,
+)
+from runner import add_runner_arguments, add_selection_arguments, converted_results, run_subjects
+from staging import SubjectTables, stage_table
+from timestamps import first_time, format_times, in_window
 
-def preprocess_dclp3(data_source):
-    """Load and pre-process DCLP3 source tables."""
-    cgm_all = pd.read_csv(os.path.join(data_source, "cgm.txt"), sep="|")
-    basal_all = pd.read_csv(os.path.join(data_source, "Pump_BasalRateChange.txt"), sep="|")
-    bolus_all = pd.read_csv(os.path.join(data_source, "Pump_BolusDelivered.txt"), sep="|")
-    smbg_all = pd.read_csv(os.path.join(data_source, "RocheMeter_a.txt"), sep="|", encoding="utf-16")
-    phys_all = pd.read_csv(os.path.join(data_source, "DiabPhysExam_a.txt"), sep="|", encoding="utf-16")
 
-    insulin_all = pd.read_csv(os.path.join(data_source, "Insulin_a.txt"), sep="|", encoding="utf-16")
+CONVERTER_VERSION = 1
+
+
+def preprocess_dclp3(data_source, subjects=None):
+    """Load and pre-process DCLP3 source tables (parsed once, then cached as Parquet)."""
+    cgm_all = stage_table(
+        os.path.join(data_source, "cgm.txt"),
+        {"PtID": "category", "CGM": "float32"},
+        subjects=subjects,
+    )
+    basal_all = stage_table(
+        os.path.join(data_source, "Pump_BasalRateChange.txt"),
+        {"PtID": "category", "CommandedBasalRate": "float32"},
+        subjects=subjects,
+    )
+    bolus_all = stage_table(
+        os.path.join(data_source, "Pump_BolusDelivered.txt"),
+        {"PtID": "category", "BolusAmount": "float32"},
+        subjects=subjects,
+    )
+    smbg_all = stage_table(
+        os.path.join(data_source, "RocheMeter_a.txt"),
+        {"PtID": "category", "BG": "float32"},
+        encoding="utf-16",
+        subjects=subjects,
+    )
+    phys_all = stage_table(
+        os.path.join(data_source, "DiabPhysExam_a.txt"),
+        {"PtID": "category"},
+        encoding="utf-16",
+        subjects=subjects,
+    )
+
+    insulin_all = stage_table(
+        os.path.join(data_source, "Insulin_a.txt"),
+        {"PtID": "category"},
+        encoding="utf-16",
+        subjects=subjects,
+    )
     insulin_all = insulin_all[insulin_all["InsRoute"] == "Pump"]
     insulin_all["InsTypeStartDt"] = pd.to_datetime(
         insulin_all["InsTypeStartDt"], errors="coerce"
@@ -38,8 +79,11 @@ def preprocess_dclp3(data_source):
     }
 
 
-def process_subj_dclp3(cgm, basal, bolus, insulin, smbg, phys, subject_id, output_file):
-    """Process a single DCLP3 subject and write a DIAX JSON file."""
+def process_subj_dclp3(cgm, basal, bolus, insulin, smbg, phys, subject_id, output_file, options=OutputOptions()):
+    """Process a single DCLP3 subject and write a DIAX JSON file.
+
+    ``options.start``/``options.end`` restrict every time series to that window.
+    """
     cgm.loc[:, "time"] = pd.to_datetime(cgm["DataDtTm"], format="%d%b%y:%H:%M:%S")
     cgm_data = cgm
 
@@ -55,18 +99,21 @@ def process_subj_dclp3(cgm, basal, bolus, insulin, smbg, phys, subject_id, outpu
     smbg.loc[:, "time"] = pd.to_datetime(smbg["DataDtTm"], format="%Y-%m-%d %H:%M:%S")
     smbg_data = smbg
 
+    # Time window
+    cgm_data = in_window(cgm_data, options.start, options.end)
+    basal_data = in_window(basal_data, options.start, options.end)
+    bolus_data = in_window(bolus_data, options.start, options.end)
+    smbg_data = in_window(smbg_data, options.start, options.end)
+    if not any(len(df) for df in (cgm_data, basal_data, bolus_data, smbg_data)):
+        print(f"Subject {subject_id} has no data between {options.start} and {options.end}, skipping.")
+        return False
+
     # Time normalizing
-    start_times = [
-        cgm_data["time"].min(),
-        basal_data["time"].min(),
-        bolus_data["time"].min(),
-        smbg_data["time"].min(),
-    ]
-    start_time = min(start_times)
+    start_time = first_time(cgm_data, basal_data, bolus_data, smbg_data)
 
     def normalize(df, col):
         df = df.copy()
-        df.loc[:, col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        df.loc[:, col] = format_times(df[col])
         return df.sort_values(col).reset_index(drop=True)
 
     cgm_data = normalize(cgm_data, "time")
@@ -174,35 +221,58 @@ def process_subj_dclp3(cgm, basal, bolus, insulin, smbg, phys, subject_id, outpu
         "smbg": {"time": smbg_data["time"].tolist(), "value": smbg_data["BG"].tolist()},
     }
 
-    with open(output_file, "w") as f:
-        json.dump(output, f, indent=2, default=str)
-
-
-def process_all_dclp3(data_source, output_dir):
-    """Process all DCLP3 subjects from the source directory."""
-    os.makedirs(output_dir, exist_ok=True)
-    prep = preprocess_dclp3(data_source)
-
-    cgm_all = prep["cgm_all"]
-    basal_all = prep["basal_all"]
-    bolus_all = prep["bolus_all"]
-    insulin_all = prep["insulin_all"]
-    smbg_all = prep["smbg_all"]
-    phys_all = prep["phys_all"]
-    subjects = prep["subjects"]
+    save_subject(output, output_file, options)
 
-    for subject_id in subjects:
-        cgm = cgm_all[cgm_all["PtID"] == subject_id].copy()
-        basal = basal_all[basal_all["PtID"] == subject_id].copy()
-        bolus = bolus_all[bolus_all["PtID"] == subject_id].copy()
-        insulin = insulin_all[insulin_all["PtID"] == subject_id].copy()
-        smbg = smbg_all[smbg_all["PtID"] == subject_id].copy()
-        phys = phys_all[phys_all["PtID"] == subject_id].copy()
 
-        output_file = os.path.join(output_dir, f"DCLP3_subject_{subject_id}.json")
-        process_subj_dclp3(cgm, basal, bolus, insulin, smbg, phys, subject_id, output_file)
+def process_all_dclp3(data_source, output_dir, jobs=1, subjects=None, options=OutputOptions()):
+    """Process all DCLP3 subjects from the source directory.
 
-    return len(subjects)
+    Subjects whose output is current in the output manifest are skipped
+    unless ``options.force`` is set. ``subjects`` limits the conversion to
+    those PtIDs; ``options`` (``OutputOptions``) also sets the format, the
+    inclusive window of local time, compaction and the study summary.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = OutputManifest(
+        output_dir,
+        source_fingerprints(data_source),
+        CONVERTER_VERSION,
+        options,
+        subset=subjects is not None,
+    )
+    if manifest.up_to_date():
+        print(f"{output_dir} is up to date.")
+        update_study_summary(output_dir, manifest, options)
+        return 0
+
+    prep = preprocess_dclp3(data_source, subjects)
+    outputs = {
+        subject_id: os.path.join(output_dir, f"DCLP3_subject_{subject_id}{options.suffix}")
+        for subject_id in prep["subjects"]
+    }
+    subjects = manifest.pending(outputs)
+
+    # row positions of every subject, built once per table
+    names = ["cgm_all", "basal_all", "bolus_all", "insulin_all", "smbg_all", "phys_all"]
+    tables = SubjectTables({name: prep[name] for name in names}, "PtID")
+
+    def tasks():
+        for subject_id in subjects:
+            cgm, basal, bolus, insulin, smbg, phys = (tables.take(name, subject_id) for name in names)
+
+            output_file = outputs[subject_id]
+            yield (
+                subject_id,
+                (cgm, basal, bolus, insulin, smbg, phys, subject_id, output_file),
+                {"options": options},
+            )
+
+    with manifest:
+        report = run_subjects(
+            tasks(), process_subj_dclp3, jobs=jobs, desc="DCLP3", total=len(subjects), on_done=manifest.on_done
+        )
+    update_study_summary(output_dir, manifest, options)
+    return len(converted_results(report))
 
 
 if __name__ == "__main__":
@@ -211,7 +281,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process all DCLP3 subjects.")
     parser.add_argument("--source", required=True, help="Path to DCLP3 data directory.")
     parser.add_argument("--output", required=True, help="Output directory for JSON files.")
+    add_runner_arguments(parser)
+    add_selection_arguments(parser)
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    count = process_all_dclp3(args.source, args.output)
+    count = process_all_dclp3(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        subjects=args.subjects,
+        options=OutputOptions.from_args(args),
+    )
     print(f"Processed {count} subjects.")
@@ -1,38 +1,89 @@
-import json
 import os
 
 import numpy as np
 import pandas as pd
 
+from cgm_merge import DEFAULT_TOLERANCE, merge_sources
+from diax_output import (
+    OutputManifest,
+    OutputOptions,
+    add_output_arguments,
+    save_subject,
+    source_fingerprints,
+    update_study_summary,
+)
+from runner import add_runner_arguments, add_selection_arguments, converted_results, parse_list, run_subjects
+from staging import SubjectTables, concat_frames, stage_table
+from timestamps import first_time, format_times, in_window, parse_mixed
 
-def _parse_mixed(x):
-    """Parse mixed datetime formats (with/without time)."""
-    for fmt in ("%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y"):
-        try:
-            return pd.to_datetime(x, format=fmt)
-        except (ValueError, TypeError):
-            continue
-    return pd.NaT
 
+CONVERTER_VERSION = 2
 
-def preprocess_dclp5(data_source):
-    """Load and pre-process DCLP5 source tables."""
-    cgm1 = pd.read_csv(os.path.join(data_source, "DexcomClarityCGM.txt"), sep="|")
+# CGM sources, most trusted first: Dexcom Clarity, the Tandem pump's copy, other receivers
+CGM_SOURCES = ("clarity", "tandem", "other")
+
+
+def _label_source(cgm, name):
+    """Tag the rows of one CGM table with its source, for the per-subject merge."""
+    codes = np.full(len(cgm), CGM_SOURCES.index(name), dtype=np.int8)
+    cgm["source"] = pd.Categorical.from_codes(codes, categories=CGM_SOURCES)
+    return cgm
+
+
+def check_cgm_priority(priority):
+    """Raise ValueError unless every name in ``priority`` is one of ``CGM_SOURCES``.
+
+    A misspelt name would otherwise rank the real source last, or with no
+    known name leave every source on one level, so nothing is deduplicated.
+    """
+    unknown = [name for name in priority if name not in CGM_SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown CGM source(s) {', '.join(unknown)}; expected names from {', '.join(CGM_SOURCES)}.")
+
+
+def preprocess_dclp5(data_source, subjects=None):
+    """Load and pre-process DCLP5 source tables (parsed once, then cached as Parquet)."""
+    cgm1 = stage_table(
+        os.path.join(data_source, "DexcomClarityCGM.txt"),
+        {"PtID": "category", "CGM": "float32"},
+        subjects=subjects,
+    )
     cgm1.rename(columns={"DataDtTm_adj": "DataDtTm_adjusted"}, inplace=True)
-    cgm2 = pd.read_csv(os.path.join(data_source, "DCLP5TandemCGMDATAGXB_b.txt"), sep="|")
+    cgm2 = stage_table(
+        os.path.join(data_source, "DCLP5TandemCGMDATAGXB_b.txt"),
+        {"PtID": "category", "CGMValue": "float32"},
+        subjects=subjects,
+    )
     cgm2.rename(columns={"CGMValue": "CGM"}, inplace=True)
-    cgm3 = pd.read_csv(os.path.join(data_source, "OtherCGM.txt"), sep="|")
-    cgm_all = pd.concat([cgm1, cgm2, cgm3])
+    cgm3 = stage_table(
+        os.path.join(data_source, "OtherCGM.txt"),
+        {"PtID": "category", "CGM": "float32"},
+        subjects=subjects,
+    )
+    # PtID and source stay categorical across the three CGM sources
+    cgm_all = concat_frames(
+        [_label_source(cgm1, "clarity"), _label_source(cgm2, "tandem"), _label_source(cgm3, "other")]
+    )
 
-    basal_all = pd.read_csv(os.path.join(data_source, "DCLP5TandemBASALRATECHG_b.txt"), sep="|")
-    bolus_all = pd.read_csv(
-        os.path.join(data_source, "DCLP5TandemBolus_Completed_Combined_b.txt"), sep="|"
+    basal_all = stage_table(
+        os.path.join(data_source, "DCLP5TandemBASALRATECHG_b.txt"),
+        {"PtID": "category", "CommandedBasalRate": "float32"},
+        subjects=subjects,
+    )
+    bolus_all = stage_table(
+        os.path.join(data_source, "DCLP5TandemBolus_Completed_Combined_b.txt"),
+        {"PtID": "category", "BolusAmount": "float32"},
+        subjects=subjects,
     )
 
-    smbg_all = pd.read_csv(os.path.join(data_source, "RocheMeter.txt"), sep="|")
+    smbg_all = stage_table(
+        os.path.join(data_source, "RocheMeter.txt"),
+        {"PtID": "category", "BG": "float32"},
+        subjects=subjects,
+    )
 
-    phys_all = pd.read_csv(os.path.join(data_source, "DiabPhysExam.txt"), sep="|")
-    insulin_all = pd.read_csv(os.path.join(data_source, "Insulin.txt"), sep="|")
+    phys_all = stage_table(os.path.join(data_source, "DiabPhysExam.txt"), {"PtID": "category"}, subjects=subjects)
+    insulin_all = stage_table(os.path.join(data_source, "Insulin.txt"), {"PtID": "category"}, subjects=subjects)
     insulin_all = insulin_all[insulin_all["InsRoute"] == "Pump"]
     insulin_all["InsTypeStartDt"] = pd.to_datetime(
         insulin_all["InsTypeStartDt"], errors="coerce"
@@ -57,26 +108,56 @@ def preprocess_dclp5(data_source):
     }
 
 
-def process_subj_dclp5(cgm, basal, bolus, insulin, smbg, phys, subject_id, output_file):
-    """Process a single DCLP5 subject and write a DIAX JSON file."""
-    cgm.loc[:, "time"] = cgm["DataDtTm_adjusted"].fillna(cgm["DataDtTm"]).apply(_parse_mixed)
-    cgm_data = cgm
+def process_subj_dclp5(
+    cgm,
+    basal,
+    bolus,
+    insulin,
+    smbg,
+    phys,
+    subject_id,
+    output_file,
+    cgm_tolerance=DEFAULT_TOLERANCE,
+    cgm_priority=CGM_SOURCES,
+    options=OutputOptions(),
+):
+    """Process a single DCLP5 subject and write a DIAX JSON file.
+
+    ``options.start``/``options.end`` restrict every time series to that
+    window. Readings repeated by several CGM sources (within
+    ``cgm_tolerance`` seconds) are kept once, from the first source in
+    ``cgm_priority``.
+
+    Returns:
+        Number of duplicate CGM readings dropped, or False if skipped.
+    """
+    cgm.loc[:, "time"] = parse_mixed(cgm["DataDtTm_adjusted"].fillna(cgm["DataDtTm"]))
+    cgm_data, duplicates = merge_sources(cgm, cgm_priority, cgm_tolerance)
 
     # Basal
-    basal.loc[:, "time"] = basal["DataDtTm_adjusted"].fillna(basal["DataDtTm"]).apply(_parse_mixed)
+    basal.loc[:, "time"] = parse_mixed(basal["DataDtTm_adjusted"].fillna(basal["DataDtTm"]))
     basal_data = basal
 
     # Bolus
-    bolus.loc[:, "time"] = bolus["DataDtTm_adjusted"].fillna(bolus["DataDtTm"]).apply(_parse_mixed)
+    bolus.loc[:, "time"] = parse_mixed(bolus["DataDtTm_adjusted"].fillna(bolus["DataDtTm"]))
     bolus_data = bolus
 
     # SMBG
     smbg.loc[:, "time"] = pd.to_datetime(smbg["DataDtTm"], format="%Y-%m-%d %H:%M:%S")
     smbg_data = smbg
 
+    # Time window
+    cgm_data = in_window(cgm_data, options.start, options.end)
+    basal_data = in_window(basal_data, options.start, options.end)
+    bolus_data = in_window(bolus_data, options.start, options.end)
+    smbg_data = in_window(smbg_data, options.start, options.end)
+    if not any(len(df) for df in (cgm_data, basal_data, bolus_data, smbg_data)):
+        print(f"Subject {subject_id} has no data between {options.start} and {options.end}, skipping.")
+        return False
+
     def normalize(df, col):
         df = df.copy()
-        df.loc[:, col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        df.loc[:, col] = format_times(df[col])
         return df.sort_values(col).reset_index(drop=True)
 
     cgm_data = normalize(cgm_data, "time")
@@ -84,13 +165,7 @@ def process_subj_dclp5(cgm, basal, bolus, insulin, smbg, phys, subject_id, outpu
     bolus_data = normalize(bolus_data, "time")
     smbg_data = normalize(smbg_data, "time")
 
-    start_times = [
-        cgm_data["time"].min(),
-        basal_data["time"].min(),
-        bolus_data["time"].min(),
-        smbg_data["time"].min(),
-    ]
-    start_time = min(start_times)
+    start_time = first_time(cgm_data, basal_data, bolus_data, smbg_data)
 
     ins_string = "UNKNOWN"
     if len(insulin) > 1:
@@ -192,35 +267,77 @@ def process_subj_dclp5(cgm, basal, bolus, insulin, smbg, phys, subject_id, outpu
         "smbg": {"time": smbg_data["time"].tolist(), "value": smbg_data["BG"].tolist()},
     }
 
-    with open(output_file, "w") as f:
-        json.dump(output, f, indent=2, default=str)
-
-
-def process_all_dclp5(data_source, output_dir):
-    """Process all DCLP5 subjects from the source directory."""
+    save_subject(output, output_file, options)
+    return duplicates
+
+
+def process_all_dclp5(
+    data_source,
+    output_dir,
+    jobs=1,
+    subjects=None,
+    cgm_tolerance=DEFAULT_TOLERANCE,
+    cgm_priority=CGM_SOURCES,
+    options=OutputOptions(),
+):
+    """Process all DCLP5 subjects from the source directory.
+
+    Subjects whose output is current in the output manifest are skipped
+    unless ``options.force`` is set. ``subjects`` limits the conversion to
+    those PtIDs; ``options`` (``OutputOptions``) also sets the format, the
+    inclusive window of local time, compaction and the study summary.
+    ``cgm_tolerance`` and ``cgm_priority`` control the merge of the
+    overlapping CGM sources (see ``cgm_merge.merge_sources``).
+
+    Raises:
+        ValueError: If ``cgm_priority`` names a source not in ``CGM_SOURCES``.
+    """
+    check_cgm_priority(cgm_priority)
     os.makedirs(output_dir, exist_ok=True)
-    prep = preprocess_dclp5(data_source)
-
-    cgm_all = prep["cgm_all"]
-    basal_all = prep["basal_all"]
-    bolus_all = prep["bolus_all"]
-    insulin_all = prep["insulin_all"]
-    smbg_all = prep["smbg_all"]
-    phys_all = prep["phys_all"]
-    subjects = prep["subjects"]
-
-    for subject_id in subjects:
-        cgm = cgm_all[cgm_all["PtID"] == subject_id].copy()
-        basal = basal_all[basal_all["PtID"] == subject_id].copy()
-        bolus = bolus_all[bolus_all["PtID"] == subject_id].copy()
-        insulin = insulin_all[insulin_all["PtID"] == subject_id].copy()
-        smbg = smbg_all[smbg_all["PtID"] == subject_id].copy()
-        phys = phys_all[phys_all["PtID"] == subject_id].copy()
-
-        output_file = os.path.join(output_dir, f"DCLP5_subject_{subject_id}.json")
-        process_subj_dclp5(cgm, basal, bolus, insulin, smbg, phys, subject_id, output_file)
-
-    return len(subjects)
+    manifest = OutputManifest(
+        output_dir,
+        source_fingerprints(data_source),
+        CONVERTER_VERSION,
+        options,
+        subset=subjects is not None,
+        extra={"cgm_tolerance": cgm_tolerance, "cgm_priority": list(cgm_priority)},
+    )
+    if manifest.up_to_date():
+        print(f"{output_dir} is up to date.")
+        update_study_summary(output_dir, manifest, options)
+        return 0
+
+    prep = preprocess_dclp5(data_source, subjects)
+    outputs = {
+        subject_id: os.path.join(output_dir, f"DCLP5_subject_{subject_id}{options.suffix}")
+        for subject_id in prep["subjects"]
+    }
+    subjects = manifest.pending(outputs)
+
+    # row positions of every subject, built once per table
+    names = ["cgm_all", "basal_all", "bolus_all", "insulin_all", "smbg_all", "phys_all"]
+    tables = SubjectTables({name: prep[name] for name in names}, "PtID")
+
+    def tasks():
+        for subject_id in subjects:
+            cgm, basal, bolus, insulin, smbg, phys = (tables.take(name, subject_id) for name in names)
+
+            output_file = outputs[subject_id]
+            yield (
+                subject_id,
+                (cgm, basal, bolus, insulin, smbg, phys, subject_id, output_file),
+                {"cgm_tolerance": cgm_tolerance, "cgm_priority": cgm_priority, "options": options},
+            )
+
+    with manifest:
+        report = run_subjects(
+            tasks(), process_subj_dclp5, jobs=jobs, desc="DCLP5", total=len(subjects), on_done=manifest.on_done
+        )
+    update_study_summary(output_dir, manifest, options)
+    converted = converted_results(report)
+    if converted:
+        print(f"Dropped {sum(converted)} duplicate CGM readings from overlapping sources.")
+    return len(converted)
 
 
 if __name__ == "__main__":
@@ -229,7 +346,35 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process all DCLP5 subjects.")
     parser.add_argument("--source", required=True, help="Path to DCLP5 data directory.")
     parser.add_argument("--output", required=True, help="Output directory for JSON files.")
+    add_runner_arguments(parser)
+    add_selection_arguments(parser)
+    add_output_arguments(parser)
+    parser.add_argument(
+        "--cgm-tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Seconds within which readings of two CGM sources are duplicates "
+        f"(default: {DEFAULT_TOLERANCE}).",
+    )
+    parser.add_argument(
+        "--cgm-priority",
+        type=parse_list,
+        default=CGM_SOURCES,
+        help=f"Comma-separated CGM sources, most trusted first (default: {','.join(CGM_SOURCES)}).",
+    )
     args = parser.parse_args()
-
-    count = process_all_dclp5(args.source, args.output)
+    try:
+        check_cgm_priority(args.cgm_priority)
+    except ValueError as err:
+        parser.error(str(err))
+
+    count = process_all_dclp5(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        subjects=args.subjects,
+        cgm_tolerance=args.cgm_tolerance,
+        cgm_priority=args.cgm_priority,
+        options=OutputOptions.from_args(args),
+    )
     print(f"Processed {count} subjects.")
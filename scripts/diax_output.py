@@ -0,0 +1,401 @@
+import dataclasses
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+import utils_path  # noqa: F401 (the DIAX reader/writer lives in utils/python)
+from diax_io import FORMATS, diax_suffix, write_diax
+from staging import atomic_replace, fingerprint
+from summary import remove_study_summary, save_summary, summarize_subject, write_study_summary
+from timestamps import parse_wall_times
+
+
+logger = logging.getLogger(__name__)
+
+# hidden and without a .json suffix, so globs for subject files skip it
+MANIFEST = ".diax_manifest"
+
+# streams that compact under the key definitions (README): a basal rate holds
+# until the next sample, so a repeat of the previous rate adds nothing, and in
+# an event stream a zero is no event at all
+COMPACTION = {
+    "basal_rate": (
+        "run_length",
+        "Rows repeating the previous rate were removed, keeping one row at least every 24 hours; "
+        "a rate holds until the next row.",
+    ),
+    "bolus": ("drop_zero", "Zero-valued rows were removed; a missing row means no bolus."),
+    "carbs": ("drop_zero", "Zero-valued rows were removed; a missing row means no carbs."),
+    "steps": ("drop_zero", "Zero-valued rows were removed; a missing row means no steps."),
+}
+
+# run_length works on the bins of time_align at this period, and keeps a row
+# within its basal_rate missing_tolerance (1440 min) so the rate is still filled
+COMPACTION_PERIOD = np.timedelta64(5, "m")
+COMPACTION_HEARTBEAT = np.timedelta64(24, "h")
+
+# recorded for compacted output in the manifest; bump when compact_streams
+# keeps other rows, so compacted files are written again
+COMPACTION_VERSION = 2
+
+
+def _run_length_keep(times, values):
+    """Rows of a rate stream to keep, by bins of ``COMPACTION_PERIOD``.
+
+    ``time_align`` averages the rows of each bin and forward-fills empty
+    bins, so a bin is dropped only when it and the previous non-empty bin
+    hold one rate and nothing else; the fill then restores it. The first
+    and last bins are kept, and no two kept bins are more than
+    ``COMPACTION_HEARTBEAT`` apart unless the stream itself has that gap.
+    """
+    # right-closed bins counted from midnight of the first day, as resample does
+    offsets = times - times[0].astype("datetime64[D]")
+    bins = -(-offsets // COMPACTION_PERIOD)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    ends = np.r_[starts[1:], len(bins)]
+    first = values[starts]
+    flat = np.logical_and.reduceat(values == np.repeat(first, ends - starts), starts) & ~np.isnan(first)
+    repeat = np.r_[False, flat[1:] & flat[:-1] & (first[1:] == first[:-1])]
+
+    heartbeat = COMPACTION_HEARTBEAT // COMPACTION_PERIOD
+    bin_ids = bins[starts]
+    kept = np.ones(len(starts), dtype=bool)
+    last = bin_ids[0]
+    for i in range(1, len(starts) - 1):
+        if repeat[i] and bin_ids[i + 1] - last <= heartbeat:
+            kept[i] = False
+        else:
+            last = bin_ids[i]
+    return np.repeat(kept, ends - starts)
+
+
+def compact_streams(output):
+    """Drop the rows of a converted subject that the key definitions make redundant.
+
+    ``basal_rate`` drops repeats of the previous rate (``_run_length_keep``);
+    ``bolus``, ``carbs`` and ``steps`` lose their zero-valued rows. Rows are
+    taken in time order, the first and last row of a stream are kept so its
+    period stays the same, and rows without a value or time are always kept.
+    ``time_align`` at 5-minute sampling, with its default strategies, gives
+    the same frame for the compacted file; other periods can differ where a
+    bin mixes rates. Each compacted stream records the method and its row
+    counts under ``metadata[<stream>]["compaction"]``. Streams that are not
+    numeric ``{"time", "value"}`` lists are left as they are.
+
+    Returns:
+        ``output``, modified in place.
+    """
+    metadata = output.setdefault("metadata", {})
+    for key, (method, description) in COMPACTION.items():
+        stream = output.get(key)
+        if not isinstance(stream, dict) or not isinstance(stream.get("value"), list):
+            continue
+        try:
+            values = np.asarray(stream["value"], dtype=float)
+        except (TypeError, ValueError):
+            continue
+        times = parse_wall_times(stream["time"])
+        timed = np.flatnonzero(~np.isnat(times))
+        order = timed[np.argsort(times[timed], kind="stable")]
+        keep = np.ones(len(values), dtype=bool)
+        if len(order) > 2:
+            if method == "run_length":
+                keep[order] = _run_length_keep(times[order], values[order])
+            else:
+                keep[order[1:-1]] = values[order[1:-1]] != 0
+        stream["time"] = list(itertools.compress(stream["time"], keep))
+        stream["value"] = list(itertools.compress(stream["value"], keep))
+        metadata.setdefault(key, {})["compaction"] = {
+            "method": method,
+            "description": description,
+            "rows": len(values),
+            "kept": int(keep.sum()),
+        }
+    return output
+
+
+@dataclasses.dataclass(frozen=True)
+class OutputOptions:
+    """How a converter writes its subjects, shared by every converter.
+
+    Built from a CLI by ``from_args`` and passed as one object to
+    ``process_all_*``, the per-subject functions, ``save_subject`` and
+    ``OutputManifest``.
+
+    Attributes:
+        fmt: Output format, one of ``FORMATS``.
+        start: Earliest local time kept in every stream, or None.
+        end: Latest local time kept in every stream, or None.
+        compact: Drop redundant stream rows (``compact_streams``).
+        summary: Also write the study summary tables (``write_study_summary``).
+        force: Convert every subject, even those whose output is up to date.
+    """
+
+    fmt: str = "json"
+    start: Optional[str] = None
+    end: Optional[str] = None
+    compact: bool = False
+    summary: bool = False
+    force: bool = False
+
+    @classmethod
+    def from_args(cls, args):
+        """Options of a CLI built with ``add_output_arguments`` and ``add_selection_arguments``."""
+        return cls(
+            fmt=args.format,
+            start=args.start,
+            end=args.end,
+            compact=args.compact,
+            summary=args.summary,
+            force=args.force,
+        )
+
+    @property
+    def suffix(self):
+        """File suffix of the output format (``diax_suffix``)."""
+        return diax_suffix(self.fmt)
+
+    def manifest_key(self, **extra):
+        """The options that change the written files, plus a converter's ``extra`` ones.
+
+        ``summary`` is not among them: the study tables are derived from the
+        files (``update_study_summary``), so adding it does not reconvert.
+        ``compact`` is recorded as ``COMPACTION_VERSION``.
+        """
+        compact = COMPACTION_VERSION if self.compact else False
+        return {"format": self.fmt, "start": self.start, "end": self.end, "compact": compact, **extra}
+
+
+def save_subject(output, output_file, options=OutputOptions()):
+    """Write one converted subject atomically; compression follows the file suffix.
+
+    With ``options.summary`` the subject's metrics and daily rollups are
+    computed from ``output``, before any compaction, and kept for the study
+    table (``write_study_summary``); with ``options.compact`` the streams
+    are compacted (``compact_streams``).
+    """
+    summary = summarize_subject(output) if options.summary else None
+    if options.compact:
+        compact_streams(output)
+    # the temporary name keeps the suffix, so write_diax picks the same format
+    atomic_replace(lambda tmp: write_diax(output, tmp), output_file)
+    if summary is not None:
+        save_summary(summary, output_file)
+    return output_file
+
+
+def update_study_summary(output_dir, manifest, options):
+    """Bring the study summary tables of ``output_dir`` in line with its files.
+
+    With ``options.summary`` the tables are written for every file in the
+    ``manifest``, up to date or not; summaries missing for files converted
+    without ``--summary`` are computed from the files. Otherwise tables of
+    an earlier run are removed once this run has rewritten a file, as they
+    no longer describe the output.
+
+    Returns:
+        Path of the subject table, or None.
+    """
+    if options.summary:
+        return write_study_summary(output_dir, manifest.entries)
+    if manifest.written:
+        remove_study_summary(output_dir)
+    return None
+
+
+def add_output_arguments(parser):
+    """Add the shared ``--format``, ``--compact``, ``--summary`` and ``--force`` options for converter output."""
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="json",
+        help="Output file format: compact JSON, optionally gzip- or zstd-compressed, or binary (default: json).",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Drop redundant rows: repeated basal rates (one is kept every 24 h) and zero-valued "
+        "bolus, carbs and steps rows. The compaction is recorded in the metadata.",
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Also write summary.parquet (metrics per subject) and summary_daily.parquet (daily rollups) "
+        "to the output directory, computed while converting.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Convert every subject, even those whose output is up to date.",
+    )
+    return parser
+
+
+def source_fingerprints(directory, recursive=False):
+    """Fingerprints of the source files in ``directory``, keyed by relative path.
+
+    Hidden files and subdirectories (staged caches, unless ``recursive``)
+    are left out.
+    """
+    sources = {}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".")) if recursive else []
+        for name in sorted(files):
+            if not name.startswith("."):
+                path = os.path.join(root, name)
+                sources[os.path.relpath(path, directory)] = fingerprint(path)
+    return sources
+
+
+def _sources_hash(sources):
+    """Short, order-independent digest of a ``source_fingerprints`` dict."""
+    return hashlib.sha256(json.dumps(sources, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class OutputManifest:
+    """Record of the converted subjects of one output directory.
+
+    The fingerprints of the source files are stored once; for each output
+    file the manifest keeps the subject, a digest of the fingerprints, the
+    converter version and output options it was built with, and the size
+    and mtime of the file. A subject is current while all of these still
+    match, so a rerun only converts subjects that are missing, stale or
+    were interrupted.
+
+    Typical use in a converter::
+
+        manifest = OutputManifest(output_dir, source_fingerprints(data_source), CONVERTER_VERSION, options)
+        if manifest.up_to_date():
+            return 0
+        todo = manifest.pending({subject: output_file(subject) for subject in subjects})
+        with manifest:
+            run_subjects(..., on_done=manifest.on_done)
+
+    Leaving the ``with`` block saves the manifest, also when the run is
+    interrupted; it is marked complete if no subject failed.
+
+    Args:
+        output_dir: Directory holding the converted files and the manifest.
+        sources: ``source_fingerprints`` of the converter's inputs.
+        version: The converter's ``CONVERTER_VERSION``. Each converter bumps
+            its own whenever a change alters the files it writes, so outputs
+            of the older code are rebuilt on the next run.
+        options: ``OutputOptions`` of the run; those that change the output
+            are recorded (``OutputOptions.manifest_key``), and with
+            ``options.force`` every subject is treated as stale.
+        subset: Only some subjects are being converted (e.g. a patient
+            filter), so the run is never marked complete.
+        extra: Converter-specific options that change the output.
+    """
+
+    def __init__(self, output_dir, sources, version, options=OutputOptions(), subset=False, extra=None):
+        self.path = os.path.join(output_dir, MANIFEST)
+        self.sources = sources
+        self.sources_hash = _sources_hash(sources)
+        self.version = version
+        self.options = options.manifest_key(**(extra or {}))
+        self.force = options.force
+        self.subset = subset
+        self.entries = {}
+        self.written = 0
+        self.complete = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                stored = json.load(f)
+            self.entries = stored.get("subjects", {})
+            self.complete = (
+                stored.get("complete", False)
+                and stored.get("sources") == sources
+                and stored.get("version") == version
+                and stored.get("options") == self.options
+            )
+        self._outputs = {}
+        self._failed = 0
+        self._saved_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.save(complete=exc_type is None and not self._failed and not self.subset)
+        return False
+
+    def current(self, output_file):
+        """Whether ``output_file`` exists and was built from the current inputs."""
+        if self.force:
+            return False
+        entry = self.entries.get(os.path.basename(output_file))
+        if entry is None or not os.path.exists(output_file):
+            return False
+        built_with = (entry.get("sources_hash"), entry.get("version"), entry.get("options"))
+        if built_with != (self.sources_hash, self.version, self.options):
+            return False
+        out = fingerprint(output_file)
+        return entry["size"] == out["size"] and entry["mtime_ns"] == out["mtime_ns"]
+
+    def up_to_date(self):
+        """True if the last complete run used these inputs and all its outputs are current."""
+        return (
+            not self.force
+            and self.complete
+            and all(self.current(os.path.join(os.path.dirname(self.path), name)) for name in self.entries)
+        )
+
+    def pending(self, outputs):
+        """Subjects of ``{subject: output_file}`` that need converting, in order."""
+        todo = {subject: path for subject, path in outputs.items() if not self.current(path)}
+        self._outputs.update(todo)
+        if len(todo) < len(outputs):
+            logger.info("%d of %d subjects are up to date", len(outputs) - len(todo), len(outputs))
+        return list(todo)
+
+    def record(self, subject, output_file):
+        """Add a freshly written output to the manifest."""
+        self.written += 1
+        out = fingerprint(output_file)
+        self.entries[os.path.basename(output_file)] = {
+            "subject": str(subject),
+            "sources_hash": self.sources_hash,
+            "version": self.version,
+            "options": self.options,
+            "size": out["size"],
+            "mtime_ns": out["mtime_ns"],
+        }
+        # save now and then, so an interrupted run keeps most of its progress
+        if time.monotonic() - self._saved_at > 10:
+            self.save()
+
+    def on_done(self, subject, ok, value):
+        """``run_subjects`` callback: record subjects whose output was written.
+
+        A subject function returning ``False`` skipped the subject (e.g. a
+        missing table), so an older file left under its name is not recorded.
+        """
+        output_file = self._outputs.get(subject)
+        if not ok:
+            self._failed += 1
+        elif value is not False and output_file is not None and os.path.exists(output_file):
+            self.record(subject, output_file)
+
+    def save(self, complete=False):
+        """Write the manifest; ``complete`` marks a full run without failures."""
+        manifest = {
+            "sources": self.sources,
+            "version": self.version,
+            "options": self.options,
+            "complete": complete,
+            "subjects": self.entries,
+        }
+
+        def write(tmp):
+            with open(tmp, "w") as f:
+                json.dump(manifest, f, indent=2)
+
+        atomic_replace(write, self.path)
+        self._saved_at = time.monotonic()
@@ -1,25 +1,33 @@
-import json
 import os
 
 import numpy as np
 import pandas as pd
 
+from diax_output import (
+    OutputManifest,
+    OutputOptions,
+    add_output_arguments,
+    save_subject,
+    source_fingerprints,
+    update_study_summary,
+)
+from runner import add_runner_arguments, add_selection_arguments, converted_results, run_subjects
+from staging import SubjectTables, stage_table
+from timestamps import first_time, format_times, in_window, parse_mixed
 
-def _parse_mixed(x):
-    """Parse mixed datetime formats (with/without time)."""
-    for fmt in ("%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y"):
-        try:
-            return pd.to_datetime(x, format=fmt)
-        except (ValueError, TypeError):
-            continue
-    return pd.NaT
 
+CONVERTER_VERSION = 1
 
-def preprocess_iobp2(data_source):
-    """Load and pre-process IOBP2 source tables."""
-    dset_all = pd.read_csv(os.path.join(data_source, "IOBP2DeviceiLet.txt"), sep="|")
 
-    insulin_all = pd.read_csv(os.path.join(data_source, "IOBP2Insulin.txt"), sep="|")
+def preprocess_iobp2(data_source, subjects=None):
+    """Load and pre-process IOBP2 source tables (parsed once, then cached as Parquet)."""
+    dset_all = stage_table(
+        os.path.join(data_source, "IOBP2DeviceiLet.txt"),
+        {"PtID": "category", "CGMVal": "float32"},
+        subjects=subjects,
+    )
+
+    insulin_all = stage_table(os.path.join(data_source, "IOBP2Insulin.txt"), {"PtID": "category"}, subjects=subjects)
     insulin_all = insulin_all[insulin_all["InsRoute"] == "Pump"]
     insulin_all["InsTypeStartDt"] = pd.to_datetime(
         insulin_all["InsTypeStartDt"], errors="coerce"
@@ -28,11 +36,20 @@ def preprocess_iobp2(data_source):
         insulin_all["InsTypeStopDt"], errors="coerce"
     )
 
-    height_weight = pd.read_csv(os.path.join(data_source, "IOBP2HeightWeight.txt"), sep="|")
+    height_weight = stage_table(
+        os.path.join(data_source, "IOBP2HeightWeight.txt"),
+        {"PtID": "category"},
+        subjects=subjects,
+    )
 
-    smbg_all = pd.read_csv(os.path.join(data_source, "IOBP2DeviceBGM.txt"), sep="|")
+    smbg_all = stage_table(
+        os.path.join(data_source, "IOBP2DeviceBGM.txt"),
+        {"PtID": "category", "BGMVal": "float32"},
+        subjects=subjects,
+    )
 
-    subjects = list(set(dset_all["PtID"].unique()))
+    # numpy ints, as read_csv gave them: unique_id is written through default=str
+    subjects = list(set(dset_all["PtID"].unique().astype("int64")))
 
     return {
         "dset_all": dset_all,
@@ -43,11 +60,22 @@ def preprocess_iobp2(data_source):
     }
 
 
-def process_subj_iobp2(dset, insulin, smbg, hw, subject_id, output_file):
-    """Process a single IOBP2 subject and write a DIAX JSON file."""
+def process_subj_iobp2(
+    dset,
+    insulin,
+    smbg,
+    hw,
+    subject_id,
+    output_file,
+    options=OutputOptions(),
+):
+    """Process a single IOBP2 subject and write a DIAX JSON file.
+
+    ``options.start``/``options.end`` restrict every time series to that window.
+    """
     # get datetime
-    dset.loc[:, "time"] = dset["DeviceDtTm"].apply(_parse_mixed)
-    smbg.loc[:, "time"] = smbg["DeviceDtTm"].apply(_parse_mixed)
+    dset.loc[:, "time"] = parse_mixed(dset["DeviceDtTm"])
+    smbg.loc[:, "time"] = parse_mixed(smbg["DeviceDtTm"])
 
     # get time delta (used for computing basal rate in u/hr)
     dset.loc[:, "time_delta"] = dset.loc[:, "time"].diff()
@@ -81,24 +109,25 @@ def process_subj_iobp2(dset, insulin, smbg, hw, subject_id, output_file):
 
     smbg_data = smbg[["time", "BGMVal"]]
 
+    # Time window, applied after the rates so the first one keeps its interval
+    cgm_data = in_window(cgm_data, options.start, options.end)
+    basal_data = in_window(basal_data, options.start, options.end)
+    bolus_data = in_window(bolus_data, options.start, options.end)
+    carb_data = in_window(carb_data, options.start, options.end)
+    smbg_data = in_window(smbg_data, options.start, options.end)
+    if not any(len(df) for df in (cgm_data, basal_data, bolus_data, carb_data, smbg_data)):
+        print(f"Subject {subject_id} has no data between {options.start} and {options.end}, skipping.")
+        return False
+
     # Time normalizing
-    start_times = [
-        cgm_data["time"].min(),
-        basal_data["time"].min(),
-        bolus_data["time"].min(),
-        smbg_data["time"].min(),
-        carb_data["time"].min(),
-    ]
-    # Filter out any NaT values before taking the min
-    start_times = [t for t in start_times if pd.notna(t)]
-    start_time = min(start_times)
+    start_time = first_time(cgm_data, basal_data, bolus_data, smbg_data, carb_data)
 
     def normalize(df, col):
         if len(df) == 0:
             return df
 
         df = df.copy()
-        df.loc[:, col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        df.loc[:, col] = format_times(df[col])
         return df.sort_values(col).reset_index(drop=True)
 
     cgm_data = normalize(cgm_data, "time")
@@ -225,31 +254,58 @@ def process_subj_iobp2(dset, insulin, smbg, hw, subject_id, output_file):
         "weight": weight_data,
     }
 
-    with open(output_file, "w") as f:
-        json.dump(output, f, indent=2, default=str)
+    save_subject(output, output_file, options)
 
 
-def process_all_iobp2(data_source, output_dir):
-    """Process all IOBP2 subjects from the source directory."""
-    os.makedirs(output_dir, exist_ok=True)
-    prep = preprocess_iobp2(data_source)
-
-    dset_all = prep["dset_all"]
-    insulin_all = prep["insulin_all"]
-    smbg_all = prep["smbg_all"]
-    height_weight = prep["height_weight"]
-    subjects = prep["subjects"]
+def process_all_iobp2(data_source, output_dir, jobs=1, subjects=None, options=OutputOptions()):
+    """Process all IOBP2 subjects from the source directory.
 
-    for subject_id in subjects:
-        dset = dset_all[dset_all["PtID"] == subject_id].copy()
-        insulin = insulin_all[insulin_all["PtID"] == subject_id].copy()
-        smbg = smbg_all[smbg_all["PtID"] == subject_id].copy()
-        hw = height_weight[height_weight["PtID"] == subject_id].copy()
-
-        output_file = os.path.join(output_dir, f"IOBP2_subject_{subject_id}.json")
-        process_subj_iobp2(dset, insulin, smbg, hw, subject_id, output_file)
-
-    return len(subjects)
+    Subjects whose output is current in the output manifest are skipped
+    unless ``options.force`` is set. ``subjects`` limits the conversion to
+    those PtIDs; ``options`` (``OutputOptions``) also sets the format, the
+    inclusive window of local time, compaction and the study summary.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = OutputManifest(
+        output_dir,
+        source_fingerprints(data_source),
+        CONVERTER_VERSION,
+        options,
+        subset=subjects is not None,
+    )
+    if manifest.up_to_date():
+        print(f"{output_dir} is up to date.")
+        update_study_summary(output_dir, manifest, options)
+        return 0
+
+    prep = preprocess_iobp2(data_source, subjects)
+    outputs = {
+        subject_id: os.path.join(output_dir, f"IOBP2_subject_{subject_id}{options.suffix}")
+        for subject_id in prep["subjects"]
+    }
+    subjects = manifest.pending(outputs)
+
+    # row positions of every subject, built once per table
+    names = ["dset_all", "insulin_all", "smbg_all", "height_weight"]
+    tables = SubjectTables({name: prep[name] for name in names}, "PtID")
+
+    def tasks():
+        for subject_id in subjects:
+            dset, insulin, smbg, hw = (tables.take(name, subject_id) for name in names)
+
+            output_file = outputs[subject_id]
+            yield (
+                subject_id,
+                (dset, insulin, smbg, hw, subject_id, output_file),
+                {"options": options},
+            )
+
+    with manifest:
+        report = run_subjects(
+            tasks(), process_subj_iobp2, jobs=jobs, desc="IOBP2", total=len(subjects), on_done=manifest.on_done
+        )
+    update_study_summary(output_dir, manifest, options)
+    return len(converted_results(report))
 
 
 if __name__ == "__main__":
@@ -258,7 +314,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process all IOBP2 subjects.")
     parser.add_argument("--source", required=True, help="Path to IOBP2 data directory.")
     parser.add_argument("--output", required=True, help="Output directory for JSON files.")
+    add_runner_arguments(parser)
+    add_selection_arguments(parser)
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    count = process_all_iobp2(args.source, args.output)
+    count = process_all_iobp2(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        subjects=args.subjects,
+        options=OutputOptions.from_args(args),
+    )
     print(f"Processed {count} subjects.")
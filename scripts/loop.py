@@ -1,15 +1,26 @@
-import json
 import os
-import glob
 import logging
 from datetime import timezone, timedelta
 
 import numpy as np
 import pandas as pd
 
+from diax_output import (
+    OutputManifest,
+    OutputOptions,
+    add_output_arguments,
+    save_subject,
+    source_fingerprints,
+    update_study_summary,
+)
+from runner import add_runner_arguments, add_selection_arguments, converted_results, run_subjects
+from staging import partition_csv, partition_values, read_partition
+from timestamps import format_times, in_window
+
 
 logger = logging.getLogger(__name__)
 
+CONVERTER_VERSION = 1
 
 CGM_FILES = [
     "LOOPDeviceCGM1.txt",
@@ -27,71 +38,92 @@ BASAL_FILES = [
 ]
 
 
-def preprocess_loop(data_source):
+CGM_COLUMNS = ["PtID", "UTCDtTm", "CGMVal", "Units", "OriginDeviceManufact", "OriginDeviceModel"]
+BASAL_COLUMNS = ["PtID", "UTCDtTm", "Rate", "OriginDeviceManufact", "OriginDeviceModel"]
+
+# dtype plan of the source tables: categoricals for repeated strings, a small
+# (nullable) int for PtID, and glucose and basal rates read as float so every
+# chunk gets a float column, narrowed to float32 where that is exact. Bolus and
+# carb amounts keep the inferred type (they are coerced per subject).
+DTYPES = {
+    "PtID": "Int32",
+    "CGMVal": "float32",
+    "BGMVal": "float32",
+    "Rate": "float32",
+    "Units": "category",
+    "CarbUnits": "category",
+    "OriginDeviceManufact": "category",
+    "OriginDeviceModel": "category",
+}
+
+# event tables: dataset directory -> (source file, columns)
+EVENT_TABLES = {
+    "LOOP_BGM": (
+        "LOOPDeviceBGM.txt",
+        ["PtID", "UTCDtTm", "BGMVal", "Units", "OriginDeviceManufact", "OriginDeviceModel"],
+    ),
+    "LOOP_BOLUS": (
+        "LOOPDeviceBolus.txt",
+        ["PtID", "UTCDtTm", "Normal", "Extended", "OriginDeviceManufact", "OriginDeviceModel"],
+    ),
+    "LOOP_FOOD": (
+        "LOOPDeviceFood.txt",
+        ["PtID", "UTCDtTm", "CarbsNet", "CarbUnits"],
+    ),
+}
+
+
+def preprocess_loop(data_source, subjects=None):
     """Load and pre-process Loop source tables.
 
-    Creates per-subject pickles for CGM and basal to avoid re-loading the
-    full tables for each subject.
+    Streams each CGM, basal, BGM, bolus and food table once and partitions
+    the rows by subject into Parquet datasets (``LOOP_CGM/``, ``LOOP_BASAL/``,
+    ...), so each subject is later read directly without re-loading the full
+    tables. Interrupted runs resume from the last fully partitioned file.
+    With ``subjects``, only their rows are partitioned (unless the full
+    tables already are).
     """
 
-    # CGM (chunked per subject)
-    cgm_pkls = glob.glob(os.path.join(data_source, "LOOP_CGM_*.pkl"))
-    if not cgm_pkls:
-        for fname in CGM_FILES:
-            path = os.path.join(data_source, fname)
-            if not os.path.exists(path):
-                continue
-            chunk = pd.read_csv(
-                path,
-                sep="|",
-                usecols=["PtID", "UTCDtTm", "CGMVal", "Units", "OriginDeviceManufact", "OriginDeviceModel"],
-            )
-
-            logger.info("Processing CGM %s", fname)
-            for subj, df_subj in chunk.groupby("PtID"):
-                subj_path = os.path.join(data_source, f"LOOP_CGM_{int(subj)}.pkl")
-                if os.path.exists(subj_path):
-                    df_existing = pd.read_pickle(subj_path)
-                    pd.concat([df_existing, df_subj], ignore_index=True).to_pickle(subj_path)
-                else:
-                    df_subj.to_pickle(subj_path)
-        cgm_pkls = glob.glob(os.path.join(data_source, "LOOP_CGM_*.pkl"))
-
-    # Basal (chunked per subject)
-    basal_pkls = glob.glob(os.path.join(data_source, "LOOP_BASAL_*.pkl"))
-    if not basal_pkls:
-        for fname in BASAL_FILES:
-            path = os.path.join(data_source, fname)
-            if not os.path.exists(path):
-                continue
-            chunk = pd.read_csv(
-                path,
-                sep="|",
-                usecols=["PtID", "UTCDtTm", "Rate", "OriginDeviceManufact", "OriginDeviceModel"],
-            )
-            logger.info("Processing basal chunk from %s", fname)
-            for subj, df_subj in chunk.groupby("PtID"):
-                subj_path = os.path.join(data_source, f"LOOP_BASAL_{int(subj)}.pkl")
-                if os.path.exists(subj_path):
-                    df_existing = pd.read_pickle(subj_path)
-                    pd.concat([df_existing, df_subj], ignore_index=True).to_pickle(subj_path)
-                else:
-                    df_subj.to_pickle(subj_path)
-        basal_pkls = glob.glob(os.path.join(data_source, "LOOP_BASAL_*.pkl"))
-
-    cgm_subjs = {
-        int(os.path.basename(f).replace("LOOP_CGM_", "").replace(".pkl", ""))
-        for f in cgm_pkls
-    }
-    basal_subjs = {
-        int(os.path.basename(f).replace("LOOP_BASAL_", "").replace(".pkl", ""))
-        for f in basal_pkls
-    }
+    cgm_dir = os.path.join(data_source, "LOOP_CGM")
+    partition_csv(
+        [os.path.join(data_source, fname) for fname in CGM_FILES],
+        cgm_dir,
+        "PtID",
+        usecols=CGM_COLUMNS,
+        dtype=DTYPES,
+        subjects=subjects,
+    )
+
+    basal_dir = os.path.join(data_source, "LOOP_BASAL")
+    partition_csv(
+        [os.path.join(data_source, fname) for fname in BASAL_FILES],
+        basal_dir,
+        "PtID",
+        usecols=BASAL_COLUMNS,
+        dtype=DTYPES,
+        subjects=subjects,
+    )
+
+    for name, (fname, usecols) in EVENT_TABLES.items():
+        partition_csv(
+            [os.path.join(data_source, fname)],
+            os.path.join(data_source, name),
+            "PtID",
+            usecols=usecols,
+            dtype=DTYPES,
+            subjects=subjects,
+        )
 
-    subjects = sorted(cgm_subjs.intersection(basal_subjs))
+    cgm_subjs = {int(v) for v in partition_values(cgm_dir, "PtID")}
+    basal_subjs = {int(v) for v in partition_values(basal_dir, "PtID")}
+
+    pt_ids = cgm_subjs.intersection(basal_subjs)
+    if subjects is not None:
+        wanted = {str(s) for s in subjects}
+        pt_ids = {pt_id for pt_id in pt_ids if str(pt_id) in wanted}
 
     return {
-        "subjects": subjects,
+        "subjects": sorted(pt_ids),
         "data_source": data_source,
     }
 
@@ -114,22 +146,14 @@ def _load_pt_timezone_offsets(data_source):
     return dict(zip(roster["PtID"], roster["PtTimezoneOffset"]))
 
 
-def _read_subject_table(path, usecols, subject_id, chunksize=500_000):
-    """Read a delimited file in chunks and filter by subject ID."""
+def _read_subject_table(data_source, name, subject_id):
+    """Read one subject's rows of a partitioned event table (empty if none)."""
 
-    if not os.path.exists(path):
+    usecols = EVENT_TABLES[name][1]
+    df = read_partition(os.path.join(data_source, name), "PtID", subject_id, columns=usecols)
+    if df is None:
         return pd.DataFrame(columns=usecols)
-
-    frames = []
-    for chunk in pd.read_csv(path, sep="|", usecols=usecols, chunksize=chunksize):
-        chunk = chunk[chunk["PtID"] == subject_id]
-        if len(chunk):
-            frames.append(chunk)
-
-    if frames:
-        return pd.concat(frames, ignore_index=True)
-
-    return pd.DataFrame(columns=usecols)
+    return df
 
 
 def _parse_time_utc(df, time_col="UTCDtTm"):
@@ -183,9 +207,7 @@ def _infer_device(mfg_series, model_series):
 def _iso_with_colon(series):
     """Format timestamps as ISO 8601 with timezone colon."""
 
-    return (
-        series.dt.strftime("%Y-%m-%d %H:%M:%S %Z").tolist()
-    )
+    return format_times(series, with_zone=True).tolist()
 
 
 def _start_end_duration(series_list):
@@ -201,8 +223,25 @@ def _start_end_duration(series_list):
     return start_time, end_time, duration_days
 
 
-def process_subj_loop(cgm, basal, bolus, bgm, carbs, subject_id, output_file, tz_offset_hours=None):
-    """Process a single Loop subject and write a DIAX JSON file."""
+def process_subj_loop(
+    cgm,
+    basal,
+    bolus,
+    bgm,
+    carbs,
+    subject_id,
+    output_file,
+    tz_offset_hours=None,
+    options=OutputOptions(),
+):
+    """Process a single Loop subject and write a DIAX JSON file.
+
+    ``options.start``/``options.end`` restrict every stream to that window
+    of local time.
+
+    Returns:
+        False if the subject has no rows in the window and was skipped.
+    """
     logger.info("Processing subject %s", subject_id)
 
     cgm = _parse_time_utc(cgm)
@@ -217,6 +256,15 @@ def process_subj_loop(cgm, basal, bolus, bgm, carbs, subject_id, output_file, tz
     basal["time"] = _apply_timezone(basal["time"], tz_offset_hours)
     carbs["time"] = _apply_timezone(carbs["time"], tz_offset_hours)
 
+    cgm = in_window(cgm, options.start, options.end)
+    bgm = in_window(bgm, options.start, options.end)
+    bolus = in_window(bolus, options.start, options.end)
+    basal = in_window(basal, options.start, options.end)
+    carbs = in_window(carbs, options.start, options.end)
+    if not any(len(df) for df in (cgm, bgm, bolus, basal, carbs)):
+        logger.info("Subject %s has no data between %s and %s, skipping.", subject_id, options.start, options.end)
+        return False
+
     cgm.loc[:, "value_mgdl"] = _convert_glucose_to_mgdl(cgm["CGMVal"], cgm["Units"])
     bgm.loc[:, "value_mgdl"] = _convert_glucose_to_mgdl(bgm["BGMVal"], bgm["Units"])
 
@@ -309,63 +357,83 @@ def process_subj_loop(cgm, basal, bolus, bgm, carbs, subject_id, output_file, tz
         output["end_date"] = end_time.isoformat()
         output["duration_in_days"] = duration_days
 
-    with open(output_file, "w") as f:
-        json.dump(output, f, indent=2)
+    save_subject(output, output_file, options)
+
+
+def _convert_subject(
+    data_source, subject_id, output_file, tz_offset_hours=None, options=OutputOptions()
+):
+    """Load one subject's tables and convert it (runs inside a worker)."""
+
+    cgm = read_partition(os.path.join(data_source, "LOOP_CGM"), "PtID", subject_id)
+    if cgm is None:
+        logger.warning("CGM data not found for subject %s, skipping.", subject_id)
+        return False
+
+    basal = read_partition(os.path.join(data_source, "LOOP_BASAL"), "PtID", subject_id)
+    if basal is None:
+        logger.warning("Basal data not found for subject %s, skipping.", subject_id)
+        return False
+
+    bgm = _read_subject_table(data_source, "LOOP_BGM", subject_id)
+    bolus = _read_subject_table(data_source, "LOOP_BOLUS", subject_id)
+    carbs = _read_subject_table(data_source, "LOOP_FOOD", subject_id)
+
+    return process_subj_loop(
+        cgm,
+        basal,
+        bolus,
+        bgm,
+        carbs,
+        subject_id,
+        output_file,
+        tz_offset_hours=tz_offset_hours,
+        options=options,
+    )
+
 
+def process_all_loop(data_source, output_dir, jobs=1, subjects=None, options=OutputOptions()):
+    """Process all Loop subjects from the source directory.
 
-def process_all_loop(data_source, output_dir):
-    """Process all Loop subjects from the source directory."""
+    Subjects whose output is current in the output manifest are skipped
+    unless ``options.force`` is set. ``subjects`` limits the conversion to
+    those PtIDs; ``options`` (``OutputOptions``) also sets the format, the
+    inclusive window of local time, compaction and the study summary.
+    """
 
     os.makedirs(output_dir, exist_ok=True)
-    prep = preprocess_loop(data_source)
-    subjects = prep["subjects"]
+    manifest = OutputManifest(
+        output_dir,
+        source_fingerprints(data_source),
+        CONVERTER_VERSION,
+        options,
+        subset=subjects is not None,
+    )
+    if manifest.up_to_date():
+        logger.info("%s is up to date.", output_dir)
+        update_study_summary(output_dir, manifest, options)
+        return 0
+
+    prep = preprocess_loop(data_source, subjects)
+    outputs = {
+        subject_id: os.path.join(output_dir, f"LOOP_subject_{subject_id}{options.suffix}")
+        for subject_id in prep["subjects"]
+    }
+    subjects = manifest.pending(outputs)
     tz_offsets = _load_pt_timezone_offsets(data_source)
 
-    for subject_id in subjects:
-        cgm_path = os.path.join(data_source, f"LOOP_CGM_{subject_id}.pkl")
-        basal_path = os.path.join(data_source, f"LOOP_BASAL_{subject_id}.pkl")
-
-        if os.path.exists(cgm_path):
-            cgm = pd.read_pickle(cgm_path)
-        else:
-            logger.warning("CGM data not found for subject %s, skipping.", subject_id)
-            continue
-
-        if os.path.exists(basal_path):
-            basal = pd.read_pickle(basal_path)
-        else:
-            logger.warning("Basal data not found for subject %s, skipping.", subject_id)
-            continue
-
-        bgm = _read_subject_table(
-            os.path.join(data_source, "LOOPDeviceBGM.txt"),
-            ["PtID", "UTCDtTm", "BGMVal", "Units", "OriginDeviceManufact", "OriginDeviceModel"],
-            subject_id,
-        )
-        bolus = _read_subject_table(
-            os.path.join(data_source, "LOOPDeviceBolus.txt"),
-            ["PtID", "UTCDtTm", "Normal", "Extended", "OriginDeviceManufact", "OriginDeviceModel"],
-            subject_id,
-        )
-        carbs = _read_subject_table(
-            os.path.join(data_source, "LOOPDeviceFood.txt"),
-            ["PtID", "UTCDtTm", "CarbsNet", "CarbUnits"],
+    tasks = [
+        (
             subject_id,
+            (data_source, subject_id, outputs[subject_id]),
+            {"tz_offset_hours": tz_offsets.get(subject_id), "options": options},
         )
-
-        output_file = os.path.join(output_dir, f"LOOP_subject_{subject_id}.json")
-        process_subj_loop(
-            cgm,
-            basal,
-            bolus,
-            bgm,
-            carbs,
-            subject_id,
-            output_file,
-            tz_offset_hours=tz_offsets.get(subject_id),
-        )
-
-    return len(subjects)
+        for subject_id in subjects
+    ]
+    with manifest:
+        report = run_subjects(tasks, _convert_subject, jobs=jobs, desc="LOOP", on_done=manifest.on_done)
+    update_study_summary(output_dir, manifest, options)
+    return len(converted_results(report))
 
 
 if __name__ == "__main__":
@@ -379,7 +447,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process all Loop subjects.")
     parser.add_argument("--source", required=True, help="Path to Loop data directory (Data Tables).")
     parser.add_argument("--output", required=True, help="Output directory for JSON files.")
+    add_runner_arguments(parser)
+    add_selection_arguments(parser)
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    count = process_all_loop(args.source, args.output)
+    count = process_all_loop(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        subjects=args.subjects,
+        options=OutputOptions.from_args(args),
+    )
     logger.info("Processed %s subjects.", count)
@@ -1,28 +1,44 @@
-import json
 import os
 
 import numpy as np
 import pandas as pd
 
+from diax_output import (
+    OutputManifest,
+    OutputOptions,
+    add_output_arguments,
+    save_subject,
+    source_fingerprints,
+    update_study_summary,
+)
+from runner import add_runner_arguments, add_selection_arguments, converted_results, run_subjects
+from staging import SubjectTables, stage_table
+from timestamps import first_time, format_times, in_window, parse_mixed
 
-def _parse_mixed(x):
-    """Parse mixed datetime formats (with/without time)."""
-    for fmt in ("%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y"):
-        try:
-            return pd.to_datetime(x, format=fmt)
-        except (ValueError, TypeError):
-            continue
-    return pd.NaT
 
+CONVERTER_VERSION = 1
 
-def preprocess_pedap(data_source):
-    """Load and pre-process PEDAP source tables."""
-    basal_all = pd.read_csv(os.path.join(data_source, "PEDAPTandemBASALDELIVERY.txt"), sep="|")
-    bolus_all = pd.read_csv(os.path.join(data_source, "PEDAPTandemBolusDelivered.txt"), sep="|")
-    cgm_all = pd.read_csv(os.path.join(data_source, "PEDAPTandemCGMDATAGXB.txt"), sep="|")
-    phys_all = pd.read_csv(os.path.join(data_source, "PEDAPDiabPhysExam.txt"), sep="|")
 
-    insulin_all = pd.read_csv(os.path.join(data_source, "PEDAPInsulin.txt"), sep="|")
+def preprocess_pedap(data_source, subjects=None):
+    """Load and pre-process PEDAP source tables (parsed once, then cached as Parquet)."""
+    basal_all = stage_table(
+        os.path.join(data_source, "PEDAPTandemBASALDELIVERY.txt"),
+        {"PtID": "category", "BasalRate": "float32"},
+        subjects=subjects,
+    )
+    bolus_all = stage_table(
+        os.path.join(data_source, "PEDAPTandemBolusDelivered.txt"),
+        {"PtID": "category", "BolusAmount": "float32"},
+        subjects=subjects,
+    )
+    cgm_all = stage_table(
+        os.path.join(data_source, "PEDAPTandemCGMDATAGXB.txt"),
+        {"PtID": "category", "CGMValue": "float32"},
+        subjects=subjects,
+    )
+    phys_all = stage_table(os.path.join(data_source, "PEDAPDiabPhysExam.txt"), {"PtID": "category"}, subjects=subjects)
+
+    insulin_all = stage_table(os.path.join(data_source, "PEDAPInsulin.txt"), {"PtID": "category"}, subjects=subjects)
     insulin_all = insulin_all[insulin_all["InsRoute"] == "Pump"]
     insulin_all["InsTypeStartDt"] = pd.to_datetime(
         insulin_all["InsTypeStartDt"], errors="coerce"
@@ -46,35 +62,41 @@ def preprocess_pedap(data_source):
     }
 
 
-def process_subj_pedap(cgm, basal, bolus, insulin, phys, subject_id, output_file):
-    """Process a single PEDAP subject and write a DIAX JSON file."""
-    cgm["time"] = cgm["DeviceDtTm"].apply(_parse_mixed)
+def process_subj_pedap(cgm, basal, bolus, insulin, phys, subject_id, output_file, options=OutputOptions()):
+    """Process a single PEDAP subject and write a DIAX JSON file.
+
+    ``options.start``/``options.end`` restrict every time series to that window.
+    """
+    cgm["time"] = parse_mixed(cgm["DeviceDtTm"])
     cgm = cgm.dropna(subset="time")
     cgm_data = cgm
 
     # Basal
-    basal["time"] = basal["DeviceDtTm"].apply(_parse_mixed)
+    basal["time"] = parse_mixed(basal["DeviceDtTm"])
     basal = basal.dropna(subset="time")
     basal_data = basal
 
     # Bolus
-    bolus["time"] = bolus["DeviceDtTm"].apply(_parse_mixed)
+    bolus["time"] = parse_mixed(bolus["DeviceDtTm"])
     bolus = bolus.dropna(subset="time")
     bolus_data = bolus
 
-    meal_data = bolus[bolus["CarbAmount"] > 0].copy()
+    # Time window
+    cgm_data = in_window(cgm_data, options.start, options.end)
+    basal_data = in_window(basal_data, options.start, options.end)
+    bolus_data = in_window(bolus_data, options.start, options.end)
+    if not any(len(df) for df in (cgm_data, basal_data, bolus_data)):
+        print(f"Subject {subject_id} has no data between {options.start} and {options.end}, skipping.")
+        return False
+
+    meal_data = bolus_data[bolus_data["CarbAmount"] > 0].copy()
 
     # Time normalizing
-    start_times = [
-        cgm_data["time"].min(),
-        basal_data["time"].min(),
-        bolus_data["time"].min(),
-    ]
-    start_time = min(start_times)
+    start_time = first_time(cgm_data, basal_data, bolus_data)
 
     def normalize(df, col):
         df = df.copy()
-        df.loc[:, col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        df.loc[:, col] = format_times(df[col])
         return df.sort_values(col).reset_index(drop=True)
 
     cgm_data = normalize(cgm_data, "time")
@@ -184,33 +206,58 @@ def process_subj_pedap(cgm, basal, bolus, insulin, phys, subject_id, output_file
         },
     }
 
-    with open(output_file, "w") as f:
-        json.dump(output, f, indent=2, default=str)
+    save_subject(output, output_file, options)
 
 
-def process_all_pedap(data_source, output_dir):
-    """Process all PEDAP subjects from the source directory."""
-    os.makedirs(output_dir, exist_ok=True)
-    prep = preprocess_pedap(data_source)
-
-    cgm_all = prep["cgm_all"]
-    basal_all = prep["basal_all"]
-    bolus_all = prep["bolus_all"]
-    insulin_all = prep["insulin_all"]
-    phys_all = prep["phys_all"]
-    subjects = prep["subjects"]
+def process_all_pedap(data_source, output_dir, jobs=1, subjects=None, options=OutputOptions()):
+    """Process all PEDAP subjects from the source directory.
 
-    for subject_id in subjects:
-        cgm = cgm_all[cgm_all["PtID"] == subject_id].copy()
-        basal = basal_all[basal_all["PtID"] == subject_id].copy()
-        bolus = bolus_all[bolus_all["PtID"] == subject_id].copy()
-        insulin = insulin_all[insulin_all["PtID"] == subject_id].copy()
-        phys = phys_all[phys_all["PtID"] == subject_id].copy()
-
-        output_file = os.path.join(output_dir, f"PEDAP_subject_{subject_id}.json")
-        process_subj_pedap(cgm, basal, bolus, insulin, phys, subject_id, output_file)
-
-    return len(subjects)
+    Subjects whose output is current in the output manifest are skipped
+    unless ``options.force`` is set. ``subjects`` limits the conversion to
+    those PtIDs; ``options`` (``OutputOptions``) also sets the format, the
+    inclusive window of local time, compaction and the study summary.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = OutputManifest(
+        output_dir,
+        source_fingerprints(data_source),
+        CONVERTER_VERSION,
+        options,
+        subset=subjects is not None,
+    )
+    if manifest.up_to_date():
+        print(f"{output_dir} is up to date.")
+        update_study_summary(output_dir, manifest, options)
+        return 0
+
+    prep = preprocess_pedap(data_source, subjects)
+    outputs = {
+        subject_id: os.path.join(output_dir, f"PEDAP_subject_{subject_id}{options.suffix}")
+        for subject_id in prep["subjects"]
+    }
+    subjects = manifest.pending(outputs)
+
+    # row positions of every subject, built once per table
+    names = ["cgm_all", "basal_all", "bolus_all", "insulin_all", "phys_all"]
+    tables = SubjectTables({name: prep[name] for name in names}, "PtID")
+
+    def tasks():
+        for subject_id in subjects:
+            cgm, basal, bolus, insulin, phys = (tables.take(name, subject_id) for name in names)
+
+            output_file = outputs[subject_id]
+            yield (
+                subject_id,
+                (cgm, basal, bolus, insulin, phys, subject_id, output_file),
+                {"options": options},
+            )
+
+    with manifest:
+        report = run_subjects(
+            tasks(), process_subj_pedap, jobs=jobs, desc="PEDAP", total=len(subjects), on_done=manifest.on_done
+        )
+    update_study_summary(output_dir, manifest, options)
+    return len(converted_results(report))
 
 
 if __name__ == "__main__":
@@ -219,7 +266,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process all PEDAP subjects.")
     parser.add_argument("--source", required=True, help="Path to PEDAP data directory.")
     parser.add_argument("--output", required=True, help="Output directory for JSON files.")
+    add_runner_arguments(parser)
+    add_selection_arguments(parser)
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    count = process_all_pedap(args.source, args.output)
+    count = process_all_pedap(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        subjects=args.subjects,
+        options=OutputOptions.from_args(args),
+    )
     print(f"Processed {count} subjects.")
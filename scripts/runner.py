@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import traceback
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import tqdm
+
+
+logger = logging.getLogger(__name__)
+
+
+def _call(func, args, kwargs):
+    """Run one subject and turn any exception into a reportable result."""
+    try:
+        return True, func(*args, **kwargs)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def run_subjects(tasks, func, jobs=1, desc="Processing subjects", total=None, pool=None, on_done=None):
+    """Run a per-subject function over many subjects with failure isolation.
+
+    Args:
+        tasks: Iterable of ``(subject_id, args)`` or ``(subject_id, args, kwargs)``
+            tuples. It is consumed lazily, so per-subject slices can be built
+            in a generator and only ``jobs`` of them are held at once.
+        func: Module-level function called as ``func(*args, **kwargs)``.
+            It returns ``False`` for a subject it skipped (e.g. no data in
+            the time window); any other value means the subject was converted.
+        jobs: Number of worker processes. 1 runs everything in-process.
+        desc: Progress bar label.
+        total: Number of tasks, for the progress bar when ``tasks`` has no len.
+        pool: Executor shared with other concurrent callers (e.g. one per
+            study). Subjects are submitted to it instead of a new pool, and
+            ``jobs`` only bounds how many this call keeps in flight.
+        on_done: Called in this process as ``on_done(subject_id, ok, value)``
+            when each subject finishes, e.g. to record progress.
+
+    Returns:
+        dict with ``results`` (subject -> return value of ``func``) and
+        ``failed`` (subject -> formatted traceback).
+    """
+    if total is None and hasattr(tasks, "__len__"):
+        total = len(tasks)
+
+    results = {}
+    failed = {}
+
+    def record(subject_id, ok, value):
+        if ok:
+            results[subject_id] = value
+        else:
+            failed[subject_id] = value
+            logger.error("Subject %s failed:\n%s", subject_id, value)
+        if on_done is not None:
+            on_done(subject_id, ok, value)
+
+    def unpack(task):
+        subject_id, args = task[0], task[1]
+        kwargs = task[2] if len(task) > 2 else {}
+        return subject_id, args, kwargs
+
+    progress = tqdm.tqdm(total=total, desc=desc)
+    if jobs <= 1 and pool is None:
+        for task in tasks:
+            subject_id, args, kwargs = unpack(task)
+            record(subject_id, *_call(func, args, kwargs))
+            progress.update()
+    else:
+        # a shared pool is shut down by its owner, not here
+        executor = process_pool(jobs) if pool is None else nullcontext(pool)
+        with executor as pool:
+            pending = {}
+            task_iter = iter(tasks)
+            exhausted = False
+            while pending or not exhausted:
+                # keep a bounded number of subjects in flight
+                while not exhausted and len(pending) < 2 * jobs:
+                    try:
+                        subject_id, args, kwargs = unpack(next(task_iter))
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[pool.submit(_call, func, args, kwargs)] = subject_id
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    subject_id = pending.pop(future)
+                    try:
+                        record(subject_id, *future.result())
+                    except Exception:  # worker crashed or result not picklable
+                        record(subject_id, False, traceback.format_exc())
+                    progress.update()
+    progress.close()
+
+    if failed:
+        logger.warning(
+            "%d of %d subjects failed: %s",
+            len(failed), len(failed) + len(results), ", ".join(str(s) for s in failed),
+        )
+
+    return {"results": results, "failed": failed}
+
+
+def converted_results(report):
+    """Return values of the subjects a ``run_subjects`` report converted, skipped ones left out."""
+    return [value for value in report["results"].values() if value is not False]
+
+
+def process_pool(jobs):
+    """Worker pool for ``run_subjects(..., pool=...)``."""
+    # spawn, not fork: the parent may already run polars/arrow thread pools,
+    # which deadlock in a forked child
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"))
+
+
+def default_jobs():
+    """Number of worker processes available to this job."""
+    if os.environ.get("SLURM_CPUS_PER_TASK"):
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+    return os.cpu_count() or 1
+
+
+def parse_list(value):
+    """Parse a comma-separated CLI list (or return None)."""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def add_selection_arguments(parser):
+    """Add the shared ``--subjects``, ``--start`` and ``--end`` options to a converter CLI."""
+    parser.add_argument(
+        "--subjects",
+        type=parse_list,
+        default=None,
+        help="Comma-separated list of subject ids to convert (default: all).",
+    )
+    parser.add_argument("--start", default=None, help="Only keep data at or after this local time (e.g. 2020-01-01).")
+    parser.add_argument("--end", default=None, help="Only keep data at or before this local time.")
+    return parser
+
+
+def add_runner_arguments(parser):
+    """Add the shared ``--jobs`` option to a converter CLI."""
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=f"Number of subjects converted in parallel (default: 1, available: {default_jobs()}).",
+    )
+    return parser
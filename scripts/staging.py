@@ -0,0 +1,390 @@
+import csv
+import glob
+import json
+import logging
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "_manifest.json"
+
+
+def fingerprint(path):
+    """Size and modification time of a source file, used to detect changes."""
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def atomic_replace(write, path):
+    """Call ``write(tmp_path)`` and move the result to ``path`` in one rename."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, f".tmp-{uuid.uuid4().hex}-{os.path.basename(path)}")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def read_manifest(dataset_dir):
+    """Load the manifest of a staged dataset (empty if not built yet)."""
+    path = os.path.join(dataset_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {"sources": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(dataset_dir, manifest):
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    atomic_replace(write, os.path.join(dataset_dir, MANIFEST))
+
+
+def _key_str(value):
+    """Partition directory value; integral floats (PtID read with NaNs) become ints."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def concat_frames(frames):
+    """Concatenate frames, keeping columns that are categorical in all of them categorical.
+
+    ``pd.concat`` turns categoricals with different categories into object
+    columns; here their categories are unified first.
+    """
+    frames = list(frames)
+    for column in frames[0].columns if frames else []:
+        if all(column in f and isinstance(f[column].dtype, pd.CategoricalDtype) for f in frames):
+            try:
+                categories = union_categoricals([f[column] for f in frames]).categories
+            except TypeError:  # categories of different types (e.g. an all-missing chunk)
+                continue
+            frames = [f.assign(**{column: f[column].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def partition_chunks(chunks, source, order, dataset_dir, key, flush_rows=5_000_000):
+    """Append chunks of one source table to a per-key Parquet dataset.
+
+    Rows are buffered per key and flushed to
+    ``dataset_dir/<key>=<value>/<order>_<source>_<n>.parquet`` every
+    ``flush_rows`` rows, so each key receives a few files per source and
+    nothing already written is read back.
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    buffered = {}
+    n_buffered = 0
+    n_flush = 0
+
+    def flush():
+        for value, frames in buffered.items():
+            df = concat_frames(frames)
+            part = os.path.join(dataset_dir, f"{key}={value}", f"{order:03d}_{stem}_{n_flush:05d}.parquet")
+            atomic_replace(lambda tmp: df.to_parquet(tmp, index=False), part)
+        buffered.clear()
+
+    for chunk in chunks:
+        for value, df_key in chunk.groupby(key, sort=False):
+            buffered.setdefault(_key_str(value), []).append(df_key)
+        n_buffered += len(chunk)
+        if n_buffered >= flush_rows:
+            flush()
+            n_buffered = 0
+            n_flush += 1
+    flush()
+
+
+def _remove_source_parts(dataset_dir, source):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    for part in glob.glob(os.path.join(dataset_dir, "*", f"*_{stem}_*.parquet")):
+        os.remove(part)
+
+
+def _select_keys(chunk, key, wanted):
+    """Rows of ``chunk`` whose key (as a partition value) is in ``wanted``."""
+    keep = [value for value in chunk[key].unique() if _key_str(value) in wanted]
+    return chunk[chunk[key].isin(keep)]
+
+
+def partition_sources(sources, dataset_dir, key, usecols, read_chunks, subjects=None, dtypes=None):
+    """Stream source tables once into a Parquet dataset partitioned by ``key``.
+
+    ``read_chunks(path)`` yields DataFrames of one source. Each source is
+    appended to per-key files without re-reading earlier output. A source
+    is recorded in the manifest (with its size, mtime, the staged columns
+    and their ``dtypes`` plan) only once all of its rows are on disk; on
+    the next run completed sources are skipped, and the parts of
+    interrupted or changed sources, or of a changed plan, are removed and
+    rebuilt.
+
+    With ``subjects``, only rows of those key values are written and the
+    manifest records the subset. A later run for other subjects rebuilds
+    the source for the union, and a run for all subjects rebuilds it in
+    full; a fully staged source serves any subset.
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    manifest = read_manifest(dataset_dir)
+    wanted = None if subjects is None else sorted({_key_str(s) for s in subjects})
+
+    for order, path in enumerate(sources):
+        name = os.path.basename(path)
+        if not os.path.exists(path):
+            continue
+        entry = dict(fingerprint(path), columns=list(usecols), dtypes=dict(dtypes or {}))
+        stored = dict(manifest["sources"].get(name, {}))
+        staged = stored.pop("subjects", None)
+        if stored == entry and (staged is None or (wanted is not None and set(wanted) <= set(staged))):
+            continue
+
+        subset = wanted
+        if wanted is not None and stored == entry:
+            # same source, other subjects: keep the ones staged before
+            subset = sorted(set(staged) | set(wanted))
+
+        logger.info("Partitioning %s by %s", name, key)
+        _remove_source_parts(dataset_dir, path)
+        manifest["sources"].pop(name, None)
+        chunks = read_chunks(path)
+        if subset is not None:
+            chunks = (_select_keys(chunk, key, set(subset)) for chunk in chunks)
+        partition_chunks(chunks, path, order, dataset_dir, key)
+
+        manifest["sources"][name] = entry if subset is None else dict(entry, subjects=subset)
+        write_manifest(dataset_dir, manifest)
+
+    return dataset_dir
+
+
+def partition_csv(sources, dataset_dir, key, usecols, dtype=None, sep="|", chunksize=1_000_000, subjects=None):
+    """Partition delimited tables by ``key`` (see ``partition_sources``).
+
+    ``dtype`` is the dtype plan of the columns, passed to ``pd.read_csv``.
+    ``"float32"`` columns are read as float64 and narrowed per chunk only
+    where every value survives the round trip (as in ``stage_table``).
+    """
+    dtype = {column: dtype for column, dtype in (dtype or {}).items() if column in usecols}
+    narrow = [column for column, planned in dtype.items() if planned == "float32"]
+    read_dtype = {column: "float64" if column in narrow else planned for column, planned in dtype.items()}
+
+    def read_chunks(path):
+        for chunk in pd.read_csv(path, sep=sep, usecols=usecols, dtype=read_dtype, chunksize=chunksize):
+            for column in narrow:
+                chunk[column] = _narrow_float32(chunk[column])
+            yield chunk
+
+    return partition_sources(sources, dataset_dir, key, usecols, read_chunks, subjects=subjects, dtypes=dtype)
+
+
+def partition_xpt(source, dataset_dir, key, dtypes, encoding="cp1252", chunksize=1_000_000, subjects=None):
+    """Partition a SAS transport file by ``key``, keeping only ``dtypes`` columns.
+
+    Columns are cast to the given dtypes so every part file has the same
+    schema, whatever values a chunk happens to contain (``"category"``
+    parts differ only in their dictionaries).
+    """
+    usecols = list(dtypes)
+
+    def read_chunks(path):
+        for chunk in pd.read_sas(path, format="xport", encoding=encoding, chunksize=chunksize):
+            yield chunk[usecols].astype(dtypes)
+
+    return partition_sources([source], dataset_dir, key, usecols, read_chunks, subjects=subjects, dtypes=dtypes)
+
+
+def _infer(series):
+    """Numeric inference as ``pd.read_csv`` does it: int64/float64 if every value parses."""
+    try:
+        return pd.to_numeric(series)
+    except (ValueError, TypeError):
+        return series
+
+
+def _narrow_float32(series):
+    """float32 copy of a float column if every value survives the round trip, else ``series``."""
+    if series.dtype.kind != "f":
+        return series
+    narrowed = series.astype(np.float32)
+    exact = (narrowed.astype(np.float64) == series) | series.isna()
+    return narrowed if exact.all() else series
+
+
+def _apply_dtype(series, dtype):
+    """Convert a column read as text to its planned dtype.
+
+    ``"float32"`` is only applied to float columns whose values all survive
+    the round trip, so staged values (and the JSON written from them) never
+    change; anything else stays at the inferred type.
+    """
+    series = _infer(series)
+    if dtype is None:
+        return series
+    if dtype == "float32":
+        return _narrow_float32(series)
+    return series.astype(dtype)
+
+
+def _read_text_table(path, sep, encoding):
+    """Parse a delimited table with the multithreaded Arrow reader, all columns as text."""
+    with open(path, encoding=encoding, newline="") as f:
+        header = next(csv.reader(f, delimiter=sep), [])
+    header = [name.lstrip("\ufeff") for name in header]
+
+    table = pv.read_csv(
+        path,
+        read_options=pv.ReadOptions(encoding=encoding, use_threads=True),
+        parse_options=pv.ParseOptions(delimiter=sep),
+        convert_options=pv.ConvertOptions(
+            column_types={name: pa.string() for name in header},
+            strings_can_be_null=True,
+        ),
+    )
+    return table.to_pandas()
+
+
+def _typed_keys(field_type, wanted):
+    """Key strings as values of a Parquet column type; ones that do not parse are dropped."""
+    if pa.types.is_dictionary(field_type):
+        field_type = field_type.value_type
+    values = []
+    for value in wanted:
+        try:
+            values.append(pa.scalar(value).cast(field_type).as_py())
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    return values
+
+
+def stage_table(path, dtypes=None, sep="|", encoding="utf-8", subjects=None, key="PtID"):
+    """Load a delimited source table through a Parquet cache.
+
+    The first call parses the text file and stores it, typed, as
+    ``staged/<name>.parquet`` next to the source; later calls read the
+    Parquet file directly. The cache is rebuilt when the source size or
+    mtime, or the dtype plan, changes.
+
+    Args:
+        path: Source table.
+        dtypes: Planned dtype per column (e.g. ``"category"`` for PtID,
+            ``"float32"`` for glucose). Other columns are inferred like
+            ``pd.read_csv``.
+        sep: Field delimiter.
+        encoding: Source encoding (several Jaeb tables are UTF-16).
+        subjects: Only return the rows of these ``key`` values (compared as
+            strings). The cache always holds the whole table; reading it
+            back, the filter is pushed into the Parquet scan.
+        key: Subject column used by ``subjects``.
+    """
+    dtypes = dict(dtypes or {})
+    cache_dir = os.path.join(os.path.dirname(path), "staged")
+    name = os.path.basename(path)
+    cache = os.path.join(cache_dir, os.path.splitext(name)[0] + ".parquet")
+    wanted = None if subjects is None else {_key_str(s) for s in subjects}
+
+    manifest = read_manifest(cache_dir)
+    entry = dict(fingerprint(path), dtypes=dtypes)
+    if manifest["sources"].get(name) == entry and os.path.exists(cache):
+        filters = None
+        if wanted is not None:
+            values = _typed_keys(pq.read_schema(cache).field(key).type, sorted(wanted))
+            filters = [(key, "in", values)]
+        df = pd.read_parquet(cache, filters=filters)
+        # Parquet keeps integer categoricals as plain ints
+        for column, dtype in dtypes.items():
+            if dtype == "category" and column in df:
+                df[column] = df[column].astype("category")
+        return df
+
+    logger.info("Staging %s", name)
+    df = _read_text_table(path, sep, encoding)
+    for column in df.columns:
+        df[column] = _apply_dtype(df[column], dtypes.get(column))
+
+    atomic_replace(lambda tmp: df.to_parquet(tmp, index=False), cache)
+    manifest["sources"][name] = entry
+    write_manifest(cache_dir, manifest)
+    if wanted is not None:
+        df = df[df[key].map(_key_str).isin(wanted)].reset_index(drop=True)
+    return df
+
+
+def partition_values(dataset_dir, key):
+    """List the key values present in a partitioned dataset."""
+    prefix = f"{key}="
+    if not os.path.isdir(dataset_dir):
+        return []
+    return [
+        entry[len(prefix):]
+        for entry in os.listdir(dataset_dir)
+        if entry.startswith(prefix) and os.path.isdir(os.path.join(dataset_dir, entry))
+    ]
+
+
+def partition_files(dataset_dir, key, value=None):
+    """Part files of one key value (or of the whole dataset), in source order."""
+    value = "*" if value is None else _key_str(value)
+    return sorted(glob.glob(os.path.join(dataset_dir, f"{key}={value}", "*.parquet")))
+
+
+def read_partition(dataset_dir, key, value, columns=None):
+    """Read all rows of one key value, in source order, or None if absent."""
+    parts = partition_files(dataset_dir, key, value)
+    if not parts:
+        return None
+    return concat_frames(pd.read_parquet(part, columns=columns) for part in parts)
+
+
+class SubjectTables:
+    """Source tables indexed by subject once, so a subject's slice costs only its own rows.
+
+    pandas tables keep the row positions of every key value from a single
+    groupby, and a subject is taken with ``iloc`` as a copy the converter
+    may modify. polars tables (lazy
+    frames are collected here) are stably sorted by key instead, so every
+    subject keeps its source row order and is a zero-copy slice.
+
+    Args:
+        tables: Frames by name.
+        key: Subject column of every table.
+    """
+
+    def __init__(self, tables, key):
+        self.key = key
+        self._tables = {}
+        for name, table in tables.items():
+            if isinstance(table, (pl.DataFrame, pl.LazyFrame)):
+                table = table.lazy().sort(key, maintain_order=True).collect()
+                counts = table.group_by(key, maintain_order=True).len()
+                lengths = counts["len"].to_list()
+                offsets = np.cumsum([0] + lengths[:-1]).tolist()
+                index = dict(zip(counts[key].to_list(), zip(offsets, lengths)))
+            else:
+                index = table.groupby(key, sort=False, observed=True).indices
+            self._tables[name] = (table, index)
+
+    def subjects(self, name):
+        """Key values with rows in table ``name``."""
+        return set(self._tables[name][1])
+
+    def take(self, name, value):
+        """Rows of one key value in table ``name`` (empty if it has none)."""
+        table, index = self._tables[name]
+        rows = index.get(value)
+        if isinstance(table, pl.DataFrame):
+            return table.clear() if rows is None else table.slice(*rows)
+        return table.iloc[:0].copy() if rows is None else table.iloc[rows].copy()
@@ -0,0 +1,240 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils_path  # noqa: F401 (the DIAX reader lives in utils/python)
+from diax_io import load_diax
+from staging import atomic_replace, fingerprint
+from timestamps import parse_wall_times
+
+
+# per-subject summaries wait here until the study table is written; hidden,
+# so subject globs and source fingerprints skip them
+SIDECAR_DIR = ".summary"
+SUMMARY = "summary.parquet"
+DAILY_SUMMARY = "summary_daily.parquet"
+
+# event streams in which a zero-valued row is no event (README, key definitions);
+# they are left out, so a summary does not change when the file is compacted
+EVENT_STREAMS = ("bolus", "carbs", "steps")
+
+# glycemic thresholds in mg/dL
+TBR2, TBR1, TIR_LOW, TIR_HIGH, TAR2 = 54.0, 70.0, 70.0, 180.0, 250.0
+
+# columns of the study tables, in order; metrics a subject has no data for are null
+SUBJECT_COLUMNS = [
+    "subject", "file", "start", "end", "days",
+    "cgm_readings", "cgm_mean", "cgm_sd", "cgm_cv", "gmi", "tir", "tbr1", "tbr2", "tar1", "tar2", "lbgi", "hbgi",
+    "basal_u_per_day", "bolus_u_per_day", "insulin_u_per_day", "carbs_g_per_day",
+    "smbg_readings", "steps_per_day", "heart_rate_mean",
+]
+DAILY_COLUMNS = [
+    "subject", "date", "cgm_readings", "cgm_mean", "tir", "tbr1", "tar1", "basal_u", "bolus_u", "carbs_g", "steps",
+]
+
+
+def _stream(output, key):
+    """``time``/``value`` frame of a numeric stream, sorted by time (None if absent or empty).
+
+    Times are parsed once as local wall clock (``parse_wall_times``),
+    ignoring any zone suffix; rows whose time or value does not parse, and
+    the zero-valued rows of ``EVENT_STREAMS``, are left out.
+    """
+    stream = output.get(key)
+    if not isinstance(stream, dict) or not isinstance(stream.get("time"), list) or not stream["time"]:
+        return None
+    values = pd.to_numeric(pd.Series(stream["value"]), errors="coerce")
+    frame = pd.DataFrame({"time": parse_wall_times(stream["time"]), "value": values.to_numpy(dtype=float)}).dropna()
+    if key in EVENT_STREAMS:
+        frame = frame[frame["value"] != 0]
+    if frame.empty:
+        return None
+    return frame.sort_values("time", kind="stable").reset_index(drop=True)
+
+
+def _risk(glucose):
+    """Low and high blood glucose risk indices (as ``DIAX.lbgi``/``DIAX.hbgi``)."""
+    glucose = glucose[glucose > 0]
+    if not len(glucose):
+        return np.nan, np.nan
+    risk = np.log(glucose) ** 1.084 - 5.381
+    return 22.77 * np.mean(np.minimum(risk, 0) ** 2), 22.77 * np.mean(np.maximum(risk, 0) ** 2)
+
+
+def _glycemic(glucose):
+    """CGM metrics of one subject or day, with the column names of the summary tables."""
+    glucose = np.asarray(glucose, dtype=float)
+    if not len(glucose):
+        return {"cgm_readings": 0}
+    mean, sd = glucose.mean(), glucose.std()
+    lbgi, hbgi = _risk(glucose)
+    return {
+        "cgm_readings": len(glucose),
+        "cgm_mean": mean,
+        "cgm_sd": sd,
+        "cgm_cv": 100.0 * sd / mean if mean else np.nan,
+        "gmi": 3.31 + 0.02392 * mean,
+        "tir": 100.0 * np.mean((glucose >= TIR_LOW) & (glucose <= TIR_HIGH)),
+        "tbr1": 100.0 * np.mean(glucose < TBR1),
+        "tbr2": 100.0 * np.mean(glucose < TBR2),
+        "tar1": 100.0 * np.mean(glucose > TIR_HIGH),
+        "tar2": 100.0 * np.mean(glucose > TAR2),
+        "lbgi": lbgi,
+        "hbgi": hbgi,
+    }
+
+
+def _basal_by_day(basal, end):
+    """Units of basal insulin per calendar day, each rate held until the next sample (or ``end``).
+
+    The intervals are split at midnight, so a rate running over a day
+    boundary counts towards both days.
+    """
+    times = basal["time"].to_numpy(dtype="datetime64[ns]")
+    stop = end.to_datetime64().astype("datetime64[ns]")
+    midnights = np.arange(
+        times[0].astype("datetime64[D]") + 1, stop.astype("datetime64[D]") + 1, dtype="datetime64[D]"
+    ).astype("datetime64[ns]")
+    edges = np.union1d(times, midnights[midnights < stop])
+    rates = basal["value"].to_numpy()[np.searchsorted(times, edges, side="right") - 1]
+    hours = np.diff(np.append(edges, stop)) / np.timedelta64(1, "h")
+    units = pd.Series(rates * hours, index=pd.DatetimeIndex(edges).normalize())
+    return units.groupby(level=0).sum()
+
+
+def summarize_subject(output):
+    """Summary metrics and daily rollups of one converted subject.
+
+    Computed from the in-memory DIAX dict the converter is about to write,
+    so no file has to be read back. Durations run from the first to the
+    last time of any stream. Per-day rates (``*_per_day``) divide the
+    totals by that duration; the daily rollups use calendar days of the
+    local wall clock.
+
+    Returns:
+        (dict of subject metrics, list of one dict per day with data)
+    """
+    streams = {
+        key: _stream(output, key)
+        for key in ("cgm", "basal_rate", "bolus", "carbs", "smbg", "steps", "heart_rate")
+    }
+    present = [frame for frame in streams.values() if frame is not None]
+    subject = {"subject": str(output.get("unique_id", ""))}
+    if not present:
+        return subject, []
+
+    start = min(frame["time"].iloc[0] for frame in present)
+    end = max(frame["time"].iloc[-1] for frame in present)
+    days = (end - start) / pd.Timedelta(days=1)
+    per_day = 1.0 / days if days > 0 else np.nan
+    subject.update({"start": start, "end": end, "days": days})
+
+    cgm = streams["cgm"]
+    subject.update(_glycemic(cgm["value"] if cgm is not None else []))
+    basal = streams["basal_rate"]
+    basal_daily = _basal_by_day(basal, end) if basal is not None else pd.Series(dtype=float)
+    subject["basal_u_per_day"] = basal_daily.sum() * per_day if basal is not None else np.nan
+    for key, column in (("bolus", "bolus_u_per_day"), ("carbs", "carbs_g_per_day"), ("steps", "steps_per_day")):
+        frame = streams[key]
+        subject[column] = frame["value"].sum() * per_day if frame is not None else np.nan
+    insulin = pd.Series([subject["basal_u_per_day"], subject["bolus_u_per_day"]])
+    subject["insulin_u_per_day"] = insulin.sum(min_count=1)
+    subject["smbg_readings"] = len(streams["smbg"]) if streams["smbg"] is not None else 0
+    heart_rate = streams["heart_rate"]
+    subject["heart_rate_mean"] = heart_rate["value"].mean() if heart_rate is not None else np.nan
+
+    # daily rollups
+    daily = {}
+    if cgm is not None:
+        for day, values in cgm.groupby(cgm["time"].dt.normalize())["value"]:
+            metrics = _glycemic(values)
+            daily[day] = {name: metrics.get(name) for name in ("cgm_readings", "cgm_mean", "tir", "tbr1", "tar1")}
+    for day, units in basal_daily.items():
+        daily.setdefault(day, {})["basal_u"] = units
+    for key, column in (("bolus", "bolus_u"), ("carbs", "carbs_g"), ("steps", "steps")):
+        frame = streams[key]
+        if frame is not None:
+            for day, total in frame.groupby(frame["time"].dt.normalize())["value"].sum().items():
+                daily.setdefault(day, {})[column] = total
+    rows = [{"subject": subject["subject"], "date": day, **daily[day]} for day in sorted(daily)]
+    return subject, rows
+
+
+def _sidecar(output_file):
+    return os.path.join(os.path.dirname(output_file), SIDECAR_DIR, os.path.basename(output_file) + ".json")
+
+
+def save_summary(summary, output_file):
+    """Keep a ``summarize_subject`` result of the written ``output_file`` until ``write_study_summary``.
+
+    The sidecar records the file's fingerprint, so a summary of an older
+    version of the file is not used.
+    """
+    subject, daily = summary
+    subject = dict(subject, file=os.path.basename(output_file))
+    text = json.dumps({"output": fingerprint(output_file), "subject": subject, "daily": daily}, default=str)
+
+    def write(tmp):
+        with open(tmp, "w") as f:
+            f.write(text)
+
+    atomic_replace(write, _sidecar(output_file))
+    # as read back from the sidecar, so both paths give the same table
+    return json.loads(text)
+
+
+def _load_summary(output_file):
+    """Saved summary of ``output_file``; recomputed from the file if missing or stale."""
+    path = _sidecar(output_file)
+    if os.path.exists(path):
+        with open(path) as f:
+            stored = json.load(f)
+        if stored.get("output") == fingerprint(output_file):
+            return stored
+    return save_summary(summarize_subject(load_diax(output_file)), output_file)
+
+
+def write_study_summary(output_dir, names):
+    """Collect the subject summaries of the output files ``names`` into the study tables.
+
+    Writes ``summary.parquet`` (one row per subject) and
+    ``summary_daily.parquet`` (one row per subject and day) in
+    ``output_dir``. Summaries saved while converting are reused; those of
+    files converted without one, or rewritten since, are computed from the
+    file.
+
+    Returns:
+        Path of the subject table, or None if there was nothing to write.
+    """
+    subjects, daily = [], []
+    for name in sorted(names):
+        output_file = os.path.join(output_dir, name)
+        if not os.path.exists(output_file):
+            continue
+        stored = _load_summary(output_file)
+        subjects.append(stored["subject"])
+        daily.extend(stored["daily"])
+    if not subjects:
+        remove_study_summary(output_dir)
+        return None
+
+    subjects = pd.DataFrame(subjects).reindex(columns=SUBJECT_COLUMNS)
+    for column in ("start", "end"):
+        subjects[column] = pd.to_datetime(subjects[column])
+    daily = pd.DataFrame(daily).reindex(columns=DAILY_COLUMNS)
+    daily["date"] = pd.to_datetime(daily["date"]).dt.date
+
+    path = os.path.join(output_dir, SUMMARY)
+    atomic_replace(lambda tmp: subjects.to_parquet(tmp, index=False), path)
+    atomic_replace(lambda tmp: daily.to_parquet(tmp, index=False), os.path.join(output_dir, DAILY_SUMMARY))
+    return path
+
+
+def remove_study_summary(output_dir):
+    """Remove the study tables of ``output_dir``, which no longer describe its files."""
+    for name in (SUMMARY, DAILY_SUMMARY):
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
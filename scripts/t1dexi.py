@@ -1,150 +1,188 @@
 import datetime
-import json
 import os
-import glob
 
-import numpy as np
-import pandas as pd
 import polars as pl
 
+from diax_output import (
+    OutputManifest,
+    OutputOptions,
+    add_output_arguments,
+    save_subject,
+    source_fingerprints,
+    update_study_summary,
+)
+from runner import add_runner_arguments, add_selection_arguments, converted_results, run_subjects
+from staging import SubjectTables, partition_files, partition_values, partition_xpt
+
+
+CONVERTER_VERSION = 1
 
 epoch_1960 = datetime.datetime(1960, 1, 1, 0, 0, 0)
 
+# FACM rows used by the conversion: pump basal, bolus, and injected basal
+FACM_FILTER = pl.col("FATESTCD").is_in(["BASFLRT", "INSBOLUS"]) | (pl.col("INSDVSRC") == "Injections")
+LB_FILTER = pl.col("LBTEST") == "Glucose"
+FA_FILTER = pl.col("FATESTCD") == "STEPSTKN"
+HEART_RATE_FILTER = pl.col("VSCAT") == "VERILY HEART RATE"
+VS_FILTER = HEART_RATE_FILTER | pl.col("VSTEST").is_in(["Weight", "Height"])
+
+
+def _sas_time(column, whole_seconds=False):
+    """SAS datetime (seconds since 1960-01-01) to a polars datetime."""
+    seconds = pl.col(column).cast(pl.Int64 if whole_seconds else pl.Float64)
+    return ((seconds * 1000).cast(pl.Duration("ms")) + epoch_1960).alias("time")
+
+
+def _in_window(time, start=None, end=None):
+    """Predicate keeping rows whose ``time`` expression lies in the inclusive [start, end]."""
+    keep = pl.lit(True)
+    if start is not None:
+        keep = keep & (time >= datetime.datetime.fromisoformat(start))
+    if end is not None:
+        keep = keep & (time <= datetime.datetime.fromisoformat(end))
+    return keep
+
+
+# columns staged from each XPT file, with the dtype they are stored with: categoricals
+# for repeated codes and names, strings for values parsed per subject, SAS times as float64
+XPT_COLUMNS = {
+    "FAMLPM": {
+        "USUBJID": "string", "FATEST": "category", "FACAT": "category", "FADTC": "float64", "FASTRESN": "float64",
+    },
+    "DX": {"USUBJID": "string", "DXTRT": "category"},
+    "CM": {"USUBJID": "string", "CMSCAT": "category", "CMTRT": "category"},
+    "FACM": {
+        "USUBJID": "string", "FATESTCD": "category", "INSDVSRC": "category", "FADTC": "float64", "FAORRES": "string",
+    },
+    "LB": {"USUBJID": "string", "LBTEST": "category", "LBDTC": "float64", "LBSTRESC": "string"},
+    "FA": {"USUBJID": "string", "FADTC": "float64", "FATESTCD": "category", "FAORRES": "string"},
+    "VS": {
+        "USUBJID": "string", "VSDTC": "float64", "VSCAT": "category", "VSTEST": "category",
+        "VSSTRESC": "string", "VSORRES": "string", "VSORRESU": "category",
+    },
+}
+
+
+_POLARS_TYPES = {"string": pl.String, "category": pl.Categorical, "float64": pl.Float64}
+
+
+def _table_dir(data_source, name):
+    return os.path.join(data_source, f"T1DEXI_{name}")
+
+
+def _scan_table(data_source, name, subjects=None):
+    """Lazily scan a staged table, or only the partitions of some subjects."""
+    directory = _table_dir(data_source, name)
+    if subjects is None:
+        parts = partition_files(directory, "USUBJID")
+    else:
+        parts = [part for subject in subjects for part in partition_files(directory, "USUBJID", subject)]
+    if not parts:
+        return pl.LazyFrame(schema={col: _POLARS_TYPES[dtype] for col, dtype in XPT_COLUMNS[name].items()})
+    return pl.scan_parquet(parts)
+
+
+def preprocess_t1dexi(data_source, subjects=None, start=None, end=None):
+    """Load and pre-process T1DEXI datasets.
+
+    Every XPT file is converted once into column-pruned Parquet partitioned by
+    USUBJID (``T1DEXI_<table>/``). The cache is rebuilt when a source's size
+    or mtime, or its staged columns and dtypes, change. The small tables are then loaded with their filters
+    pushed into the scan; FA and VS are read per subject by the workers.
+    With ``subjects`` only their rows are partitioned and scanned, and
+    ``start``/``end`` drop the time series rows outside that window.
+    """
+    for name, dtypes in XPT_COLUMNS.items():
+        partition_xpt(
+            os.path.join(data_source, f"{name}.xpt"),
+            _table_dir(data_source, name),
+            "USUBJID",
+            dtypes,
+            subjects=subjects,
+        )
 
-def preprocess_t1dexi(data_source):
-    """Load and pre-process T1DEXI datasets, creating per-subject pickles for FA/VS."""
     # FAMLPM (carbs)
-    famlpm_pkl = os.path.join(data_source, "FAMLPM.pkl")
-    if not os.path.exists(famlpm_pkl):
-        FAMLPM_all = pd.read_sas(os.path.join(data_source, "FAMLPM.xpt"), encoding="cp1252")
-        FAMLPM_all = FAMLPM_all[FAMLPM_all["FATEST"] == "Dietary Total Carbohydrates"]
-        FAMLPM_all = FAMLPM_all[FAMLPM_all["FACAT"] == "CONSUMED"]
-        FAMLPM_all["time"] = pd.to_datetime(
-            FAMLPM_all["FADTC"], unit="s", origin=datetime.datetime(1960, 1, 1)
-        )
-        FAMLPM_all.to_pickle(famlpm_pkl)
-    else:
-        FAMLPM_all = pd.read_pickle(famlpm_pkl)
+    FAMLPM_all = (
+        _scan_table(data_source, "FAMLPM", subjects)
+        .filter((pl.col("FATEST") == "Dietary Total Carbohydrates") & (pl.col("FACAT") == "CONSUMED"))
+        .with_columns(_sas_time("FADTC"))
+        .filter(_in_window(pl.col("time"), start, end))
+    )
 
     # DX and CM
-    DX_all = pd.read_sas(os.path.join(data_source, "DX.xpt"), encoding="cp1252")
-    DX_all = DX_all[DX_all["DXTRT"] != "INSULIN PUMP"]
+    DX_all = _scan_table(data_source, "DX", subjects).filter(pl.col("DXTRT") != "INSULIN PUMP")
 
-    CM_all = pd.read_sas(os.path.join(data_source, "CM.xpt"), encoding="cp1252")
-    CM_all = CM_all[
-        CM_all["CMSCAT"].isin([
+    CM_all = _scan_table(data_source, "CM", subjects).filter(
+        pl.col("CMSCAT").is_in([
             "MDI, BOLUS INSULIN",
             "MDI, BASAL INSULIN",
             "PUMP OR CLOSED LOOP",
         ])
-    ]
-    CM_all = CM_all[
-        ~CM_all["CMTRT"].isin([
+        & ~pl.col("CMTRT").is_in([
             "BASAL INSULIN",
             "BOLUS INSULIN",
             "PUMP OR CLOSED LOOP INSULIN",
         ])
-    ]
+    )
 
-    # FACM
-    facm_pkl = os.path.join(data_source, "FACM.pkl")
-    if not os.path.exists(facm_pkl):
-        FACM_all = pd.read_sas(os.path.join(data_source, "FACM.xpt"), encoding="cp1252")
-        FACM_all.to_pickle(facm_pkl)
-    else:
-        FACM_all = pd.read_pickle(facm_pkl)
+    # FACM and LB: only the rows the conversion uses
+    FACM_all = (
+        _scan_table(data_source, "FACM", subjects)
+        .filter(FACM_FILTER)
+        .with_columns(_sas_time("FADTC"))
+        .filter(_in_window(pl.col("time"), start, end))
+    )
+    LB_all = (
+        _scan_table(data_source, "LB", subjects)
+        .filter(LB_FILTER)
+        .with_columns(_sas_time("LBDTC"))
+        .filter(_in_window(pl.col("time"), start, end))
+    )
 
-    # LB
-    lb_pkl = os.path.join(data_source, "LB.pkl")
-    if not os.path.exists(lb_pkl):
-        LB_all = pd.read_sas(os.path.join(data_source, "LB.xpt"), encoding="cp1252")
-        LB_all.to_pickle(lb_pkl)
-    else:
-        LB_all = pd.read_pickle(lb_pkl)
-
-    # FA (chunked per subject)
-    fa_files = glob.glob(os.path.join(data_source, "FA_*.pkl"))
-    if not fa_files:
-        itr = pd.read_sas(os.path.join(data_source, "FA.xpt"), chunksize=10000000, encoding="cp1252")
-        for i, chunk in enumerate(itr):
-            print(f"Processing FA chunk {i}")
-            chunk = chunk[["USUBJID", "FADTC", "FATESTCD", "FAORRES"]]
-            for subj, df_subj in chunk.groupby("USUBJID"):
-                subj_path = os.path.join(data_source, f"FA_{subj}.pkl")
-                if os.path.exists(subj_path):
-                    df_existing = pd.read_pickle(subj_path)
-                    pd.concat([df_existing, df_subj], ignore_index=True).to_pickle(subj_path)
-                else:
-                    df_subj.to_pickle(subj_path)
-        fa_files = glob.glob(os.path.join(data_source, "FA_*.pkl"))
-
-    # VS (chunked per subject)
-    vs_files = glob.glob(os.path.join(data_source, "VS_*.pkl"))
-    if not vs_files:
-        itr = pd.read_sas(os.path.join(data_source, "VS.xpt"), chunksize=10000000, encoding="cp1252")
-        for i, chunk in enumerate(itr):
-            print(f"Processing VS chunk {i}")
-            chunk = chunk[["USUBJID", "VSDTC", "VSCAT", "VSTEST", "VSSTRESC", "VSORRES", "VSORRESU"]]
-            for subj, df_subj in chunk.groupby("USUBJID"):
-                subj_path = os.path.join(data_source, f"VS_{subj}.pkl")
-                if os.path.exists(subj_path):
-                    df_existing = pd.read_pickle(subj_path)
-                    pd.concat([df_existing, df_subj], ignore_index=True).to_pickle(subj_path)
-                else:
-                    df_subj.to_pickle(subj_path)
-        vs_files = glob.glob(os.path.join(data_source, "VS_*.pkl"))
-
-    FA_subjs = {os.path.basename(f).replace("FA_", "").replace(".pkl", "") for f in fa_files}
-    VS_subjs = {os.path.basename(f).replace("VS_", "").replace(".pkl", "") for f in vs_files}
-
-    subjects = (
-        set(FAMLPM_all["USUBJID"]).intersection(set(DX_all["USUBJID"]))
-        .intersection(set(CM_all["USUBJID"]))
-        .intersection(set(FACM_all["USUBJID"]))
-        .intersection(set(LB_all["USUBJID"]))
-        .intersection(FA_subjs)
-        .intersection(VS_subjs)
+    # each table is grouped by subject so a subject slice costs its own rows
+    tables = SubjectTables(
+        {"FAMLPM": FAMLPM_all, "DX": DX_all, "CM": CM_all, "FACM": FACM_all, "LB": LB_all},
+        "USUBJID",
     )
 
+    subjects = tables.subjects("FAMLPM") & tables.subjects("DX") & tables.subjects("CM")
+    for name in ["FACM", "LB", "FA", "VS"]:
+        subjects = subjects.intersection(partition_values(_table_dir(data_source, name), "USUBJID"))
+
     return {
-        "FAMLPM_all": FAMLPM_all,
-        "DX_all": DX_all,
-        "CM_all": CM_all,
-        "FACM_all": FACM_all,
-        "LB_all": LB_all,
-        "FA_subjs": FA_subjs,
-        "VS_subjs": VS_subjs,
+        "tables": tables,
         "subjects": sorted(subjects),
         "data_source": data_source,
     }
 
 
-def process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path):
-    """Process a single T1DEXI subject and write JSON."""
-    # convert to polars for faster processing
-    FAMLPM = pl.from_pandas(FAMLPM)
-    FACM = pl.from_pandas(FACM)
-    LB = pl.from_pandas(LB)
-    FA = pl.from_pandas(FA)
-    VS = pl.from_pandas(VS)
+def process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path, options=OutputOptions()):
+    """Process a single T1DEXI subject and write JSON.
 
+    All tables are polars frames. FACM and LB already carry a ``time`` column
+    (see ``preprocess_t1dexi``); FA and VS may be lazy and are only collected
+    for the rows used here.
 
+    Returns the output dict, or ``False`` when the subject is skipped because
+    steps, basal, bolus, CGM or heart rate data is missing (e.g. outside the
+    time window).
+    """
     steps_data = (
-        FA.filter(pl.col("FATESTCD") == "STEPSTKN")
+        FA.lazy()
+        .filter(FA_FILTER)
         .with_columns(
-            ((pl.col("FADTC").cast(pl.Float64) * 1000).cast(pl.Duration("ms")) + epoch_1960).alias("time"),  # Convert to datetime
+            _sas_time("FADTC"),  # Convert to datetime
             pl.col("FAORRES").str.strip_chars().cast(pl.Int64).alias("FAORRES")  # Ensure steps are integers
         )
+        .collect()
     )
     if steps_data.height == 0:
         print(f"Subject has no steps data, skipping subject: {output_path}")
-        return None
+        return False
     start_time_steps = steps_data["time"][0]
 
     # FACM Data Processing (Pump Basal, Injected Basal, Bolus)
     #FACM-Basal
-    FACM = FACM.with_columns([((pl.col("FADTC").cast(pl.Float64) * 1000).cast(pl.Duration("ms")) + epoch_1960).alias("time")])
-
     basal_data = (
         FACM
         .filter(pl.col("FATESTCD") == "BASFLRT")
@@ -170,29 +208,28 @@ def process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path):
         basal_data = FACM.filter(pl.col("INSDVSRC") == "Injections").with_columns(
             pl.col("FAORRES").str.strip_chars().cast(pl.Float64)
         )
+        if basal_data.height == 0:
+            print(f"Subject has no basal data, skipping subject: {output_path}")
+            return False
         start_time_basal = basal_data["time"][0]
         basal_data = basal_data.fill_null(0)
         basal_type = "injection"
 
-    if basal_data.height == 0:
-        print(f"Subject has no basal data, skipping subject: {output_path}")
-        return None
-
     #FACM-Bolus
     bolus_data = FACM.filter(pl.col("FATESTCD") == "INSBOLUS").with_columns(
         pl.col("FAORRES").str.strip_chars().cast(pl.Float64)
     )
     if bolus_data.height == 0:
         print(f"Subject has no bolus data, skipping subject: {output_path}")
+        return False
     start_time_bolus = bolus_data["time"][0]
 
     # LB Data Processing (CGM)
     # LB-CGM
-    cgm_data = LB.filter(pl.col("LBTEST") == "Glucose").with_columns(
-        ((pl.col("LBDTC").cast(pl.Float64) * 1000).cast(pl.Duration("ms")) + epoch_1960).alias("time")  # Convert to datetime
-    )
+    cgm_data = LB.filter(LB_FILTER)
     if cgm_data.height == 0:
         print(f"Subject has no CGM data, skipping subject: {output_path}")
+        return False
     start_time_cgm = cgm_data["time"][0]
 
     # FAMLPM Data Processing (Carbs)
@@ -200,16 +237,17 @@ def process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path):
     start_time_carbs = carbs_data["time"].min()
 
     # VS Data Processing (Heart Rate, Height, Weight)
+    VS = VS.lazy().filter(VS_FILTER).collect()
     heart_rate_data = (
         VS.filter(pl.col("VSCAT") == "VERILY HEART RATE")
         .with_columns([
-            ((pl.col("VSDTC").cast(pl.Int64) * 1000).cast(pl.Duration("ms")) + epoch_1960).alias("time"),
+            _sas_time("VSDTC", whole_seconds=True),
             pl.col("VSSTRESC").str.strip_chars().cast(pl.Int32).alias("VSSTRESC")  # Ensure heart rate is integer
         ])
     )
     if heart_rate_data.height == 0:
         print(f"Subject has no heart rate data, skipping subject: {output_path}")
-        return None
+        return False
     
     start_time_heart_rate = heart_rate_data["time"][0]
 
@@ -333,13 +371,13 @@ def process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path):
 
     if basal_type == "pump":
         # get pump type from DX
-        pump_type = DX['DXTRT'].unique().tolist()
+        pump_type = DX['DXTRT'].unique(maintain_order=True).to_list()
         if len(pump_type) == 0:
             pump_type = "UNKNOWN"
         else:
             pump_type = ', '.join(pump_type)
 
-        insulin_type = CM['CMTRT'].unique().tolist()
+        insulin_type = CM['CMTRT'].unique(maintain_order=True).to_list()
         if len(insulin_type) == 0:
             insulin_type = "UNKNOWN"
         else:
@@ -360,13 +398,13 @@ def process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path):
 
     elif basal_type == "injection":
         print(f"Subject {subject} has basal insulin by injection, checking for insulin type in CM dataset.")
-        basal_insulin_type = CM[CM['CMSCAT'] == 'MDI, BASAL INSULIN']['CMTRT'].unique().tolist()
+        basal_insulin_type = CM.filter(pl.col('CMSCAT') == 'MDI, BASAL INSULIN')['CMTRT'].unique(maintain_order=True).to_list()
         if len(basal_insulin_type) == 0:
             basal_insulin_type = "UNKNOWN"
         else:
             basal_insulin_type = ', '.join(basal_insulin_type)
 
-        bolus_insulin_type = CM[CM['CMSCAT'] == 'MDI, BOLUS INSULIN']['CMTRT'].unique().tolist()
+        bolus_insulin_type = CM.filter(pl.col('CMSCAT') == 'MDI, BOLUS INSULIN')['CMTRT'].unique(maintain_order=True).to_list()
         if len(bolus_insulin_type) == 0:
             bolus_insulin_type = "UNKNOWN"
         else:
@@ -386,46 +424,90 @@ def process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path):
 
 
     # Save output to JSON
-    with open(output_path, 'w') as f:
-        print(f"Saving processed data to {output_path}")
-        json.dump(output, f, indent=4, default=str)
+    print(f"Saving processed data to {output_path}")
+    save_subject(output, output_path, options)
     
     print(f"Finished processing subject, output saved to {output_path}")
     return output
 
 
-def process_all_t1dexi(data_source, output_dir):
-    """Process all T1DEXI subjects given a data source directory."""
-    os.makedirs(output_dir, exist_ok=True)
-    prep = preprocess_t1dexi(data_source)
-
-    for subject in prep["subjects"]:
-        FAMLPM = prep["FAMLPM_all"][prep["FAMLPM_all"]["USUBJID"] == subject]
-        DX = prep["DX_all"][prep["DX_all"]["USUBJID"] == subject]
-        CM = prep["CM_all"][prep["CM_all"]["USUBJID"] == subject]
-        FACM = prep["FACM_all"][prep["FACM_all"]["USUBJID"] == subject]
-        LB = prep["LB_all"][prep["LB_all"]["USUBJID"] == subject]
-
-        # FA and VS are large, so we saved them as separate pickles per subject during preprocessing
-        FA = pd.read_pickle(os.path.join(prep["data_source"], f"FA_{subject}.pkl"))
-        VS = pd.read_pickle(os.path.join(prep["data_source"], f"VS_{subject}.pkl"))
-        output_path = os.path.join(output_dir, f"T1Dexi_{subject}.json")
+def _convert_subject(FAMLPM, DX, CM, FACM, LB, data_source, subject, output_path, options=OutputOptions()):
+    """Scan a subject's FA/VS partitions and convert it (runs inside a worker)."""
+    # FA and VS are large, so only this subject's partition is read, and only
+    # the rows process_subj_t1dexi keeps; weight and height are kept whatever
+    # their time
+    FA = (
+        _scan_table(data_source, "FA", [subject])
+        .filter(FA_FILTER & _in_window(_sas_time("FADTC"), options.start, options.end))
+        .collect()
+    )
+    VS = (
+        _scan_table(data_source, "VS", [subject])
+        .filter(
+            VS_FILTER
+            & (~HEART_RATE_FILTER | _in_window(_sas_time("VSDTC", whole_seconds=True), options.start, options.end))
+        )
+        .collect()
+    )
 
-        if (
-            len(FAMLPM) == 0
-            or len(DX) == 0
-            or len(CM) == 0
-            or len(FACM) == 0
-            or len(LB) == 0
-            or len(FA) == 0
-            or len(VS) == 0
-        ):
-            print(f"Skipping subject {subject} due to missing data in one of the datasets.")
-            continue
+    if (
+        len(FAMLPM) == 0
+        or len(DX) == 0
+        or len(CM) == 0
+        or len(FACM) == 0
+        or len(LB) == 0
+        or len(FA) == 0
+        or len(VS) == 0
+    ):
+        print(f"Skipping subject {subject} due to missing data in one of the datasets.")
+        return False
+
+    # the output dict is large, only report success back to the runner
+    converted = process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path, options)
+    return converted is not False
+
+
+def process_all_t1dexi(data_source, output_dir, jobs=1, subjects=None, options=OutputOptions()):
+    """Process all T1DEXI subjects given a data source directory.
+
+    Subjects whose output is current in the output manifest are skipped
+    unless ``options.force`` is set. ``subjects`` limits the conversion to
+    those USUBJIDs; ``options`` (``OutputOptions``) also sets the format, the
+    inclusive window of local time, compaction and the study summary.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = OutputManifest(
+        output_dir,
+        source_fingerprints(data_source),
+        CONVERTER_VERSION,
+        options,
+        subset=subjects is not None,
+    )
+    if manifest.up_to_date():
+        print(f"{output_dir} is up to date.")
+        update_study_summary(output_dir, manifest, options)
+        return 0
+
+    prep = preprocess_t1dexi(data_source, subjects, options.start, options.end)
+    outputs = {
+        subject: os.path.join(output_dir, f"T1Dexi_{subject}{options.suffix}") for subject in prep["subjects"]
+    }
+    subjects = manifest.pending(outputs)
 
-        process_subj_t1dexi(FAMLPM, DX, CM, FACM, LB, FA, VS, subject, output_path)
+    def tasks():
+        for subject in subjects:
+            FAMLPM, DX, CM, FACM, LB = (
+                prep["tables"].take(name, subject) for name in ("FAMLPM", "DX", "CM", "FACM", "LB")
+            )
+            args = (FAMLPM, DX, CM, FACM, LB, prep["data_source"], subject, outputs[subject])
+            yield subject, args, {"options": options}
 
-    return len(prep["subjects"])
+    with manifest:
+        report = run_subjects(
+            tasks(), _convert_subject, jobs=jobs, desc="T1DEXI", total=len(subjects), on_done=manifest.on_done
+        )
+    update_study_summary(output_dir, manifest, options)
+    return len(converted_results(report))
 
 
 if __name__ == "__main__":
@@ -434,7 +516,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process all T1DEXI subjects.")
     parser.add_argument("--source", required=True, help="Path to T1DEXI data directory.")
     parser.add_argument("--output", required=True, help="Output directory for JSON files.")
+    add_runner_arguments(parser)
+    add_selection_arguments(parser)
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    count = process_all_t1dexi(args.source, args.output)
+    count = process_all_t1dexi(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        subjects=args.subjects,
+        options=OutputOptions.from_args(args),
+    )
     print(f"Processed {count} subjects.")
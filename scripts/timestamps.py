@@ -0,0 +1,199 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+# Jaeb vendor exports mix full timestamps and bare dates (midnight) in one column
+VENDOR_FORMATS = ("%m/%d/%Y %I:%M:%S %p", "%m/%d/%Y")
+
+
+def parse_mixed(values, formats=VENDOR_FORMATS):
+    """Parse a column whose values use one of several datetime formats.
+
+    Each distinct string is parsed once: the formats are tried in order,
+    vectorized over the values not matched by an earlier format. Values
+    that match none of them (or are missing) become NaT.
+
+    Args:
+        values: Series (or array-like) of timestamp strings.
+        formats: strptime formats, tried in order.
+
+    Returns:
+        datetime64[ns] Series aligned with ``values``.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(np.asarray(uniques, dtype=object))
+
+    parsed = np.full(len(uniques), np.datetime64("NaT"), dtype="datetime64[ns]")
+    remaining = np.ones(len(uniques), dtype=bool)
+    for fmt in formats:
+        if not remaining.any():
+            break
+        attempt = pd.to_datetime(uniques[remaining], format=fmt, errors="coerce")
+        matched = attempt.notna().to_numpy()
+        positions = np.flatnonzero(remaining)[matched]
+        parsed[positions] = attempt.to_numpy(dtype="datetime64[ns]")[matched]
+        remaining[positions] = False
+
+    result = np.where(codes >= 0, parsed[codes], np.datetime64("NaT"))
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+_SECONDS_PER_DAY = 86400
+_TICKS_PER_SECOND = {"s": 1, "ms": 1_000, "us": 1_000_000, "ns": 1_000_000_000}
+_FIRST_DAY = int(np.datetime64("1000-01-01", "D").astype(np.int64))
+_LAST_DAY = int(np.datetime64("9999-12-31", "D").astype(np.int64))
+_CLOCK = None  # "HH:MM:SS" for every second of the day, built on first use
+
+
+def _clock():
+    global _CLOCK
+    if _CLOCK is None:
+        sod = np.arange(_SECONDS_PER_DAY)
+        _CLOCK = np.char.encode(
+            np.datetime_as_string(sod.astype("datetime64[s]"), unit="s"), "ascii"
+        ).astype("S19").view("S1").reshape(-1, 19)[:, 11:].copy().view("S8").ravel()
+    return _CLOCK
+
+
+def _fixed_zone(series):
+    """``%Z`` of a tz-aware series if it is the same for every row, else None."""
+    tz = series.dt.tz
+    if isinstance(tz, datetime.timezone) or str(tz) == "UTC":
+        valid = series.dropna()
+        return valid.iloc[:1].dt.strftime("%Z").iloc[0] if len(valid) else ""
+    return None
+
+
+def format_times(series, with_zone=False):
+    """Render datetimes as ``"%Y-%m-%d %H:%M:%S"`` strings, like ``Series.dt.strftime``.
+
+    Each row is assembled from a per-day ``YYYY-MM-DD`` prefix (one per day
+    in the column's range) and a precomputed ``HH:MM:SS`` table, written
+    into one fixed-width byte buffer that becomes the string column without
+    a Python object per row. The result is identical to
+    ``series.dt.strftime(fmt)``; missing values stay missing.
+
+    Args:
+        series: datetime64 Series, naive or tz-aware (local wall time is used).
+        with_zone: Append ``" %Z"`` (e.g. ``"UTC-05:00"``) for tz-aware input.
+
+    Returns:
+        Series of strings with the index of ``series``.
+    """
+    fmt = "%Y-%m-%d %H:%M:%S %Z" if with_zone else "%Y-%m-%d %H:%M:%S"
+    target = series.iloc[:0].dt.strftime(fmt).dtype
+
+    zone = ""  # %Z of a naive time is empty
+    wall = series
+    if series.dt.tz is not None:
+        if with_zone:
+            zone = _fixed_zone(series)
+            if zone is None:
+                # zone name changes with DST; not worth a fast path
+                return series.dt.strftime(fmt)
+        wall = series.dt.tz_localize(None)
+
+    stamps = wall.to_numpy()
+    missing = np.isnat(stamps)
+    per_second = _TICKS_PER_SECOND[np.datetime_data(stamps.dtype)[0]]
+    seconds = np.where(missing, 0, stamps.view(np.int64) // per_second)
+    days = seconds // _SECONDS_PER_DAY
+    if len(days) and (days.min() < _FIRST_DAY or days.max() > _LAST_DAY):
+        return series.dt.strftime(fmt)
+
+    first = days.min() if len(days) else 0
+    last = days.max() if len(days) else 0
+    dates = np.char.encode(
+        np.datetime_as_string(np.arange(first, last + 1).astype("datetime64[D]")), "ascii"
+    )
+    suffix = (" " + zone).encode() if with_zone else b""
+
+    rows = np.empty(len(stamps), dtype=[("date", "S10"), ("sep", "S1"), ("clock", "S8"), ("zone", f"V{len(suffix)}")])
+    rows["date"] = dates[days - first]
+    rows["sep"] = b" "
+    rows["clock"] = _clock()[seconds - days * _SECONDS_PER_DAY]
+    if suffix:
+        rows["zone"] = np.void(suffix)
+
+    width = rows.dtype.itemsize
+    offsets = np.arange(len(stamps) + 1, dtype=np.int64) * width
+    validity = np.packbits(~missing, bitorder="little")
+    strings = pa.LargeStringArray.from_buffers(
+        len(stamps), pa.py_buffer(offsets), pa.py_buffer(rows.view(np.uint8)), pa.py_buffer(validity),
+        int(missing.sum()),
+    )
+
+    if hasattr(target, "__from_arrow__"):
+        values = target.__from_arrow__(strings)
+    else:
+        values = strings.to_numpy(zero_copy_only=False)
+        values[missing] = np.nan
+    return pd.Series(values, index=series.index, name=series.name, dtype=target)
+
+
+def parse_wall_times(values):
+    """Parse times written by ``format_times`` back to naive local wall clock.
+
+    The inverse of ``format_times`` in one vectorized pass: the values are
+    cut to their first 19 characters in a fixed-width array, which drops
+    any zone suffix, and parsed with the fixed format.
+
+    Args:
+        values: List (or array-like) of ``"%Y-%m-%d %H:%M:%S"`` strings,
+            optionally followed by a zone.
+
+    Returns:
+        datetime64[ns] array; values that do not parse become NaT.
+    """
+    wall = np.asarray(values, dtype="U19")
+    return pd.to_datetime(wall, format="%Y-%m-%d %H:%M:%S", errors="coerce").to_numpy(dtype="datetime64[ns]")
+
+
+def in_window(df, start=None, end=None, column="time"):
+    """Rows of ``df`` whose ``column`` lies in the inclusive ``[start, end]`` window.
+
+    Bounds are compared with the local wall-clock time, so a tz-aware column
+    is compared without its offset. Either bound may be None.
+
+    Args:
+        df: DataFrame with a datetime64 ``column``.
+        start: Earliest time to keep (string or datetime-like), or None.
+        end: Latest time to keep, or None.
+        column: Time column.
+
+    Returns:
+        ``df`` itself without bounds, otherwise the rows in the window.
+    """
+    if start is None and end is None:
+        return df
+    times = df[column]
+    if times.dt.tz is not None:
+        times = times.dt.tz_localize(None)
+    keep = times.notna()
+    if start is not None:
+        keep &= times >= pd.Timestamp(start)
+    if end is not None:
+        keep &= times <= pd.Timestamp(end)
+    return df[keep]
+
+
+def first_time(*frames, column="time"):
+    """Earliest ``column`` value over several tables.
+
+    Tables that are empty (e.g. a stream without rows in the time window)
+    and missing values are ignored.
+
+    Args:
+        *frames: DataFrames holding a ``column``.
+        column: Time column.
+
+    Returns:
+        The earliest value, or None if no table has one.
+    """
+    times = [df[column].min() for df in frames]
+    times = [t for t in times if pd.notna(t)]
+    return min(times) if times else None
@@ -0,0 +1,16 @@
+"""Put the DIAX utilities (``utils/python``) on ``sys.path``.
+
+Modules in ``scripts/`` and ``benchmarks/`` import this before importing
+``diax_io`` and the other utilities as top-level modules, as the utilities
+do when run from their own directory; imported as the ``utils.python``
+package they import each other relatively.
+"""
+
+import os
+import sys
+
+
+UTILS = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "utils", "python"))
+
+if UTILS not in sys.path:
+    sys.path.insert(0, UTILS)
@@ -0,0 +1,56 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the converters are flat scripts importing their siblings, as when run from
+# scripts/; the DIAX utilities are imported the same way from utils/python
+sys.path[:0] = [
+    os.path.join(ROOT, "scripts"),
+    os.path.join(ROOT, "benchmarks"),
+    os.path.join(ROOT, "utils", "python"),
+]
+
+import synthetic  # noqa: E402
+from benchmark import CONVERTERS  # noqa: E402
+from diax_output import OutputOptions  # noqa: E402
+
+EXPECTED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "expected")
+
+# small enough to commit the converted output, large enough for every stream
+SUBJECTS, DAYS, SEED = 2, 1, 0
+
+
+def convert(study, source, output, **options):
+    """Convert every subject of ``study`` with ``OutputOptions(force=True, **options)``."""
+    module, _, function = CONVERTERS[study]
+    options = OutputOptions(force=True, **options)
+    if study == "babelbetes":
+        importlib.import_module(module).convert_all(source, output, None, options=options)
+    else:
+        getattr(importlib.import_module(module), function)(source, output, options=options)
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--update-expected",
+        action="store_true",
+        help="Rewrite tests/expected from the current converters instead of comparing.",
+    )
+
+
+@pytest.fixture
+def update_expected(request):
+    return request.config.getoption("--update-expected")
+
+
+@pytest.fixture
+def source(tmp_path):
+    """Write fresh synthetic sources of one study; staging caches land next to them."""
+
+    def generate(study):
+        return synthetic.generate(str(tmp_path / "src"), [study], subjects=SUBJECTS, days=DAYS, seed=SEED)[study]
+
+    return generate
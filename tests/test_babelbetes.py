@@ -0,0 +1,63 @@
+import glob
+import os
+import shutil
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import babelbetes_converter
+from conftest import ROOT
+
+
+def test_study_missing_a_data_type_does_not_stop_the_others(source, tmp_path, capsys, caplog):
+    src = source("babelbetes")
+    shutil.rmtree(os.path.join(src, "study_name=B", "data_type=basal"))
+
+    processed = babelbetes_converter.convert_all(src, str(tmp_path / "out"), None)
+
+    assert processed == 1
+    assert os.path.exists(tmp_path / "out" / "A" / "subject_A0.json")
+    assert os.path.exists(tmp_path / "out" / "A" / "subject_A1.json")
+    assert not os.path.exists(tmp_path / "out" / "B")
+    assert "Study B failed" in caplog.text
+    rows = {line.split()[0]: line.split()[1:] for line in capsys.readouterr().out.splitlines()[1:]}
+    assert rows["A"][:2] == ["2", "0"]
+    assert rows["B"][:3] == ["-", "study", "-"]
+
+
+def _numeric_ids(src):
+    """Rewrite the synthetic studies with integer patient ids (A0 -> 0)."""
+    for parquet in glob.glob(os.path.join(src, "study_name=*", "data_type=*", "*.parquet")):
+        df = pd.read_parquet(parquet)
+        df["patient_id"] = df["patient_id"].str[1:].astype("int64")
+        df.to_parquet(parquet, index=False)
+
+
+def test_numeric_patient_ids_select_integer_columns(source, tmp_path):
+    src = source("babelbetes")
+    _numeric_ids(src)
+
+    babelbetes_converter.convert_all(src, str(tmp_path / "out"), ["A"], patients=["1"])
+
+    assert os.path.exists(tmp_path / "out" / "A" / "subject_1.json")
+    assert not os.path.exists(tmp_path / "out" / "A" / "subject_0.json")
+
+
+def test_patient_id_of_another_type_is_a_usage_error(source, tmp_path):
+    src = source("babelbetes")
+    _numeric_ids(src)
+
+    with pytest.raises(ValueError, match="'x1'"):
+        babelbetes_converter.check_patients(src, None, ["1", "x1"])
+    result = subprocess.run(
+        [sys.executable, "babelbetes_converter.py", "--source", src, "--output", str(tmp_path / "out"),
+         "--subjects", "1,x1"],
+        cwd=os.path.join(ROOT, "scripts"),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 2
+    assert "error: Patient id 'x1' is not a valid patient_id of type int64." in result.stderr
+    assert not os.path.exists(tmp_path / "out")
@@ -0,0 +1,70 @@
+"""merge_sources: priority deduplication of overlapping CGM sources."""
+import pandas as pd
+import pytest
+
+from cgm_merge import merge_sources
+
+
+def _readings(rows, categorical=False):
+    """Frame of ``(minutes after midnight, source, value)`` rows."""
+    df = pd.DataFrame(rows, columns=["minutes", "source", "value"])
+    df.insert(0, "time", pd.Timestamp("2024-01-01") + pd.to_timedelta(df.pop("minutes"), unit="min"))
+    if categorical:
+        df["source"] = df["source"].astype("category")
+    return df
+
+
+OVERLAP = [
+    (0, "clarity", 100), (5, "clarity", 105), (10, "clarity", 110),
+    # the pump saw the same readings a minute later, and one clarity missed
+    (1, "tandem", 101), (6, "tandem", 106), (11, "tandem", 111), (15, "tandem", 115),
+    # another receiver, within tolerance of the pump only
+    (16, "other", 116), (30, "other", 130),
+]
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_lower_priority_readings_near_a_kept_one_are_dropped(categorical):
+    merged, duplicates = merge_sources(_readings(OVERLAP, categorical), ["clarity", "tandem", "other"])
+    assert duplicates == 4
+    assert list(merged["value"]) == [100, 105, 110, 115, 130]
+    assert list(merged["source"]) == ["clarity", "clarity", "clarity", "tandem", "other"]
+    assert merged["time"].is_monotonic_increasing
+
+
+def test_priority_order_decides_which_source_is_kept():
+    merged, duplicates = merge_sources(_readings(OVERLAP), ["tandem", "clarity", "other"])
+    assert duplicates == 4
+    assert list(merged["source"]) == ["tandem"] * 4 + ["other"]
+
+
+def test_tolerance_bounds_the_duplicates():
+    # every overlap is a minute apart
+    merged, duplicates = merge_sources(_readings(OVERLAP), ["clarity", "tandem", "other"], tolerance=30)
+    assert duplicates == 0
+    assert len(merged) == len(OVERLAP)
+
+
+def test_readings_of_one_source_never_collapse():
+    rows = [(0, "clarity", 100), (0.5, "clarity", 101), (1, "tandem", 102)]
+    merged, duplicates = merge_sources(_readings(rows), ["clarity", "tandem"])
+    assert duplicates == 1
+    assert list(merged["value"]) == [100, 101]
+
+
+def test_unlisted_sources_come_last_and_rows_without_time_are_kept():
+    rows = [(0, "receiver", 90), (1, "clarity", 100), (20, "receiver", 120), (0, "clarity", 999)]
+    df = _readings(rows)
+    df.loc[3, "time"] = pd.NaT
+    merged, duplicates = merge_sources(df, ["clarity"])
+    assert duplicates == 1
+    assert list(merged["value"]) == [100, 120, 999]
+
+
+def test_unknown_name_for_categorical_source_is_rejected():
+    with pytest.raises(ValueError, match="dexcom"):
+        merge_sources(_readings(OVERLAP, categorical=True), ["clarity", "dexcom"])
+
+    # object columns cannot tell a misspelling from an absent source
+    merged, _ = merge_sources(_readings(OVERLAP), ["clarity", "dexcom"])
+    assert len(merged)
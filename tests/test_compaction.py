@@ -0,0 +1,70 @@
+"""``--compact`` against ``time_align``: the aligned frame must not change."""
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import CONVERTERS, convert
+from diax_io import load_diax
+from diax_output import compact_streams
+from time_align import time_align
+
+
+def _aligned(output_file):
+    data = load_diax(output_file)
+    streams = {}
+    for key, stream in data.items():
+        if key == "metadata" or not isinstance(stream, dict) or not isinstance(stream.get("time"), list):
+            continue
+        if not stream["time"] or not all(isinstance(v, (int, float)) for v in stream["value"]):
+            continue
+        # local wall clock, as time_align does not parse a zone suffix (Loop)
+        streams[key] = {"time": [t[:19] for t in stream["time"]], "value": stream["value"]}
+    return time_align(streams, sampling_period=5)
+
+
+@pytest.mark.parametrize("study", sorted(CONVERTERS))
+def test_compaction_keeps_time_aligned_output(study, source, tmp_path):
+    data = source(study)
+    full, compact = str(tmp_path / "full"), str(tmp_path / "compact")
+    convert(study, data, full)
+    convert(study, data, compact, compact=True)
+
+    files = sorted(glob.glob(os.path.join(full, "**", "*.json"), recursive=True))
+    assert files
+    for path in files:
+        pd.testing.assert_frame_equal(_aligned(path), _aligned(path.replace(full, compact, 1)))
+
+
+def _basal(times, values):
+    return {"basal_rate": {"time": list(times), "value": list(values)}}
+
+
+def _aligned_stream(output):
+    return time_align(
+        {key: {"time": list(s["time"]), "value": list(s["value"])} for key, s in output.items() if key != "metadata"},
+        sampling_period=5,
+    )
+
+
+@pytest.mark.parametrize(
+    "times, values",
+    [
+        # one rate for three days: a row is kept at least every 24 hours
+        (pd.date_range("2024-01-01 00:02", periods=3 * 288, freq="5min"), [0.8] * (3 * 288)),
+        # two rates within one 5-minute bin are averaged by time_align, so the bin stays
+        (["2024-01-01 00:01", "2024-01-01 00:02", "2024-01-01 00:03", "2024-01-01 00:07", "2024-01-01 00:12"],
+         [1.0, 1.0, 2.0, 2.0, 2.0]),
+        # rows out of time order (Loop) are compacted in time order
+        (["2024-01-01 00:12", "2024-01-01 00:02", "2024-01-01 00:22", "2024-01-01 00:07", "2024-01-01 00:17"],
+         [1.0, 0.5, 1.0, 0.5, 1.0]),
+    ],
+)
+def test_run_length_keeps_time_aligned_basal(times, values):
+    times = [str(pd.Timestamp(t)) for t in times]
+    compacted = compact_streams(_basal(times, values))
+
+    kept = pd.to_datetime(compacted["basal_rate"]["time"]).sort_values()
+    assert kept.to_series().diff().max() <= pd.Timedelta(hours=24)
+    pd.testing.assert_frame_equal(_aligned_stream(compacted), _aligned_stream(_basal(times, values)))
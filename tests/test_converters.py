@@ -0,0 +1,39 @@
+"""Every converter on a small synthetic study, against committed output.
+
+After an intended change of the output, rewrite the expected files with
+``python -m pytest tests --update-expected`` and review their diff.
+"""
+import filecmp
+import os
+import shutil
+
+import pytest
+
+from conftest import CONVERTERS, EXPECTED, convert
+
+
+def _subject_files(directory):
+    """Relative paths of the subject files below ``directory`` (no manifests or summaries)."""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        found += [os.path.relpath(os.path.join(root, f), directory) for f in files if not f.startswith(".")]
+    return sorted(found)
+
+
+@pytest.mark.parametrize("study", sorted(CONVERTERS))
+def test_output_matches_expected(study, source, tmp_path, update_expected):
+    output = str(tmp_path / "out")
+    convert(study, source(study), output)
+
+    expected = os.path.join(EXPECTED, study)
+    if update_expected:
+        shutil.rmtree(expected, ignore_errors=True)
+        for name in _subject_files(output):
+            os.makedirs(os.path.dirname(os.path.join(expected, name)), exist_ok=True)
+            shutil.copyfile(os.path.join(output, name), os.path.join(expected, name))
+
+    names = _subject_files(output)
+    assert names == _subject_files(expected)
+    for name in names:
+        assert filecmp.cmp(os.path.join(output, name), os.path.join(expected, name), shallow=False), name
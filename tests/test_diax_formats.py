@@ -0,0 +1,79 @@
+"""DIAX file formats: every format reads back as the same dict, and .diax streams by time."""
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXPECTED
+from diax_binary import read_streams
+from diax_io import FORMATS, convert_files, load_diax, write_diax
+from timestamps import parse_wall_times
+
+SUBJECTS = sorted(glob.glob(os.path.join(EXPECTED, "**", "*.json"), recursive=True))
+FORMATS_HERE = [fmt for fmt in ("json", "json.gz", "diax") if fmt in FORMATS]
+
+
+def _multi_day(days=3):
+    """A time-sorted subject over several days, with a zone suffix, an int and a text stream."""
+    times = pd.date_range("2024-01-01 00:03", periods=days * 288, freq="5min")
+    return {
+        "metadata": {"cgm": {"unit": "mg/dL"}},
+        "unique_id": 12,
+        "weight": {"time": "2024-01-01 00:00:00", "value": 70.5},
+        "cgm": {"time": [f"{t} -0500" for t in times], "value": [float(100 + i % 50) for i in range(len(times))]},
+        "steps": {"time": [str(t) for t in times[::12]], "value": [i % 7 for i in range(len(times[::12]))]},
+        "carb_category": {"time": [str(times[5])], "value": ["More"]},
+    }
+
+
+@pytest.mark.parametrize("fmt", FORMATS_HERE)
+@pytest.mark.parametrize("path", SUBJECTS, ids=lambda path: os.path.relpath(path, EXPECTED))
+def test_converter_output_reads_back_equal(path, fmt, tmp_path):
+    data = load_diax(path)
+    written = write_diax(data, str(tmp_path / f"subject.{fmt}"))
+    assert load_diax(written) == data
+
+
+@pytest.mark.parametrize("fmt", FORMATS_HERE)
+def test_multi_day_subject_reads_back_equal(fmt, tmp_path):
+    data = _multi_day()
+    assert load_diax(write_diax(data, str(tmp_path / f"subject.{fmt}"))) == data
+
+
+def test_read_streams_matches_the_loaded_streams(tmp_path):
+    data = _multi_day()
+    path = write_diax(data, str(tmp_path / "subject.diax"))
+
+    frames = read_streams(path)
+    assert set(frames) == {"cgm", "steps", "carb_category"}
+    for key, frame in frames.items():
+        assert list(frame["time"]) == list(parse_wall_times(data[key]["time"]))
+        assert list(frame["value"]) == data[key]["value"]
+    assert set(frames["cgm"]["zone"]) == {" -0500"}  # the suffix as written, space included
+
+
+def test_read_streams_time_bounds_use_the_day_index(tmp_path):
+    data = _multi_day()
+    path = write_diax(data, str(tmp_path / "subject.diax"))
+
+    with np.load(path) as npz:
+        days = npz["s0_day"]
+        day_start = npz["s0_day_start"]
+    assert len(days) == 3
+    assert list(day_start) == [0, 288, 576]
+
+    start, end = "2024-01-02 00:00", "2024-01-02 01:00"
+    frames = read_streams(path, streams=["cgm"], start_time=start, end_time=end)
+    times = pd.Series(parse_wall_times(data["cgm"]["time"]))
+    inside = (times >= pd.Timestamp(start)) & (times <= pd.Timestamp(end))
+    assert set(frames) == {"cgm"}
+    assert list(frames["cgm"]["time"]) == list(times[inside])
+    assert list(frames["cgm"]["value"]) == [v for v, keep in zip(data["cgm"]["value"], inside) if keep]
+
+
+def test_convert_files_keeps_the_stem(tmp_path):
+    source = write_diax(_multi_day(), str(tmp_path / "subj_1.json"))
+    assert convert_files([str(tmp_path)], "diax") == 1
+    assert load_diax(str(tmp_path / "subj_1.diax")) == load_diax(source)
@@ -0,0 +1,69 @@
+"""Parquet export of raw and aligned DIAX data, read back with time bounds."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from diax_parquet import export_aligned, export_raw, read_parquet
+from time_align import time_align
+
+START = pd.Timestamp("2024-03-01 22:00")
+
+
+def _subject():
+    """Two hours of 5-minute CGM written, as converters do, in local time with an offset."""
+    wall = pd.date_range(START, periods=24, freq="5min")
+    return {
+        "metadata": {},
+        "unique_id": "7",
+        "cgm": {"time": [f"{t} -0400" for t in wall], "value": list(100.0 + np.arange(24))},
+        "carb_category": {"time": [f"{wall[3]} -0400"], "value": ["Typical"]},
+    }
+
+
+def _aligned(subject):
+    wall = {key: {"time": [t[:19] for t in s["time"]], "value": s["value"]} for key, s in subject.items()
+            if key == "cgm"}
+    aligned = time_align(wall, sampling_period=5)
+    # the same local times, now with their offset (UTC-4)
+    aligned.index = aligned.index.tz_localize("Etc/GMT+4")
+    return aligned
+
+
+def test_raw_and_aligned_select_the_same_local_times(tmp_path):
+    subject = _subject()
+    root = str(tmp_path)
+    export_raw(subject, root, "study")
+    export_aligned(_aligned(subject), root, "study", "7")
+
+    bounds = {"start_time": "2024-03-01 22:30", "end_time": "2024-03-01 23:00"}
+    raw = read_parquet(root, "raw", streams=["cgm"], **bounds)
+    aligned = read_parquet(root, "aligned", subjects=["7"], **bounds)
+
+    expected = pd.date_range("2024-03-01 22:30", "2024-03-01 23:00", freq="5min")
+    assert list(raw["time"]) == list(expected)
+    assert list(aligned["time"]) == list(expected)
+    assert set(raw["utc_offset"]) == set(aligned["utc_offset"]) == {-240}
+    np.testing.assert_allclose(raw["value"], aligned["cgm"])
+    assert set(raw["subject"]) == set(aligned["subject"]) == {"7"}
+
+
+def test_raw_keeps_text_streams_and_naive_times(tmp_path):
+    subject = _subject()
+    subject["smbg"] = {"time": [str(START)], "value": [123]}
+    export_raw(subject, str(tmp_path), "study")
+
+    carbs = read_parquet(str(tmp_path), "raw", streams=["carb_category"])
+    assert list(carbs["text"]) == ["Typical"]
+    assert carbs["value"].isna().all()
+
+    smbg = read_parquet(str(tmp_path), "raw", streams=["smbg"])
+    assert list(smbg["time"]) == [START]
+    assert smbg["utc_offset"].isna().all()
+
+
+@pytest.mark.parametrize("time", ["2024-03-01T22:00:00", "2024-03-01 22:00:00 EST", "yesterday"])
+def test_time_that_is_not_a_diax_timestamp_is_rejected(tmp_path, time):
+    subject = _subject()
+    subject["cgm"]["time"][5] = time
+    with pytest.raises(ValueError, match="not DIAX timestamps"):
+        export_raw(subject, str(tmp_path), "study")
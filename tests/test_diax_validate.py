@@ -0,0 +1,114 @@
+"""diax_validate on a valid converter output and on malformed files."""
+import copy
+import json
+import os
+
+import pytest
+
+from conftest import EXPECTED
+from diax_io import load_diax, write_diax
+from diax_validate import validate, validate_file
+
+VALID = os.path.join(EXPECTED, "dclp3", "DCLP3_subject_1.json")
+
+
+def _checks(result):
+    return {(issue["level"], issue["check"], issue.get("stream")) for issue in result["issues"]}
+
+
+def _write(tmp_path, data, name="subject.json"):
+    return write_diax(data, str(tmp_path / name))
+
+
+def test_converter_output_is_valid():
+    result = validate_file(VALID)
+    assert result["ok"], result["issues"]
+    assert result["issues"] == []
+    assert result["streams"]["cgm"]["shape"] == "list"
+    assert result["streams"]["cgm"]["unsorted"] == 0
+
+
+def _broken(tmp_path, change):
+    data = copy.deepcopy(load_diax(VALID))
+    change(data)
+    return validate_file(_write(tmp_path, data))
+
+
+def test_unsorted_times_are_an_error(tmp_path):
+    def swap(data):
+        times = data["cgm"]["time"]
+        times[3], times[4] = times[4], times[3]
+
+    result = _broken(tmp_path, swap)
+    assert not result["ok"]
+    assert ("error", "unsorted_times", "cgm") in _checks(result)
+    assert result["streams"]["cgm"]["unsorted"] == 1
+
+
+def test_length_mismatch_is_an_error(tmp_path):
+    result = _broken(tmp_path, lambda data: data["bolus"]["value"].pop())
+    assert not result["ok"]
+    issue = next(issue for issue in result["issues"] if issue["check"] == "length_mismatch")
+    assert issue["stream"] == "bolus"
+    assert issue["count"] == 1
+
+
+def test_values_in_other_units_are_an_error(tmp_path):
+    def to_mmol(data):
+        data["cgm"]["value"] = [value / 18.0 for value in data["cgm"]["value"]]
+        data["metadata"]["cgm"]["unit"] = "mmol/L"
+
+    result = _broken(tmp_path, to_mmol)
+    assert not result["ok"]
+    issue = next(issue for issue in result["issues"] if issue["check"] == "unit")
+    assert issue["stream"] == "cgm"
+    assert issue["detail"] == "'mmol/L', expected mg/dL"
+    # the values themselves are implausible in mg/dL, which is counted, not rejected
+    assert ("warning", "out_of_range", "cgm") in _checks(result)
+    assert result["streams"]["cgm"]["out_of_range"] == len(load_diax(VALID)["cgm"]["value"])
+
+
+def test_unit_spellings_of_the_converters_are_accepted():
+    for path in (VALID, os.path.join(EXPECTED, "t1dexi", "T1Dexi_101.json")):
+        assert "unit" not in {issue["check"] for issue in validate_file(path)["issues"]}
+
+
+@pytest.mark.parametrize(
+    "change, check",
+    [
+        (lambda data: data["cgm"]["time"].__setitem__(0, "2021-01-01T00:00:00"), "time_format"),
+        (lambda data: data["cgm"]["time"].__setitem__(0, data["cgm"]["time"][0] + " EST"), "time_zone_format"),
+        (lambda data: data["bolus"]["value"].__setitem__(0, -1.0), "negative_values"),
+        (lambda data: data.__setitem__("height", {"time": [], "value": 170}), "scalar_list_mismatch"),
+        (lambda data: data.__setitem__("weight", {"date": ["2021-01-01"], "value": [70]}), "missing_time_or_value"),
+        (lambda data: data.pop("unique_id"), "missing_unique_id"),
+    ],
+)
+def test_malformed_stream_is_an_error(tmp_path, change, check):
+    result = _broken(tmp_path, change)
+    assert not result["ok"]
+    assert check in {issue["check"] for issue in result["issues"] if issue["level"] == "error"}
+
+
+def test_unreadable_file_is_reported(tmp_path):
+    path = tmp_path / "subject.json"
+    path.write_text("{not json")
+    result = validate_file(str(path))
+    assert not result["ok"]
+    assert result["issues"][0]["check"] == "unreadable"
+
+
+def test_report_counts_files_and_inconsistent_shapes(tmp_path):
+    data = load_diax(VALID)
+    _write(tmp_path, data, "a.json")
+    data["weight"] = {"time": [data["weight"]["time"]], "value": [data["weight"]["value"]]}
+    _write(tmp_path, data, "b.json.gz")
+    (tmp_path / "notes.txt").write_text("not a DIAX file")
+
+    report = validate([str(tmp_path)], jobs=1)
+    assert report["files"] == 2
+    assert report["valid"] == 2
+    assert report["errors"] == 0
+    assert set(report["inconsistent_shapes"]) == {"weight"}
+    assert report["warnings"] == 1
+    json.dumps(report)
@@ -0,0 +1,31 @@
+"""The DIAX utilities import as ``utils.python`` modules, as examples/example.py does.
+
+Each import runs in a fresh interpreter with only the repository root on
+the path, since this test session already has ``utils/python`` on it.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+def _import(module):
+    env = {key: value for key, value in os.environ.items() if key != "PYTHONPATH"}
+    return subprocess.run(
+        [sys.executable, "-c", f"import {module}"], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+
+
+@pytest.mark.parametrize("module", ["time_align", "diax_io", "diax_validate", "diax_parquet", "sliding_windows"])
+def test_utility_imports_through_package(module):
+    result = _import(f"utils.python.{module}")
+    assert result.returncode == 0, result.stderr
+
+
+def test_diax_class_imports_through_package():
+    pytest.importorskip("matplotlib")
+    result = _import("utils.python.DIAX")
+    assert result.returncode == 0, result.stderr
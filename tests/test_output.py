@@ -0,0 +1,76 @@
+"""Shared output path: manifest, study summary, time window and CGM merge options."""
+import logging
+import os
+
+import pandas as pd
+import pytest
+
+from dclp3 import process_all_dclp3
+from dclp5 import process_all_dclp5
+from diax_output import OutputOptions
+from loop import process_all_loop
+from summary import DAILY_SUMMARY, SUMMARY
+from t1dexi import process_all_t1dexi
+
+
+def _mtimes(directory):
+    return {name: os.stat(os.path.join(directory, name)).st_mtime_ns for name in os.listdir(directory)
+            if name.endswith(".json")}
+
+
+def test_up_to_date_study_is_not_converted_again(source, tmp_path):
+    data, output = source("dclp3"), str(tmp_path / "out")
+    assert process_all_dclp3(data, output) == 2
+    written = _mtimes(output)
+
+    assert process_all_dclp3(data, output) == 0
+    assert _mtimes(output) == written
+    assert process_all_dclp3(data, output, options=OutputOptions(fmt="json.gz")) == 2
+
+
+def test_summary_added_later_matches_summary_written_while_converting(source, tmp_path):
+    data = source("dclp3")
+    converting, later = str(tmp_path / "converting"), str(tmp_path / "later")
+    process_all_dclp3(data, converting, options=OutputOptions(summary=True))
+
+    process_all_dclp3(data, later)
+    written = _mtimes(later)
+    assert process_all_dclp3(data, later, options=OutputOptions(summary=True)) == 0
+    assert _mtimes(later) == written
+
+    for name in (SUMMARY, DAILY_SUMMARY):
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(os.path.join(later, name)), pd.read_parquet(os.path.join(converting, name))
+        )
+
+
+def test_rewriting_without_summary_removes_the_tables(source, tmp_path):
+    data, output = source("dclp3"), str(tmp_path / "out")
+    process_all_dclp3(data, output, options=OutputOptions(summary=True))
+    assert os.path.exists(os.path.join(output, SUMMARY))
+
+    process_all_dclp3(data, output, options=OutputOptions(force=True))
+    assert not os.path.exists(os.path.join(output, SUMMARY))
+
+
+def test_loop_subject_without_data_in_window_is_skipped(source, tmp_path):
+    output = str(tmp_path / "out")
+    options = OutputOptions(start="1990-01-01", end="1990-01-02")
+    assert process_all_loop(source("loop"), output, options=options) == 0
+    assert _mtimes(output) == {}
+
+
+def test_t1dexi_subject_without_bolus_or_basal_in_window_is_skipped(source, tmp_path, caplog):
+    # carbs, CGM, steps and heart rate fall in this hour; bolus (every 4 h) and
+    # injected basal (daily) do not, so every subject is skipped, none fails
+    output = str(tmp_path / "out")
+    options = OutputOptions(start="2021-01-01 05:30:00", end="2021-01-01 06:30:00")
+    with caplog.at_level(logging.ERROR):
+        assert process_all_t1dexi(source("t1dexi"), output, options=options) == 0
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+    assert _mtimes(output) == {}
+
+
+def test_dclp5_rejects_unknown_cgm_source(source, tmp_path):
+    with pytest.raises(ValueError, match="dexcom"):
+        process_all_dclp5(source("dclp5"), str(tmp_path / "out"), cgm_priority=("clarity", "dexcom"))
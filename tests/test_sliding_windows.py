@@ -0,0 +1,82 @@
+"""SlidingWindowDataset over a time_align-style frame."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from sliding_windows import SlidingWindowDataset
+
+
+def _aligned(n=20, drop=()):
+    """``n`` 5-minute rows of cgm = 0, 1, 2, ... and insulin = -cgm, without the rows in ``drop``."""
+    index = pd.date_range("2024-01-01", periods=n, freq="5min", name="time")
+    frame = pd.DataFrame({"cgm": np.arange(n, dtype=float), "insulin": -np.arange(n, dtype=float)}, index=index)
+    # time_align drops the rows where every column is missing
+    return frame.drop(frame.index[list(drop)])
+
+
+@pytest.mark.parametrize("stride, starts", [(1, list(range(15))), (3, [0, 3, 6, 9, 12]), (20, [0])])
+def test_window_starts_follow_stride(stride, starts):
+    dataset = SlidingWindowDataset(_aligned(), history=4, horizon=2, stride=stride)
+    assert list(dataset.starts) == starts
+    assert len(dataset) == len(starts)
+
+
+def test_window_holds_history_and_horizon():
+    dataset = SlidingWindowDataset(_aligned(), history=4, horizon=2, features=["cgm", "insulin"])
+    inputs, targets = dataset[3]
+    np.testing.assert_array_equal(inputs, [[3, -3], [4, -4], [5, -5], [6, -6]])
+    np.testing.assert_array_equal(targets, [7, 8])
+
+    # the last window ends on the last row
+    inputs, targets = dataset[len(dataset) - 1]
+    np.testing.assert_array_equal(targets, [18, 19])
+
+
+def test_frame_shorter_than_window_has_no_windows():
+    dataset = SlidingWindowDataset(_aligned(5), history=4, horizon=2)
+    assert len(dataset) == 0
+    assert len(list(dataset.batches(batch_size=4))) == 0
+
+
+@pytest.mark.parametrize("history, horizon, stride", [(0, 1, 1), (1, 0, 1), (1, 1, 0)])
+def test_non_positive_sizes_are_rejected(history, horizon, stride):
+    with pytest.raises(ValueError):
+        SlidingWindowDataset(_aligned(), history=history, horizon=horizon, stride=stride)
+
+
+def test_windows_do_not_cross_a_gap_in_time():
+    # rows 8 and 9 were dropped by time_align; they are re-inserted as missing
+    dataset = SlidingWindowDataset(_aligned(drop=(8, 9)), history=4, horizon=2)
+    assert len(dataset.times) == 20
+    assert list(dataset.starts) == [0, 1, 2] + list(range(10, 15))
+
+    # one missing target sample allowed: windows holding only one of the two
+    tolerant = SlidingWindowDataset(_aligned(drop=(8, 9)), history=4, horizon=2, max_missing=1)
+    assert list(tolerant.starts) == [0, 1, 2, 3, 9, 10, 11, 12, 13, 14]
+
+
+def test_batches_stack_the_windows_in_order():
+    dataset = SlidingWindowDataset(_aligned(drop=(8, 9)), history=4, horizon=2, stride=2)
+    batches = list(dataset.batches(batch_size=3))
+    assert [len(targets) for _, targets, _ in batches] == [3, 2]
+
+    inputs = np.concatenate([batch[0] for batch in batches])
+    targets = np.concatenate([batch[1] for batch in batches])
+    times = pd.DatetimeIndex(np.concatenate([batch[2] for batch in batches]))
+    for i in range(len(dataset)):
+        np.testing.assert_array_equal(inputs[i], dataset[i][0])
+        np.testing.assert_array_equal(targets[i], dataset[i][1])
+    assert list(times) == list(dataset.times[dataset.starts])
+
+    assert [len(t) for _, t, _ in dataset.batches(batch_size=3, drop_last=True)] == [3]
+
+
+def test_worker_batches_match_in_process_batches():
+    dataset = SlidingWindowDataset(_aligned(), history=4, horizon=2)
+    local = list(dataset.batches(batch_size=4, shuffle=True, seed=1))
+    pooled = list(dataset.batches(batch_size=4, shuffle=True, seed=1, num_workers=2))
+    assert len(local) == len(pooled)
+    for (inputs, targets, times), (p_inputs, p_targets, p_times) in zip(local, pooled):
+        np.testing.assert_array_equal(inputs, p_inputs)
+        np.testing.assert_array_equal(targets, p_targets)
+        assert list(times) == list(p_times)
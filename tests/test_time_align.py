@@ -0,0 +1,75 @@
+"""time_align gap handling: gap_index, gap_mask, coverage, valid_windows and missing_tolerance."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from time_align import coverage, gap_index, gap_mask, time_align, valid_windows
+
+START = pd.Timestamp("2024-01-01 00:00")
+
+
+def _cgm(missing, before=10, after=10):
+    """5-minute CGM with ``missing`` samples left out after the first ``before``."""
+    positions = list(range(before)) + list(range(before + missing, before + missing + after))
+    return {
+        "cgm": {
+            "time": [str(START + pd.Timedelta(minutes=5 * k)) for k in positions],
+            "value": [100.0 + k for k in positions],
+        }
+    }
+
+
+def test_gap_index_lists_runs_of_missing_samples():
+    index = pd.date_range(START, periods=10, freq="5min")
+    series = pd.Series([1, np.nan, np.nan, 4, 5, np.nan, 7, 8, 9, np.nan], index=index)
+    gaps = gap_index(series)
+
+    assert list(gaps["samples"]) == [2, 1, 1]
+    assert list(gaps["first"]) == [1, 5, 9]
+    assert list(gaps["stop"]) == [3, 6, 10]
+    assert list(gaps["start"]) == [index[1], index[5], index[9]]
+    assert list(gaps["end"]) == [index[2], index[5], index[9]]
+
+    assert list(gap_mask(gaps, len(series), min_samples=2)) == [False, True, True] + [False] * 7
+    assert coverage(gaps, len(series)) == pytest.approx(60.0)
+    assert coverage(gap_index(series.iloc[:0]), 0) == 0.0
+
+
+def test_valid_windows_rejects_windows_overlapping_a_gap():
+    index = pd.date_range(START, periods=10, freq="5min")
+    gaps = gap_index(pd.Series([1, 2, np.nan, np.nan, 5, 6, 7, 8, 9, 10], index=index))
+    valid = valid_windows(gaps, index[[0, 1, 3, 4]], index[[1, 2, 5, 6]])
+    assert list(valid) == [True, False, False, True]
+
+
+@pytest.mark.parametrize("missing, filled", [(12, True), (13, False)])
+def test_gap_at_missing_limit_is_filled_and_longer_one_left_empty(missing, filled):
+    # cgm tolerance is 60 minutes: 12 samples at a 5-minute period
+    aligned, gaps = time_align(_cgm(missing), sampling_period=5, return_gaps=True)
+
+    hole = pd.date_range(START + pd.Timedelta(minutes=50), periods=missing, freq="5min")
+    assert len(gaps["cgm"]) == 1
+    assert gaps["cgm"]["samples"].iloc[0] == missing
+    assert gaps["cgm"]["start"].iloc[0] == hole[0]
+    assert gaps["cgm"]["end"].iloc[0] == hole[-1]
+
+    if filled:
+        # the whole gap is interpolated, not only its first samples
+        np.testing.assert_allclose(aligned.loc[hole, "cgm"], 110.0 + np.arange(missing))
+    else:
+        # the whole gap stays empty (its rows are all-NaN, so they are dropped)
+        assert not aligned.index.isin(hole).any()
+        assert len(aligned) == 20
+
+
+def test_missing_tolerance_sets_the_limit_per_stream():
+    aligned = time_align(_cgm(13), sampling_period=5, missing_tolerance={"cgm": 65})
+    assert len(aligned) == 33
+    assert aligned["cgm"].notna().all()
+
+
+def test_gaps_are_reported_before_filling():
+    aligned, gaps = time_align(_cgm(0), sampling_period=5, return_gaps=True)
+    assert set(gaps) == {"cgm"}
+    assert gaps["cgm"].empty
+    assert len(aligned) == 20
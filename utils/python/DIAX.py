@@ -1,4 +1,3 @@
-import json
 import logging
 import multiprocessing
 import os
@@ -13,6 +12,11 @@ plt.style.use('default')
 import numpy as np
 import pandas as pd
 
+try:
+    from .diax_io import load_diax
+except ImportError:  # imported as a top-level module
+    from diax_io import load_diax
+
 logger = logging.getLogger("DIAX")
 if os.environ.get('NUMBER_OF_PROCESSORS'):
     cpu_count = int(os.environ['NUMBER_OF_PROCESSORS'])
@@ -49,7 +53,7 @@ class DIAX:
     
     def load_json(self, json_file):
         """
-        Load diabetes data from JSON file.
+        Load diabetes data from JSON file (plain, .json.gz or .json.zst).
         
         Expected JSON format:
         {
@@ -61,8 +65,7 @@ class DIAX:
             "treat": {"time": [...], "value": [...]}
         }
         """
-        with open(json_file, 'r') as f:
-            json_data = json.load(f)
+        json_data = load_diax(json_file)
         
         # Extract metadata
         self.name = json_data.get('unique_id', json_data.get('subject_id', 'unknown'))
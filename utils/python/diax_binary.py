@@ -0,0 +1,308 @@
+import json
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+FORMAT = 'diax-binary'
+VERSION = 1
+
+_SECONDS_PER_DAY = 86400
+_CLOCK = None  # 'H:M:S' of every second of the day, built on first use
+
+
+def _split_times(times):
+    """
+    Encode DIAX time strings as epoch seconds plus a zone suffix code.
+
+    Returns None unless every time is 'Y-m-d H:M:S' followed by an optional
+    suffix (e.g. ' UTC-05:00') and renders back to exactly the same string.
+    """
+    if not set(map(type, times)) <= {str}:
+        return None
+    text = pd.Series(times, dtype=object)
+    wall = pd.to_datetime(text.str.slice(0, 19), format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    if wall.isna().any():
+        return None
+    codes, zones = pd.factorize(text.str.slice(19))
+    seconds = wall.to_numpy(dtype='datetime64[s]').view(np.int64)
+    zones = list(zones)
+    if _render_times(seconds, codes, zones) != list(times):
+        return None
+    return seconds, codes, zones
+
+
+def _clock():
+    global _CLOCK
+    if _CLOCK is None:
+        seconds = np.arange(_SECONDS_PER_DAY).astype('datetime64[s]')
+        text = np.datetime_as_string(seconds, unit='s').astype('U19')
+        _CLOCK = text.view('U1').reshape(-1, 19)[:, 11:].copy().view('U8').ravel()
+    return _CLOCK
+
+
+def _render_times(seconds, codes, zones):
+    """
+    Inverse of _split_times.
+
+    Rows are assembled from one 'Y-m-d' string per day in range and a table
+    of the 86400 'H:M:S' strings, instead of formatting every timestamp.
+    """
+    if len(seconds) == 0:
+        return []
+    days = seconds // _SECONDS_PER_DAY
+    first, last = days.min(), days.max()
+    if last - first > len(seconds) + 366:
+        # sparse dates over a long span, a day table would be mostly unused
+        text = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s').astype('U19')
+        text.view('U1').reshape(-1, 19)[:, 10] = ' '
+    else:
+        dates = np.datetime_as_string(np.arange(first, last + 1).astype('datetime64[D]')).astype('U10')
+        rows = np.empty(len(seconds), dtype=[('date', 'U10'), ('sep', 'U1'), ('clock', 'U8')])
+        rows['date'] = dates[days - first]
+        rows['sep'] = ' '
+        rows['clock'] = _clock()[seconds - days * _SECONDS_PER_DAY]
+        text = rows.view('U19')
+    if len(zones) > 1:
+        text = np.char.add(text, np.asarray(zones)[codes])
+    elif zones and zones[0]:
+        text = np.char.add(text, zones[0])
+    return text.tolist()
+
+
+def _value_array(values):
+    """
+    Natural array of a value list, or None if it would not load back equal.
+
+    Floats are stored as float32 when that is exact, ints in the smallest
+    signed type holding their range.
+    """
+    types = set(map(type, values))
+    if not values or types == {float}:
+        array = np.asarray(values, dtype=np.float64)
+        narrow = array.astype(np.float32)
+        if np.array_equal(narrow.astype(np.float64), array, equal_nan=True):
+            return narrow
+        return array
+    if types == {int}:
+        try:
+            array = np.asarray(values, dtype=np.int64)
+        except OverflowError:
+            return None
+        for dtype in (np.int8, np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if array.min() >= info.min and array.max() <= info.max:
+                return array.astype(dtype)
+        return array
+    if types == {str}:
+        array = np.asarray(values, dtype=str)
+        # numpy strips trailing NULs
+        return array if array.tolist() == values else None
+    return None
+
+
+def _encode_stream(stream):
+    """Arrays and header entry of a {'time': [...], 'value': [...]} stream, or None."""
+    if not isinstance(stream, dict) or set(stream) != {'time', 'value'}:
+        return None
+    times, values = stream['time'], stream['value']
+    if not isinstance(times, list) or not isinstance(values, list) or len(times) != len(values):
+        return None
+
+    split = _split_times(times)
+    value = _value_array(values)
+    if split is None or value is None:
+        return None
+    seconds, codes, zones = split
+
+    header = {'keys': list(stream), 'length': len(seconds), 'start': int(seconds[0]) if len(seconds) else 0,
+              'zones': zones, 'sorted': bool(np.all(np.diff(seconds) >= 0))}
+    steps = np.diff(seconds)
+    info = np.iinfo(np.int32)
+    if len(steps) and (steps.min() < info.min or steps.max() > info.max):
+        arrays = {'step': steps}
+    else:
+        arrays = {'step': steps.astype(np.int32)}
+    arrays['value'] = value
+    if len(zones) > 1:
+        arrays['zone'] = codes.astype(np.uint8 if len(zones) <= 256 else np.int32)
+    if header['sorted'] and len(seconds):
+        days = seconds // _SECONDS_PER_DAY
+        first = np.concatenate([[0], np.flatnonzero(np.diff(days)) + 1])
+        arrays['day'] = days[first].astype(np.int32)
+        arrays['day_start'] = first.astype(np.int64)
+    return arrays, header
+
+
+def write_binary(diax_data: Dict[str, Any], path: str) -> str:
+    """
+    Write a DIAX subject in the columnar binary format.
+
+    Every top-level ``{'time': [...], 'value': [...]}`` stream is stored as
+    arrays in an uncompressed ``.npz`` container:
+
+    - times as int64 epoch seconds of the local wall clock, kept as the
+      first time plus int32 steps (int64 if a step does not fit),
+    - a zone suffix code per row when a stream mixes several suffixes,
+    - values as float32/float64, the smallest int type, or strings,
+    - for time-sorted streams, the first row of every calendar day.
+
+    Everything else (metadata, scalars, streams that would not round-trip)
+    is kept as JSON in the header, so ``load_binary`` returns exactly what
+    the JSON writer would have written.
+
+    Parameters
+    ----------
+    diax_data : dict
+        DIAX output of a converter.
+    path : str
+        Output file, conventionally ``*.diax``.
+
+    Returns
+    -------
+    str
+        ``path``.
+    """
+    document = {}
+    streams = {}
+    arrays = {}
+    for key, item in diax_data.items():
+        encoded = _encode_stream(item)
+        if encoded is None:
+            document[key] = item
+            continue
+        index = len(streams)
+        stream_arrays, streams[key] = encoded
+        streams[key]['index'] = index
+        document[key] = None  # placeholder, keeps the key order
+        arrays.update({f's{index}_{name}': array for name, array in stream_arrays.items()})
+
+    header = {'format': FORMAT, 'version': VERSION, 'document': document, 'streams': streams}
+    header = json.dumps(header, default=str, separators=(',', ':')).encode('utf-8')
+    with open(path, 'wb') as fh:
+        # a file object keeps numpy from appending '.npz' to the name
+        np.savez(fh, header=np.frombuffer(header, dtype=np.uint8), **arrays)
+    return path
+
+
+def _read_header(npz):
+    header = json.loads(npz['header'].tobytes().decode('utf-8'))
+    if header.get('format') != FORMAT:
+        raise ValueError('Not a DIAX binary file')
+    if header['version'] > VERSION:
+        raise ValueError(f"DIAX binary version {header['version']} is newer than supported ({VERSION})")
+    return header
+
+
+def _stream_seconds(npz, meta):
+    prefix = f"s{meta['index']}_"
+    seconds = np.empty(meta['length'], dtype=np.int64)
+    if meta['length']:
+        seconds[0] = meta['start']
+        np.cumsum(npz[prefix + 'step'], out=seconds[1:])
+        seconds[1:] += meta['start']
+    return seconds
+
+
+def _stream_codes(npz, meta):
+    name = f"s{meta['index']}_zone"
+    return npz[name] if name in npz.files else np.zeros(meta['length'], dtype=np.uint8)
+
+
+def load_binary(path: str) -> Dict[str, Any]:
+    """
+    Load a binary DIAX file as the same dict its JSON form parses to.
+
+    Parameters
+    ----------
+    path : str
+        File written by ``write_binary``.
+
+    Returns
+    -------
+    dict
+        DIAX data with time strings and value lists.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        header = _read_header(npz)
+        data = header['document']
+        for key, meta in header['streams'].items():
+            times = _render_times(_stream_seconds(npz, meta), _stream_codes(npz, meta), meta['zones'])
+            values = npz[f"s{meta['index']}_value"].tolist()
+            stream = {'time': times, 'value': values}
+            data[key] = {k: stream[k] for k in meta['keys']}
+    return data
+
+
+def _row_range(npz, meta, start, end):
+    """Rows of a sorted stream that can fall in [start, end], from the day index."""
+    prefix = f"s{meta['index']}_"
+    if not meta['sorted'] or prefix + 'day' not in npz.files:
+        return 0, meta['length']
+    days = npz[prefix + 'day']
+    first = npz[prefix + 'day_start']
+    bounds = np.append(first, meta['length'])
+    lo, hi = 0, len(days)
+    if start is not None:
+        lo = np.searchsorted(days, start // _SECONDS_PER_DAY, side='left')
+    if end is not None:
+        hi = np.searchsorted(days, end // _SECONDS_PER_DAY, side='right')
+    return int(bounds[lo]), int(bounds[max(hi, lo)])
+
+
+def _to_seconds(value):
+    if value is None:
+        return None
+    return int(pd.Timestamp(value).to_datetime64().astype('datetime64[s]').astype(np.int64))
+
+
+def read_streams(
+    path: str,
+    streams: Optional[Iterable[str]] = None,
+    start_time: Optional[Any] = None,
+    end_time: Optional[Any] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Read streams of a binary DIAX file as typed columns.
+
+    Parameters
+    ----------
+    path : str
+        File written by ``write_binary``.
+    streams : iterable of str, optional
+        Streams to read (default: all stored as arrays).
+    start_time, end_time : str or datetime-like, optional
+        Inclusive bounds on the local wall-clock time. The per-day index
+        limits the rows that are decoded.
+
+    Returns
+    -------
+    dict of DataFrame
+        Per stream, columns 'time' (datetime64[s], local wall clock),
+        'value' and, if the stream has zone suffixes, 'zone'.
+    """
+    start, end = _to_seconds(start_time), _to_seconds(end_time)
+    frames = {}
+    with np.load(path, allow_pickle=False) as npz:
+        header = _read_header(npz)
+        for key, meta in header['streams'].items():
+            if streams is not None and key not in streams:
+                continue
+            lo, hi = _row_range(npz, meta, start, end)
+            seconds = _stream_seconds(npz, meta)[lo:hi]
+            frame = pd.DataFrame({
+                'time': seconds.astype('datetime64[s]'),
+                'value': npz[f"s{meta['index']}_value"][lo:hi],
+            })
+            if any(meta['zones']):
+                frame['zone'] = pd.Categorical.from_codes(
+                    _stream_codes(npz, meta)[lo:hi], categories=meta['zones']
+                )
+            mask = np.ones(len(frame), dtype=bool)
+            if start is not None:
+                mask &= seconds >= start
+            if end is not None:
+                mask &= seconds <= end
+            frames[key] = frame[mask].reset_index(drop=True)
+    return frames
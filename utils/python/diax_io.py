@@ -0,0 +1,205 @@
+import gzip
+import io
+import json
+import os
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .diax_binary import load_binary, write_binary
+except ImportError:  # imported as a top-level module
+    from diax_binary import load_binary, write_binary
+
+
+FORMATS = ('json', 'json.gz', 'json.zst', 'diax')
+
+# Lists longer than this are encoded and written in slices of this many items
+CHUNK = 65536
+
+# default=str keeps what converters relied on with json.dump (Timestamps,
+# numpy ints and float32 written as strings). JSONEncoder.encode uses the C
+# encoder when indent is None; json.dump with any indent never does.
+_ENCODER = json.JSONEncoder(default=str, separators=(',', ':'))
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("Reading or writing .json.zst files requires the 'zstandard' package.") from e
+    return zstandard
+
+
+def _is_binary(path):
+    return os.fspath(path).endswith('.diax')
+
+
+def _compression(path):
+    path = os.fspath(path)
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def _open_text(path, mode, level=None):
+    """Open a (possibly compressed) DIAX file in text mode, by suffix."""
+    compression = _compression(path)
+    if compression is None:
+        return open(path, mode, encoding='utf-8')
+
+    if compression == 'gzip':
+        # mtime=0 so identical data gives identical files
+        stream = gzip.GzipFile(path, mode + 'b', compresslevel=6 if level is None else level, mtime=0)
+    else:
+        zstandard = _zstd()
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def _write_value(value, fh):
+    if isinstance(value, (np.ndarray, pd.Series, pd.Index)):
+        value = value.tolist()
+
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        fh.write('{')
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                fh.write(',')
+            fh.write(_ENCODER.encode(key))
+            fh.write(':')
+            _write_value(item, fh)
+        fh.write('}')
+    elif isinstance(value, (list, tuple)) and len(value) > CHUNK:
+        fh.write('[')
+        for start in range(0, len(value), CHUNK):
+            if start:
+                fh.write(',')
+            fh.write(_ENCODER.encode(value[start:start + CHUNK])[1:-1])
+        fh.write(']')
+    else:
+        fh.write(_ENCODER.encode(value))
+
+
+def write_diax(diax_data: Dict[str, Any], path: str, level: Optional[int] = None) -> str:
+    """
+    Write a DIAX subject as compact JSON, compressed according to the suffix.
+
+    Parameters
+    ----------
+    diax_data : dict
+        DIAX output of a converter. Arrays may be lists, numpy arrays or
+        Series; values that are not JSON types are written with ``str``.
+    path : str
+        Output file. ``.json.gz`` is gzip-compressed, ``.json.zst``
+        zstd-compressed (needs ``zstandard``) and ``.diax`` the columnar
+        binary format (see ``diax_binary``); anything else is plain JSON.
+    level : int, optional
+        Compression level (default 6 for gzip, 3 for zstd), unused for
+        ``.diax``.
+
+    Returns
+    -------
+    str
+        ``path``.
+
+    Notes
+    -----
+    Long arrays are encoded in slices and streamed to the file, so the
+    whole document is never held as one string.
+    """
+    if _is_binary(path):
+        return write_binary(diax_data, path)
+    with _open_text(path, 'w', level) as fh:
+        _write_value(diax_data, fh)
+    return path
+
+
+def load_diax(path: str) -> Dict[str, Any]:
+    """
+    Load a DIAX file: plain, ``.json.gz`` or ``.json.zst`` JSON, or ``.diax`` binary.
+
+    Parameters
+    ----------
+    path : str
+        File written by a converter (indented or compact JSON, or binary).
+
+    Returns
+    -------
+    dict
+        Parsed DIAX data.
+    """
+    if _is_binary(path):
+        return load_binary(path)
+    with _open_text(path, 'r') as fh:
+        return json.load(fh)
+
+
+def diax_suffix(fmt: str) -> str:
+    """File suffix of an output format from ``FORMATS``."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown DIAX format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    return '.' + fmt
+
+
+def _strip_suffix(name):
+    for fmt in sorted(FORMATS, key=len, reverse=True):
+        if name.endswith('.' + fmt):
+            return name[:-len(fmt) - 1]
+    return None
+
+
+def convert_file(src: str, dst: str) -> str:
+    """Convert a DIAX file between formats (by suffix); the data is unchanged."""
+    return write_diax(load_diax(src), dst)
+
+
+def convert_files(inputs: Iterable[str], fmt: str, output_dir: Optional[str] = None) -> int:
+    """
+    Convert DIAX files, or every DIAX file in the given directories, to ``fmt``.
+
+    Each output keeps its stem (``subj_1.json`` -> ``subj_1.diax``) and is
+    written next to its input unless ``output_dir`` is given. Returns the
+    number of files converted.
+    """
+    suffix = diax_suffix(fmt)
+    sources = []
+    for path in inputs:
+        if os.path.isdir(path):
+            sources += sorted(
+                os.path.join(path, name) for name in os.listdir(path) if _strip_suffix(name) is not None
+            )
+        else:
+            sources.append(path)
+
+    count = 0
+    for src in sources:
+        stem = _strip_suffix(os.path.basename(src))
+        if stem is None or src.endswith(suffix):
+            continue
+        dst = os.path.join(output_dir or os.path.dirname(src), stem + suffix)
+        convert_file(src, dst)
+        count += 1
+    return count
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert DIAX files between JSON, compressed JSON and binary.')
+    parser.add_argument('inputs', nargs='+', help='DIAX files or directories containing them.')
+    parser.add_argument('--to', required=True, choices=FORMATS, help='Target format.')
+    parser.add_argument('--output', default=None, help='Output directory (default: next to each input).')
+    args = parser.parse_args()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    count = convert_files(args.inputs, args.to, args.output)
+    print(f'Converted {count} files.')
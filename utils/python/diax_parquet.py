@@ -0,0 +1,231 @@
+import os
+import re
+import uuid
+from typing import Any, Dict, Iterable, Optional, Union
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('study', pa.string()), ('subject', pa.string())]), flavor='hive'
+)
+
+RAW_SCHEMA = pa.schema([
+    ('stream', pa.dictionary(pa.int8(), pa.string())),
+    ('time', pa.int64()),          # local wall-clock time, ns since epoch
+    ('utc_offset', pa.int16()),    # minutes east of UTC, null when unknown
+    ('value', pa.float32()),
+    ('text', pa.string()),         # value of non-numeric streams (e.g. carb_category)
+])
+
+_OFFSET = re.compile(r'^(?:UTC)?(?:([+-])(\d{2}):?(\d{2}))?$')
+
+
+def _parse_times(times):
+    """
+    Split DIAX time strings into wall-clock ns and UTC offset minutes.
+
+    DIAX times are 'Y-m-d H:M:S' optionally followed by a zone suffix such as
+    '-0400' or 'UTC-04:00'. The suffix is parsed once per distinct value.
+
+    Raises
+    ------
+    ValueError
+        If any time does not parse, rather than storing a sentinel timestamp.
+    """
+    times = pd.Series(times, dtype='string')
+    wall = pd.to_datetime(times.str.slice(0, 19), format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    suffix = times.str.slice(19).str.strip().fillna('')
+    codes, uniques = pd.factorize(suffix)
+    offsets = []
+    for s in uniques:
+        m = _OFFSET.match(s)
+        if not s:
+            offsets.append(np.nan)
+        elif m is None:
+            offsets.append(np.inf)  # unknown suffix, reported below
+        elif m.group(1) is None:
+            offsets.append(0)
+        else:
+            sign = -1 if m.group(1) == '-' else 1
+            offsets.append(sign * (int(m.group(2)) * 60 + int(m.group(3))))
+    offsets = np.asarray(offsets, dtype=float)[codes] if len(uniques) else np.full(len(times), np.nan)
+
+    bad = (wall.isna() | np.isinf(offsets)).to_numpy()
+    if bad.any():
+        raise ValueError(
+            f'{int(bad.sum())} of {len(times)} times are not DIAX timestamps, e.g. {times[bad].iloc[0]!r}'
+        )
+    return wall.to_numpy(dtype='datetime64[ns]').view(np.int64), offsets
+
+
+def _wall_clock(index):
+    """Wall-clock ns and UTC offset minutes (None for naive times) of a DatetimeIndex."""
+    index = pd.DatetimeIndex(index)
+    if index.tz is None:
+        return index.as_unit('ns').asi8, pd.array([None] * len(index), dtype='Int16')
+    wall = index.tz_localize(None).as_unit('ns').asi8
+    utc = index.tz_convert('UTC').tz_localize(None).as_unit('ns').asi8
+    return wall, pd.array((wall - utc) // 60_000_000_000, dtype='Int16')
+
+
+def _partition_path(root, kind, study, subject):
+    return os.path.join(
+        root, kind, f"study={quote(str(study), safe='')}", f"subject={quote(str(subject), safe='')}"
+    )
+
+
+def _write_partition(table, path):
+    """Replace a subject partition atomically; other subjects are never touched."""
+    os.makedirs(path, exist_ok=True)
+    tmp = os.path.join(path, f".tmp-{uuid.uuid4().hex}.parquet")
+    pq.write_table(table, tmp)
+    os.replace(tmp, os.path.join(path, "part-0.parquet"))
+
+
+def export_raw(diax_data: Dict[str, Any], root: str, study: str, subject: Optional[str] = None) -> str:
+    """
+    Export the raw per-stream data of one DIAX subject to a Parquet dataset.
+
+    Parameters
+    ----------
+    diax_data : dict
+        Loaded DIAX JSON.
+    root : str
+        Dataset root. The subject is written to
+        root/raw/study=<study>/subject=<subject>/part-0.parquet.
+    study : str
+        Study name used for partitioning.
+    subject : str, optional
+        Subject id. Defaults to the `unique_id` of `diax_data`.
+
+    Returns
+    -------
+    str
+        The partition directory that was written.
+
+    Raises
+    ------
+    ValueError
+        If a stream holds a time that is not a DIAX timestamp.
+    """
+    if subject is None:
+        subject = diax_data.get('unique_id', 'unknown')
+
+    frames = []
+    for key, stream in diax_data.items():
+        if key == 'metadata' or not isinstance(stream, dict) or 'time' not in stream:
+            continue
+        times, values = stream['time'], stream['value']
+        if not isinstance(times, list):
+            times, values = [times], [values]
+        if not times:
+            continue
+        time_ns, offset = _parse_times([str(t) for t in times])
+        numeric = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+        is_text = numeric.isna() & pd.Series(values, dtype=object).map(lambda v: isinstance(v, str))
+        frames.append(pd.DataFrame({
+            'stream': key,
+            'time': time_ns,
+            'utc_offset': pd.array(offset, dtype='Int16'),
+            'value': numeric.to_numpy(dtype=np.float32),
+            'text': pd.Series(values, dtype=object).where(is_text, None).astype('string'),
+        }))
+
+    df = pd.concat(frames, ignore_index=True) if frames else RAW_SCHEMA.empty_table().to_pandas()
+    df = df.sort_values(['stream', 'time'], kind='stable')
+    table = pa.Table.from_pandas(df, schema=RAW_SCHEMA, preserve_index=False)
+    path = _partition_path(root, 'raw', study, subject)
+    _write_partition(table, path)
+    return path
+
+
+def export_aligned(aligned: pd.DataFrame, root: str, study: str, subject: str) -> str:
+    """
+    Export a `time_align` result to root/aligned/study=<study>/subject=<subject>.
+
+    As in `export_raw`, 'time' is the local wall-clock time as int64 ns and
+    'utc_offset' its offset in minutes east of UTC (null for naive times),
+    so the same `read_parquet` time bounds select the same local times in
+    raw and aligned datasets. Every other column is stored as float32.
+    """
+    time_ns, offset = _wall_clock(aligned.index)
+    columns = {'time': pa.array(time_ns, type=pa.int64()), 'utc_offset': pa.array(offset, type=pa.int16())}
+    for col in aligned.columns:
+        columns[col] = pa.array(pd.to_numeric(aligned[col], errors='coerce').to_numpy(dtype=np.float32))
+    path = _partition_path(root, 'aligned', study, subject)
+    _write_partition(pa.table(columns), path)
+    return path
+
+
+def _to_ns(t):
+    return pd.Timestamp(t).as_unit('ns').value
+
+
+def read_parquet(
+                root: str,
+                kind: str = 'raw',
+                columns: Optional[Iterable[str]] = None,
+                studies: Optional[Iterable[str]] = None,
+                subjects: Optional[Iterable[Union[str, int]]] = None,
+                streams: Optional[Iterable[str]] = None,
+                start_time: Optional[Union[str, pd.Timestamp]] = None,
+                end_time: Optional[Union[str, pd.Timestamp]] = None,
+            ) -> pd.DataFrame:
+    """
+    Load selected columns and time ranges from an exported dataset.
+
+    Study/subject filters prune partition directories, and time/stream filters
+    are pushed into the Parquet scan so row groups outside them are skipped.
+
+    Parameters
+    ----------
+    root : str
+        Dataset root passed to `export_raw`/`export_aligned`.
+    kind : str
+        'raw' or 'aligned'.
+    columns : iterable of str, optional
+        Columns to load (partition columns 'study'/'subject' included).
+        All columns by default.
+    studies, subjects : iterable, optional
+        Partitions to load.
+    streams : iterable of str, optional
+        Raw streams to load (only for kind='raw').
+    start_time, end_time : str or Timestamp, optional
+        Inclusive wall-clock time bounds.
+
+    Returns
+    -------
+    DataFrame
+        With 'time' converted back to datetime64[ns].
+    """
+    path = os.path.join(root, kind)
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+    # subjects may carry different aligned columns; unify from the file footers
+    schema = pa.unify_schemas([f.physical_schema for f in dataset.get_fragments()] + [PARTITIONING.schema])
+    dataset = ds.dataset(path, schema=schema, format='parquet', partitioning=PARTITIONING)
+
+    expr = None
+    conditions = []
+    if studies is not None:
+        conditions.append(ds.field('study').isin([str(s) for s in studies]))
+    if subjects is not None:
+        conditions.append(ds.field('subject').isin([str(s) for s in subjects]))
+    if streams is not None:
+        conditions.append(ds.field('stream').isin(list(streams)))
+    if start_time is not None:
+        conditions.append(ds.field('time') >= _to_ns(start_time))
+    if end_time is not None:
+        conditions.append(ds.field('time') <= _to_ns(end_time))
+    for cond in conditions:
+        expr = cond if expr is None else expr & cond
+
+    df = dataset.to_table(columns=None if columns is None else list(columns), filter=expr).to_pandas()
+    if 'time' in df:
+        df['time'] = df['time'].astype('datetime64[ns]')
+    return df
@@ -0,0 +1,313 @@
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .diax_io import _strip_suffix, load_diax
+except ImportError:  # imported as a top-level module
+    from diax_io import _strip_suffix, load_diax
+
+
+# Plausible values per stream in the units of the README key definitions;
+# values outside are counted, not rejected
+RANGES = {
+    'cgm': (20.0, 600.0),           # mg/dL
+    'smbg': (10.0, 1000.0),         # mg/dL
+    'basal_rate': (0.0, 50.0),      # U/h
+    'basal_inj': (0.0, 300.0),      # U
+    'bolus': (0.0, 100.0),          # U
+    'carbs': (0.0, 1000.0),         # g
+    'hba1c': (3.0, 20.0),           # %
+    'heart_rate': (20.0, 250.0),    # beats per minute
+    'steps': (0.0, 100.0),          # steps per ten seconds
+    'height': (30.0, 250.0),        # cm
+    'weight': (2.0, 350.0),         # kg
+}
+
+# Units of the README key definitions, with the spellings converters write;
+# a stream whose metadata names another unit is an error, since RANGES and
+# every reader assume these
+UNITS = {
+    'cgm': {'mg/dL'},
+    'smbg': {'mg/dL'},
+    'basal_rate': {'U/h', 'U/hr'},
+    'basal_inj': {'U'},
+    'bolus': {'U'},
+    'carbs': {'g', 'grams'},
+    'hba1c': {'%'},
+    'heart_rate': {'bpm', 'bps', 'beats/min'},
+    'steps': {'steps per ten seconds', 'steps per 10 seconds'},
+    'height': {'cm'},
+    'weight': {'kg'},
+}
+
+# Streams where a negative value is an error rather than an outlier
+NON_NEGATIVE = set(RANGES)
+
+# Zone suffixes written by the converters: ' -0400', ' UTC-04:00', ' UTC'
+_ZONE = re.compile(r'^ (?:[+-]\d{4}|UTC(?:[+-]\d{2}:\d{2})?)$')
+
+
+def _issue(issues, level, check, stream=None, count=None, detail=None):
+    issue = {'level': level, 'check': check}
+    if stream is not None:
+        issue['stream'] = stream
+    if count is not None:
+        issue['count'] = int(count)
+    if detail is not None:
+        issue['detail'] = detail
+    issues.append(issue)
+
+
+def _parse_times(times):
+    """
+    Wall-clock datetime64[s] of DIAX time strings (NaT where unparseable) and their distinct zone suffixes.
+
+    Well-formed lists are parsed by numpy directly; anything else falls back
+    to pandas, which coerces the strings it cannot parse.
+    """
+    text = np.asarray(times, dtype=str)
+    width = text.dtype.itemsize // 4
+    if width >= 19 and len(text):
+        chars = text.view('U1').reshape(len(text), width)
+        # every string at least 'Y-m-d H:M:S' long (numpy pads with NUL), with a space separator
+        if (chars[:, 18] != '').all() and (chars[:, 10] == ' ').all():
+            if width == 19:
+                wall, zones = times, ['']
+            else:
+                wall = chars[:, :19].copy().view('U19').ravel().tolist()
+                zones = pd.unique(chars[:, 19:].copy().view(f'U{width - 19}').ravel()).tolist()
+            try:
+                return np.array(wall, dtype='datetime64[s]'), sorted(zones)
+            except ValueError:
+                pass
+    text = pd.Series(text, dtype=object)
+    wall = pd.to_datetime(text.str.slice(0, 19), format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    return wall.to_numpy(dtype='datetime64[s]'), sorted(text.str.slice(19).unique().tolist())
+
+
+def _check_times(key, times, stats, issues):
+    """Parse a time list once and count unparseable, unsorted and duplicate times, and zone formats."""
+    if not set(map(type, times)) <= {str}:
+        _issue(issues, 'error', 'time_type', key, sum(not isinstance(t, str) for t in times))
+        times = [str(t) for t in times]
+    ticks, stats['zones'] = _parse_times(times)
+    bad = np.isnat(ticks)
+    if bad.any():
+        _issue(issues, 'error', 'time_format', key, bad.sum(), times[int(np.argmax(bad))])
+
+    unknown = [zone for zone in stats['zones'] if zone and not _ZONE.match(zone)]
+    if unknown:
+        _issue(issues, 'error', 'time_zone_format', key, len(unknown), unknown[0])
+    styles = {'none' if not zone else 'utc' if zone.startswith(' UTC') else 'offset' for zone in stats['zones']}
+    if len(styles) > 1:
+        _issue(issues, 'warning', 'mixed_time_zones', key, len(styles), ', '.join(sorted(styles)))
+
+    valid = ticks[~bad]
+    steps = np.diff(valid.view(np.int64))
+    stats['unsorted'] = int((steps < 0).sum())
+    stats['duplicate_times'] = int((steps == 0).sum())
+    if stats['unsorted']:
+        _issue(issues, 'error', 'unsorted_times', key, stats['unsorted'])
+    if len(valid):
+        stats['start'], stats['end'] = np.datetime_as_string(np.array([valid.min(), valid.max()])).tolist()
+
+
+def _check_values(key, values, stats, issues):
+    """Count missing, negative and implausible values of a numeric stream."""
+    if any(isinstance(v, str) for v in values):
+        stats['dtype'] = 'text'
+        return
+    try:
+        array = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        _issue(issues, 'error', 'value_type', key)
+        return
+    stats['dtype'] = 'numeric'
+    nan = np.isnan(array)
+    stats['nan'] = int(nan.sum())
+    if stats['nan']:
+        _issue(issues, 'warning', 'missing_values', key, stats['nan'])
+    finite = array[~nan]
+    stats['negative'] = int((finite < 0).sum())
+    if stats['negative'] and key in NON_NEGATIVE:
+        _issue(issues, 'error', 'negative_values', key, stats['negative'])
+    if key in RANGES:
+        low, high = RANGES[key]
+        stats['out_of_range'] = int(((finite < low) | (finite > high)).sum())
+        if stats['out_of_range']:
+            _issue(issues, 'warning', 'out_of_range', key, stats['out_of_range'], f'expected {low:g} to {high:g}')
+    if len(finite):
+        stats['min'], stats['max'] = float(finite.min()), float(finite.max())
+
+
+def _check_stream(key, item, issues):
+    """Shape and statistics of one ``{'time': ..., 'value': ...}`` entry."""
+    times, values = item['time'], item['value']
+    if not isinstance(times, list) and not isinstance(values, list):
+        stats = {'shape': 'scalar'}
+        _check_values(key, [values], stats, issues)
+        return stats
+    if not isinstance(times, list) or not isinstance(values, list):
+        _issue(issues, 'error', 'scalar_list_mismatch', key)
+        return {'shape': 'mixed'}
+
+    stats = {'shape': 'list', 'length': len(values)}
+    if len(times) != len(values):
+        _issue(issues, 'error', 'length_mismatch', key, abs(len(times) - len(values)),
+               f'{len(times)} times, {len(values)} values')
+    if times:
+        _check_times(key, times, stats, issues)
+        _check_values(key, values, stats, issues)
+    return stats
+
+
+def validate_file(path: str) -> Dict[str, Any]:
+    """
+    Validate one DIAX file.
+
+    Every ``{'time': ..., 'value': ...}`` entry is checked with vectorized
+    operations on its arrays: equal lengths, parseable and sorted times,
+    one zone style per stream, the metadata unit (``UNITS``), and missing,
+    negative and implausible values (``RANGES``).
+
+    Parameters
+    ----------
+    path : str
+        DIAX file in any of the ``diax_io`` formats.
+
+    Returns
+    -------
+    dict
+        ``file``, ``ok`` (no errors), ``issues`` (dicts with ``level``,
+        ``check`` and, where they apply, ``stream``, ``count`` and
+        ``detail``) and per-stream ``streams`` statistics.
+    """
+    issues: List[Dict[str, Any]] = []
+    streams = {}
+    try:
+        data = load_diax(path)
+    except Exception as e:  # report unreadable files instead of aborting the run
+        _issue(issues, 'error', 'unreadable', detail=f'{type(e).__name__}: {e}')
+        return {'file': path, 'ok': False, 'issues': issues, 'streams': streams}
+
+    if not isinstance(data, dict):
+        _issue(issues, 'error', 'not_an_object')
+        return {'file': path, 'ok': False, 'issues': issues, 'streams': streams}
+    if 'unique_id' not in data:
+        _issue(issues, 'error', 'missing_unique_id')
+    metadata = data.get('metadata')
+    if not isinstance(metadata, dict):
+        _issue(issues, 'warning', 'missing_metadata')
+        metadata = {}
+
+    for key, item in data.items():
+        if key == 'metadata' or not isinstance(item, dict):
+            continue
+        if not {'time', 'value'} <= set(item):
+            # e.g. {'date': [...], 'value': [...]}, which readers cannot place in time
+            _issue(issues, 'error', 'missing_time_or_value', key, detail='keys: ' + ', '.join(map(str, item)))
+            streams[key] = {'shape': 'other'}
+            continue
+        streams[key] = _check_stream(key, item, issues)
+        if key not in metadata:
+            _issue(issues, 'warning', 'missing_stream_metadata', key)
+        elif key in UNITS and isinstance(metadata[key], dict) and 'unit' in metadata[key]:
+            if metadata[key]['unit'] not in UNITS[key]:
+                _issue(issues, 'error', 'unit', key,
+                       detail=f"{metadata[key]['unit']!r}, expected {' or '.join(sorted(UNITS[key]))}")
+
+    ok = not any(issue['level'] == 'error' for issue in issues)
+    return {'file': path, 'ok': ok, 'issues': issues, 'streams': streams}
+
+
+def find_files(inputs: Iterable[str]) -> List[str]:
+    """DIAX files given directly or found under the given directories (hidden entries skipped)."""
+    files = []
+    for path in inputs:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            files += [
+                os.path.join(root, name)
+                for name in sorted(names)
+                if not name.startswith('.') and _strip_suffix(name) is not None
+            ]
+    return files
+
+
+def validate(inputs: Iterable[str], jobs: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Validate DIAX files, or every DIAX file under the given directories.
+
+    Files are checked in a pool of ``jobs`` processes (default: all CPUs),
+    each reading and checking whole files, so the run is bound by reading
+    and parsing rather than by the checks.
+
+    Parameters
+    ----------
+    inputs : iterable of str
+        DIAX files or directories (searched recursively).
+    jobs : int, optional
+        Worker processes; 1 validates in this process.
+
+    Returns
+    -------
+    dict
+        Machine-readable report: ``files``, ``valid``, ``errors`` and
+        ``warnings`` counts, ``inconsistent_shapes`` (streams stored as
+        scalars in some files and as lists in others, with the files of
+        each shape) and the ``validate_file`` result of every file.
+    """
+    files = find_files(inputs)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(files) or 1))
+    if jobs == 1:
+        results = [validate_file(path) for path in files]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(validate_file, files, chunksize=max(1, len(files) // (jobs * 8))))
+
+    shapes: Dict[str, Dict[str, List[str]]] = {}
+    for result in results:
+        for key, stats in result['streams'].items():
+            shapes.setdefault(key, {}).setdefault(stats['shape'], []).append(result['file'])
+    inconsistent = {key: by_shape for key, by_shape in shapes.items() if len(by_shape) > 1}
+
+    levels = [issue['level'] for result in results for issue in result['issues']]
+    return {
+        'files': len(results),
+        'valid': sum(result['ok'] for result in results),
+        'errors': levels.count('error'),
+        'warnings': levels.count('warning') + len(inconsistent),
+        'inconsistent_shapes': inconsistent,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Validate DIAX converter output.')
+    parser.add_argument('inputs', nargs='+', help='DIAX files or directories containing them.')
+    parser.add_argument('--jobs', type=int, default=None, help='Worker processes (default: all CPUs).')
+    parser.add_argument('--report', default=None, help='Write the JSON report to this file (default: stdout).')
+    args = parser.parse_args()
+
+    report = validate(args.inputs, args.jobs)
+    if args.report:
+        with open(args.report, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    print(f"{report['valid']} of {report['files']} files valid, "
+          f"{report['errors']} errors, {report['warnings']} warnings.", file=sys.stderr)
+    sys.exit(1 if report['errors'] else 0)
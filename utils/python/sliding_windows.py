@@ -0,0 +1,185 @@
+import multiprocessing
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Dataset used by pool workers; set once per worker by _init_worker so batches
+# only ship index arrays to the workers instead of the aligned data itself.
+_worker_dataset = None
+
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _worker_gather(indices):
+    return _worker_dataset.gather(indices)
+
+
+class SlidingWindowDataset:
+    """
+    (history, horizon) windows over the output of `time_align`.
+
+    The aligned frame is copied once into a contiguous float32 array; every
+    window is then a strided view into that array, so building the dataset
+    costs O(rows) memory regardless of the window length.
+
+    Parameters
+    ----------
+    aligned : DataFrame
+        Output of `time_align`, indexed by time.
+    history : int
+        Number of samples fed to the model.
+    horizon : int
+        Number of future target samples to predict.
+    features : iterable of str, optional
+        Input columns. Defaults to all columns of `aligned`.
+    target : str
+        Column predicted over the horizon. Default 'cgm'.
+    stride : int
+        Step in samples between consecutive window starts.
+    max_missing : int
+        Maximum number of missing `target` samples allowed over the whole
+        (history + horizon) window. Windows above it are skipped.
+    sampling_period : float, optional
+        Sampling period in minutes. Inferred from the index if omitted.
+
+    Notes
+    -----
+    `time_align` drops rows where every column is NaN, so the frame is first
+    re-expanded to a regular grid; re-inserted rows count as missing and
+    windows never silently span a hole in time.
+    """
+
+    def __init__(
+                self,
+                aligned: pd.DataFrame,
+                history: int,
+                horizon: int,
+                features: Optional[Iterable[str]] = None,
+                target: str = 'cgm',
+                stride: int = 1,
+                max_missing: int = 0,
+                sampling_period: Optional[float] = None,
+            ):
+        if history < 1 or horizon < 1 or stride < 1:
+            raise ValueError("history, horizon and stride must be positive")
+
+        if sampling_period is None:
+            steps = np.diff(aligned.index.values)
+            if len(steps) == 0:
+                raise ValueError("Cannot infer sampling period from fewer than two samples")
+            sampling_period = pd.Timedelta(steps[steps > np.timedelta64(0)].min()) / pd.Timedelta(minutes=1)
+        aligned = aligned.asfreq(f'{sampling_period}min')
+
+        self.features = list(aligned.columns) if features is None else list(features)
+        self.target = target
+        self.history = history
+        self.horizon = horizon
+        self.times = aligned.index
+
+        self._values = np.ascontiguousarray(aligned[self.features].to_numpy(dtype=np.float32))
+        self._target = np.ascontiguousarray(aligned[target].to_numpy(dtype=np.float32))
+
+        window = history + horizon
+        n_windows = max(len(aligned) - window + 1, 0)
+        self._build_views()
+
+        # missing target samples per window from a prefix sum, O(rows) total
+        missing = np.concatenate([[0], np.cumsum(np.isnan(self._target), dtype=np.int64)])
+        missing = missing[window:window + n_windows] - missing[:n_windows]
+        starts = np.arange(0, n_windows, stride)
+        self.starts = starts[missing[starts] <= max_missing]
+
+    def _build_views(self):
+        n_windows = max(len(self._target) - self.history - self.horizon + 1, 0)
+        rows, cols = self._values.strides
+        self._inputs = np.lib.stride_tricks.as_strided(
+            self._values, shape=(n_windows, self.history, len(self.features)),
+            strides=(rows, rows, cols), writeable=False)
+        step = self._target.strides[0]
+        self._targets = np.lib.stride_tricks.as_strided(
+            self._target[self.history:], shape=(n_windows, self.horizon),
+            strides=(step, step), writeable=False)
+
+    def __getstate__(self):
+        # pickling the strided views would materialize every window
+        state = self.__dict__.copy()
+        del state['_inputs'], state['_targets']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_views()
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the (history, horizon) views of the i-th valid window."""
+        start = self.starts[i]
+        return self._inputs[start], self._targets[start]
+
+    def gather(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray, pd.DatetimeIndex]:
+        """
+        Stack the windows at positions `indices` into a batch.
+
+        Returns inputs (batch, history, features), targets (batch, horizon)
+        and the time of the first history sample of each window. When the
+        selected windows are evenly spaced the batch is a view, otherwise
+        only the batch itself is copied.
+        """
+        starts = self.starts[indices]
+        if len(starts) > 1:
+            step = starts[1] - starts[0]
+            evenly_spaced = step > 0 and np.all(np.diff(starts) == step)
+        else:
+            step, evenly_spaced = 1, True
+        if len(starts) and evenly_spaced:
+            sel = slice(starts[0], starts[-1] + 1, step)
+        else:
+            sel = starts
+        return self._inputs[sel], self._targets[sel], self.times[starts]
+
+    def batches(
+                self,
+                batch_size: int = 256,
+                shuffle: bool = False,
+                seed: Optional[int] = None,
+                num_workers: int = 0,
+                drop_last: bool = False,
+            ) -> Iterator[Tuple[np.ndarray, np.ndarray, pd.DatetimeIndex]]:
+        """
+        Yield batches of windows, see `gather` for the batch layout.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of windows per batch.
+        shuffle : bool
+            Shuffle the window order (a permutation of indices, the data is
+            never reordered).
+        seed : int, optional
+            Seed for the shuffle.
+        num_workers : int
+            Number of worker processes assembling batches. 0 assembles them
+            in the calling process.
+        drop_last : bool
+            Drop the final incomplete batch.
+        """
+        order = np.arange(len(self))
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(order)
+        stop = len(order) - (len(order) % batch_size if drop_last else 0)
+        chunks = [order[i:i + batch_size] for i in range(0, stop, batch_size)]
+
+        if num_workers <= 0:
+            for chunk in chunks:
+                yield self.gather(chunk)
+            return
+
+        with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(self,)) as p:
+            yield from p.imap(_worker_gather, chunks)
@@ -1,9 +1,80 @@
 import pandas as pd
 import numpy as np
-import json
 import datetime
-from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
+try:
+    from .diax_io import load_diax
+except ImportError:  # imported as a top-level module
+    from diax_io import load_diax
+
+
+def gap_index(series: pd.Series) -> pd.DataFrame:
+    """
+    Locate every run of missing samples in a regularly sampled series.
+
+    Built from a single vectorized diff over the NaN mask, so every later
+    query (filling, coverage, window validity) scales with the number of
+    gaps rather than the number of samples.
+
+    Parameters
+    ----------
+    series : Series
+        Series on a regular DatetimeIndex (e.g. a resampled signal).
+
+    Returns
+    -------
+    DataFrame
+        One row per gap, in time order, with columns
+            start, end : first and last missing timestamp (inclusive)
+            samples : number of missing samples
+            first, stop : positional bounds in `series` (stop exclusive)
+    """
+    missing = series.isna().to_numpy().astype(np.int8)
+    edges = np.diff(np.concatenate([[0], missing, [0]]))
+    first = np.flatnonzero(edges == 1)
+    stop = np.flatnonzero(edges == -1)
+    return pd.DataFrame({
+        'start': series.index[first],
+        'end': series.index[stop - 1],
+        'samples': stop - first,
+        'first': first,
+        'stop': stop,
+    })
+
+
+def gap_mask(gaps: pd.DataFrame, n_samples: int, min_samples: int = 1) -> np.ndarray:
+    """Boolean mask of the samples covered by gaps of at least `min_samples`."""
+    long_gaps = gaps[gaps['samples'] >= min_samples]
+    marks = np.zeros(n_samples + 1, dtype=np.int64)
+    np.add.at(marks, long_gaps['first'].to_numpy(), 1)
+    np.add.at(marks, long_gaps['stop'].to_numpy(), -1)
+    return np.cumsum(marks[:-1]) > 0
+
+
+def coverage(gaps: pd.DataFrame, n_samples: int) -> float:
+    """Percentage of samples that are not in a gap (e.g. sensor wear)."""
+    if n_samples == 0:
+        return 0.0
+    return 100.0 * (1.0 - gaps['samples'].sum() / n_samples)
+
+
+def valid_windows(
+                gaps: pd.DataFrame,
+                window_start: Union[pd.DatetimeIndex, Iterable],
+                window_end: Union[pd.DatetimeIndex, Iterable],
+            ) -> np.ndarray:
+    """
+    For each [window_start, window_end] interval, True if no gap overlaps it.
+
+    Gaps are sorted and disjoint, so each window costs two binary searches.
+    """
+    starts = pd.DatetimeIndex(window_start).as_unit('ns').asi8
+    ends = pd.DatetimeIndex(window_end).as_unit('ns').asi8
+    gap_starts = pd.DatetimeIndex(gaps['start']).as_unit('ns').asi8
+    gap_ends = pd.DatetimeIndex(gaps['end']).as_unit('ns').asi8
+    overlapping = np.searchsorted(gap_starts, ends, side='right') - np.searchsorted(gap_ends, starts, side='left')
+    return overlapping <= 0
 
 
 def time_align(
@@ -15,14 +86,15 @@ def time_align(
                 resample_strategy: Optional[Dict[str, str]] = None,
                 missing_strategy: Optional[Union[str, Dict[str, Union[str, Callable]]]] = None,
                 missing_tolerance: Optional[Union[float, Dict[str, float]]] = None,
-            ) -> pd.DataFrame:
+                return_gaps: bool = False,
+            ) -> Union[pd.DataFrame, Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]]:
     """
     Align multiple diax-style time series onto a common time axis.
 
     Parameters
     ----------
     diax_data : dict or str
-        Dictionary of signals or path to a JSON file containing them.
+        Dictionary of signals or path to a DIAX JSON file (optionally .json.gz/.json.zst).
         Each signal must include 'time' and 'value'.
     sampling_period : float
         Output sampling period in minutes.
@@ -69,11 +141,18 @@ def time_align(
             heart_rate -> 15  
             steps -> None (infinity)
             default -> sampling_period * 3
+        Gaps longer than the tolerance are left entirely empty; shorter gaps
+        are filled entirely.
+    return_gaps : bool, optional
+        If True, also return the gap index of each signal (see `gap_index`),
+        computed after resampling and before filling.
     Returns
     -------
     DataFrame
         Indexed by the common DateTimeIndex at the given sampling period,
         containing aligned, resampled, and gap-filled signals.
+    dict of DataFrame
+        Only if `return_gaps`; the gap index of each signal.
 
     Notes
     -----
@@ -84,8 +163,7 @@ def time_align(
 
     # If a path was provided, load the JSON file
     if isinstance(diax_data, str):
-        with open(diax_data, "r") as fh:
-            diax_data = json.load(fh)
+        diax_data = load_diax(diax_data)
 
     if columns is None:
         time_keys = [col for col in diax_data.keys() if 'metadata' not in col and 'time' in diax_data[col]]
@@ -167,6 +245,7 @@ def time_align(
 
     # resample each time series to the common time axis
     combined_df = pd.DataFrame(index=common_time_index)
+    gaps = {}
 
     # now fill_missing according to strategy
     for col in time_keys:
@@ -206,35 +285,43 @@ def time_align(
 
         # Reindex to common time index
         resampled = resampled.reindex(common_time_index)
+        gaps[col] = gap_index(resampled[col])
 
         # now interpolate missing data according to missing_strategy
         if callable(missing_strategy_col):  # custom interpolation function
             combined_df[col] = missing_strategy_col(resampled[col], missing_tolerance, sampling_period)
         else:  # predefined strategies
             if missing_strategy_col == 'mean':
-                combined_df[col] = resampled[col].fillna(resampled[col].mean(), limit=missing_limit)
+                filled = resampled[col].fillna(resampled[col].mean())
             elif missing_strategy_col == 'ffill':
-                combined_df[col] = resampled[col].ffill(limit=missing_limit)
+                filled = resampled[col].ffill()
             elif missing_strategy_col == 'interpolate_inside':
-                combined_df[col] = resampled[col].interpolate(method='linear', limit_area='inside', limit=missing_limit)
+                filled = resampled[col].interpolate(method='linear', limit_area='inside')
             elif missing_strategy_col == 'interpolate':  # interpolate and zero-order-hold out-of-bounds
-                combined_df[col] = resampled[col].interpolate(method='linear', limit=missing_limit, limit_direction='both')
+                filled = resampled[col].interpolate(method='linear', limit_direction='both')
             elif 'fill' in missing_strategy_col:
                 fill_value = float(missing_strategy_col.replace('fill', ''))
-                combined_df[col] = resampled[col].fillna(fill_value, limit=missing_limit)
+                filled = resampled[col].fillna(fill_value)
             else:  # no interpolation or filling
-                combined_df[col] = resampled[col]
+                filled = resampled[col]
+
+            # gaps longer than the tolerance stay empty instead of being partially filled
+            if missing_limit is not None:
+                filled = filled.mask(gap_mask(gaps[col], len(filled), min_samples=missing_limit + 1))
+            combined_df[col] = filled
 
     # Drop rows where all columns are NaN
     combined_df.dropna(how='all', inplace=True)
     combined_df.index.name = 'time'
 
+    if return_gaps:
+        return combined_df, gaps
     return combined_df
 
 
 if __name__ == "__main__":
     # Example usage
-    diax_data = json.load(open('../../../diax/T1DEXI/T1Dexi_145.json', 'r'))
+    diax_data = load_diax('../../../diax/T1DEXI/T1Dexi_145.json')
 
     resample_strategy = {'cgm': 'mean', 'basal_rate': 'mean', 'basal_inj': 'sum', 'bolus': 'sum', 'heart_rate': 'mean', 'steps': 'sum', 'carbs': 'sum'}
     missing_strategy = {'cgm': 'interpolate', 'basal_rate': 'ffill', 'basal_inj': 'fill0', 'bolus': 'none', 'heart_rate': 'interpolate', 'steps': 'fill0', 'carbs': 'none'}
@@ -242,4 +329,6 @@ if __name__ == "__main__":
 
     df = time_align(diax_data, sampling_period=5, resample_strategy=resample_strategy, missing_strategy=missing_strategy, missing_tolerance=missing_tolerance)
     print(df.head(20))
-    df.to_csv('example_aligned_output.csv')
\ No newline at end of file
+
+    from diax_parquet import export_aligned
+    export_aligned(df, 'example_aligned_output', study='T1DEXI', subject=diax_data['unique_id'])
\ No newline at end of file